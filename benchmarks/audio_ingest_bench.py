@@ -0,0 +1,116 @@
+"""
+实时语音输入的编码开销微基准。
+
+对同一段麦克风PCM（按前端的帧大小切分）比较两种发送前处理的CPU开销：
+- 逐帧：每帧 base64 + 构造事件字典 + json.dumps（原 OmniRealtimeClient.stream_audio 的做法）
+- 分块：AudioChunker 合并为固定大小的块，AudioAppendEncoder 用消息模板编码
+
+报告每帧、每条消息、每秒音频的耗时与消息数，并校验两者发出的音频内容一致。
+
+用法（在项目根目录执行）：
+    python -m benchmarks.audio_ingest_bench
+    python -m benchmarks.audio_ingest_bench --frame-bytes 1024 --chunk-bytes 6400 --seconds 120 --json
+"""
+import argparse
+import base64
+import json
+import os
+import time
+
+from main_helper.audio_ingest import AudioChunker, AudioAppendEncoder
+
+SAMPLE_RATE = 16000
+BYTES_PER_SECOND = SAMPLE_RATE * 2
+
+
+def _frames(frame_bytes, seconds):
+    pcm = os.urandom(BYTES_PER_SECOND * seconds)
+    return [pcm[i:i + frame_bytes] for i in range(0, len(pcm), frame_bytes)]
+
+
+def run_per_frame(frames):
+    """原实现：每帧生成一条事件"""
+    messages = []
+    for frame in frames:
+        event = {"type": "input_audio_buffer.append", "audio": base64.b64encode(frame).decode()}
+        event['event_id'] = "event_" + str(int(time.time() * 1000))
+        messages.append(json.dumps(event))
+    return messages
+
+
+def run_chunked(frames, chunk_bytes):
+    """新实现：合并成块后按模板编码；编码结果需在下一次编码前取走，这里转成str模拟发送"""
+    chunker = AudioChunker(chunk_bytes)
+    encoder = AudioAppendEncoder(chunk_bytes)
+    messages = []
+    for frame in frames:
+        for chunk in chunker.feed(frame):
+            messages.append(str(encoder.encode(chunk), 'utf-8'))
+    if chunker.pending:
+        messages.append(str(encoder.encode(chunker.take_pending()), 'utf-8'))
+    return messages
+
+
+def _audio_of(messages):
+    return b"".join(base64.b64decode(json.loads(m)['audio']) for m in messages)
+
+
+def _time(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run(frame_bytes, chunk_bytes, seconds, repeat):
+    frames = _frames(frame_bytes, seconds)
+    report = {'frame_bytes': frame_bytes, 'chunk_bytes': chunk_bytes, 'audio_seconds': seconds, 'frames': len(frames)}
+    results = {}
+    for name, fn in (('per_frame', lambda: run_per_frame(frames)),
+                     ('chunked', lambda: run_chunked(frames, chunk_bytes))):
+        elapsed, messages = _time(fn, repeat)
+        results[name] = messages
+        report[name] = {
+            'messages': len(messages),
+            'us_per_frame': elapsed / len(frames) * 1e6,
+            'us_per_message': elapsed / len(messages) * 1e6,
+            'ms_per_audio_second': elapsed / seconds * 1e3,
+            'wire_bytes': sum(len(m) for m in messages),
+        }
+    if _audio_of(results['per_frame']) != _audio_of(results['chunked']):
+        raise RuntimeError("两种实现发出的音频内容不一致")
+    report['speedup'] = report['per_frame']['ms_per_audio_second'] / report['chunked']['ms_per_audio_second']
+    return report
+
+
+def print_report(report):
+    print(f"\n帧大小 {report['frame_bytes']} 字节，块大小 {report['chunk_bytes']} 字节，"
+          f"音频 {report['audio_seconds']} 秒（{report['frames']} 帧）")
+    print(f"\n{'实现':<12}{'消息数':>10}{'us/帧':>10}{'us/消息':>10}{'ms/音频秒':>12}{'发送字节':>12}")
+    for name in ('per_frame', 'chunked'):
+        stats = report[name]
+        print(f"{name:<12}{stats['messages']:>10}{stats['us_per_frame']:>10.2f}{stats['us_per_message']:>10.2f}"
+              f"{stats['ms_per_audio_second']:>12.3f}{stats['wire_bytes']:>12}")
+    print(f"\n每秒音频的编码开销降低为原来的 1/{report['speedup']:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='实时语音输入编码开销微基准')
+    parser.add_argument('--frame-bytes', type=int, default=1024, help='前端每帧的字节数（默认512个int16采样）')
+    parser.add_argument('--chunk-bytes', type=int, default=3200, help='合并后的块大小（字节）')
+    parser.add_argument('--seconds', type=int, default=60, help='模拟的音频时长（秒）')
+    parser.add_argument('--repeat', type=int, default=5, help='重复次数，取最快一次')
+    parser.add_argument('--json', action='store_true', help='以JSON输出结果')
+    args = parser.parse_args()
+    report = run(args.frame_bytes, args.chunk_bytes, args.seconds, args.repeat)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+CosyVoice 音频回调的缓冲开销微基准。
+
+模拟一段很长的合成语音（24kHz int16），按固定包大小依次交给回调，比较：
+- legacy：原 Callback.on_data 的做法，np.concatenate 追加到缓存，每个包只切出一个8000采样的块重采样
+- ring：FramedResampler，流式重采样后写入环形缓冲区，按固定帧长输出
+
+按语音进度把包分成若干段，报告每段的平均每包耗时；ring 的每包耗时应与语音长度无关。
+
+用法（在项目根目录执行）：
+    python -m benchmarks.cosyvoice_buffer_bench
+    python -m benchmarks.cosyvoice_buffer_bench --seconds 600 --packet-bytes 48000 --json
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import soxr
+
+from config import COSYVOICE_OUTPUT_FRAME_SAMPLES
+from utils.audio import FramedResampler
+
+IN_RATE = 24000
+
+
+class LegacyCallback:
+    """原实现（仅保留音频处理部分）"""
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.cache = np.zeros(0).astype(np.float32)
+
+    def on_data(self, data):
+        audio = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
+        self.cache = np.concatenate([self.cache, audio])
+        if len(self.cache) >= 8000:
+            data = self.cache[:8000]
+            data = (soxr.resample(data, 24000, 48000, quality='HQ') * 32768.).clip(-32768, 32767).astype(np.int16).tobytes()
+            self.sink(data)
+            self.cache = self.cache[8000:]
+
+    def on_complete(self):
+        if len(self.cache) > 0:
+            data = (soxr.resample(self.cache, 24000, 48000, quality='HQ') * 32768.).clip(-32768, 32767).astype(np.int16).tobytes()
+            self.sink(data)
+            self.cache = np.zeros(0).astype(np.float32)
+
+
+class RingCallback:
+    def __init__(self, sink, frame_samples):
+        self.sink = sink
+        self.frames = FramedResampler(frame_samples)
+
+    def on_data(self, data):
+        for frame in self.frames.feed(data, 'bench'):
+            self.sink(frame)
+
+    def on_complete(self):
+        for frame in self.frames.finish():
+            self.sink(frame)
+
+
+def _packets(seconds, packet_bytes):
+    t = np.arange(IN_RATE * seconds) / IN_RATE
+    pcm = (np.sin(2 * np.pi * 220 * t) * 8000).astype(np.int16).tobytes()
+    return [pcm[i:i + packet_bytes] for i in range(0, len(pcm), packet_bytes)]
+
+
+def run_callback(callback_cls, packets, segments, **kwargs):
+    out = []
+    callback = callback_cls(out.append, **kwargs)
+    costs = []
+    for packet in packets:
+        start = time.perf_counter()
+        callback.on_data(packet)
+        costs.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    callback.on_complete()
+    complete = time.perf_counter() - start
+    per_segment = [float(np.mean(part)) * 1e6 for part in np.array_split(np.array(costs), segments) if len(part)]
+    return {
+        'us_per_packet_by_segment': per_segment,
+        'us_per_packet': float(np.mean(costs)) * 1e6,
+        'last_over_first': per_segment[-1] / per_segment[0],
+        'complete_ms': complete * 1e3,
+        'output_messages': len(out),
+        'output_samples': sum(len(b) for b in out) // 2,
+    }
+
+
+def run(seconds, packet_bytes, segments, frame_samples):
+    packets = _packets(seconds, packet_bytes)
+    return {
+        'audio_seconds': seconds,
+        'packet_bytes': packet_bytes,
+        'packets': len(packets),
+        'frame_samples': frame_samples,
+        'legacy': run_callback(LegacyCallback, packets, segments),
+        'ring': run_callback(RingCallback, packets, segments, frame_samples=frame_samples),
+    }
+
+
+def print_report(report):
+    print(f"\n音频 {report['audio_seconds']} 秒，每包 {report['packet_bytes']} 字节（共 {report['packets']} 包），"
+          f"输出帧长 {report['frame_samples']} 采样")
+    for name in ('legacy', 'ring'):
+        stats = report[name]
+        segments = " ".join(f"{v:.0f}" for v in stats['us_per_packet_by_segment'])
+        print(f"\n{name}: 平均每包 {stats['us_per_packet']:.1f}us，末段/首段 {stats['last_over_first']:.2f}，"
+              f"on_complete {stats['complete_ms']:.1f}ms，输出 {stats['output_messages']} 条 / {stats['output_samples']} 采样")
+        print(f"  各段每包耗时(us)：{segments}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CosyVoice 音频回调缓冲开销微基准')
+    parser.add_argument('--seconds', type=int, default=300, help='模拟的合成语音时长（秒）')
+    parser.add_argument('--packet-bytes', type=int, default=24000, help='每个音频包的字节数（24kHz int16）')
+    parser.add_argument('--segments', type=int, default=10, help='按语音进度划分的段数')
+    parser.add_argument('--frame-samples', type=int, default=COSYVOICE_OUTPUT_FRAME_SAMPLES, help='输出帧长（48kHz采样数）')
+    parser.add_argument('--json', action='store_true', help='以JSON输出结果')
+    args = parser.parse_args()
+    report = run(args.seconds, args.packet_bytes, args.segments, args.frame_samples)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
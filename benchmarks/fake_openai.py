@@ -0,0 +1,167 @@
+"""
+本地的 OpenAI 兼容假服务，供压测使用，不产生任何真实API调用。
+
+- /v1/chat/completions：按提示词类型返回摘要、记忆整理、精排、设定提取的合法JSON，
+  响应时间 = 固定延迟 + 输出token数 / 生成速率
+- /v1/embeddings：返回确定性的伪向量
+- /stats：按请求类型统计调用次数与token数
+
+单独运行：python -m benchmarks.fake_openai --port 48990 --latency 0.3 --token-rate 80
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from collections import Counter
+
+import uvicorn
+from fastapi import FastAPI, Request
+
+
+def _prompt_text(body):
+    parts = []
+    for message in body.get('messages', []):
+        content = message.get('content', '')
+        if isinstance(content, list):
+            content = "\n".join(item.get('text', '') for item in content if isinstance(item, dict))
+        parts.append(str(content))
+    return "\n".join(parts)
+
+
+def _estimate_tokens(text):
+    return max(1, len(text) // 2)
+
+
+def _review_reply(prompt):
+    """原样返回待整理的对话，保证压测期间历史记录不被改写"""
+    match = re.search(r'======以下为对话历史======\n(.*)\n======以上为对话历史======', prompt, re.S)
+    corrected = []
+    for block in (match.group(1).strip().split("\n\n") if match else []):
+        role, _, content = block.partition(": ")
+        if content:
+            corrected.append({"role": role, "content": content})
+    return {"修正说明": "无", "修正后的对话": corrected}
+
+
+def _reply_for(prompt):
+    if '修正后的对话' in prompt:
+        return 'review', _review_reply(prompt)
+    if '精筛' in prompt:
+        return 'rerank', [1, 2, 3]
+    if '重要个人信息' in prompt:
+        return 'settings', {}
+    digest = hashlib.md5(prompt.encode('utf-8')).hexdigest()[:8]
+    return 'summary', {"对话摘要": f"压测摘要{digest}：双方闲聊了日常琐事，没有新的重要信息。"}
+
+
+def _embedding(text, dim):
+    seed = hashlib.sha256(text.encode('utf-8')).digest()
+    vector = [((seed[i % len(seed)] + i * 31) % 255) / 127.0 - 1.0 for i in range(dim)]
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def create_app(latency=0.3, token_rate=80.0, embedding_dim=64, embedding_latency=0.02):
+    """
+    Args:
+        latency: 每次对话补全的固定延迟（秒）
+        token_rate: 输出token生成速率（token/秒）
+        embedding_dim: 伪向量维度
+        embedding_latency: 每次embedding请求的延迟（秒）
+    """
+    app = FastAPI()
+    app.state.calls = Counter()
+    app.state.prompt_tokens = Counter()
+    app.state.completion_tokens = Counter()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        prompt = _prompt_text(body)
+        kind, reply = _reply_for(prompt)
+        content = json.dumps(reply, ensure_ascii=False)
+        prompt_tokens, completion_tokens = _estimate_tokens(prompt), _estimate_tokens(content)
+        app.state.calls[kind] += 1
+        app.state.prompt_tokens[kind] += prompt_tokens
+        app.state.completion_tokens[kind] += completion_tokens
+        await asyncio.sleep(latency + completion_tokens / token_rate)
+        return {
+            "id": f"chatcmpl-{app.state.calls.total()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get('model', 'fake'),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body.get('input', [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        app.state.calls['embedding'] += 1
+        await asyncio.sleep(embedding_latency)
+        return {
+            "object": "list",
+            "model": body.get('model', 'fake'),
+            "data": [{"object": "embedding", "index": i, "embedding": _embedding(str(text), embedding_dim)}
+                     for i, text in enumerate(inputs)],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        }
+
+    @app.get("/stats")
+    async def stats():
+        return {
+            "calls": dict(app.state.calls),
+            "prompt_tokens": dict(app.state.prompt_tokens),
+            "completion_tokens": dict(app.state.completion_tokens),
+        }
+
+    return app
+
+
+class FakeOpenAIServer:
+    """在后台线程中运行假服务，base_url 形如 http://127.0.0.1:<port>/v1"""
+
+    def __init__(self, port, **app_kwargs):
+        self.port = port
+        self.app = create_app(**app_kwargs)
+        self.base_url = f"http://127.0.0.1:{port}/v1"
+        self._server = uvicorn.Server(uvicorn.Config(self.app, host="127.0.0.1", port=port, log_level="warning"))
+        self._thread = threading.Thread(target=self._server.run, name="fake-openai", daemon=True)
+
+    def start(self, timeout=10):
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("假OpenAI服务启动超时")
+            time.sleep(0.05)
+        return self
+
+    def stop(self):
+        self._server.should_exit = True
+        self._thread.join(5)
+
+    def stats(self):
+        return {
+            "calls": dict(self.app.state.calls),
+            "prompt_tokens": dict(self.app.state.prompt_tokens),
+            "completion_tokens": dict(self.app.state.completion_tokens),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='本地OpenAI兼容假服务')
+    parser.add_argument('--port', type=int, default=48990)
+    parser.add_argument('--latency', type=float, default=0.3, help='每次对话补全的固定延迟（秒）')
+    parser.add_argument('--token-rate', type=float, default=80.0, help='输出token生成速率（token/秒）')
+    parser.add_argument('--embedding-dim', type=int, default=64)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.latency, args.token_rate, args.embedding_dim), host="127.0.0.1", port=args.port)
@@ -0,0 +1,313 @@
+"""
+memory_server 压测。
+
+在隔离的临时目录中启动 memory_server（子进程）与本地的 OpenAI 兼容假服务，
+为 N 个角色并发回放 /process、/renew、/new_dialog、/get_recent_history 请求，报告：
+- 各接口的 p50 / p99 延迟
+- 每轮对话的LLM调用数（按摘要、整理、精排等分类）与embedding请求数
+- 每轮对话写入磁盘的字节数
+- memory_server 事件循环被阻塞的时间
+
+用法（在项目根目录执行）：
+    python -m benchmarks.memory_server_bench --characters 4 --turns 30
+    python -m benchmarks.memory_server_bench --characters 16 --turns 50 --llm-latency 0.8 --json
+
+目录隔离依赖 HOME / XDG_DOCUMENTS_DIR，仅适用于 Linux 与 macOS；不会读写真实的用户配置与记忆。
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _proc_write_bytes(pid='self'):
+    """进程写入存储层的字节数（Linux /proc/<pid>/io），不可用时返回None"""
+    try:
+        with open(f'/proc/{pid}/io', 'r') as f:
+            for line in f:
+                if line.startswith('write_bytes:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+# --- 服务端（子进程） ---
+
+def serve(args):
+    """在子进程中运行 memory_server，并附加事件循环阻塞监测与 /bench_stats 接口"""
+    import uvicorn
+    import memory_server
+
+    memory_server.ingest_queue.debounce = args.ingest_debounce
+    memory_server.ingest_queue.max_delay = args.ingest_max_delay
+    app = memory_server.app
+    lag = {'samples': 0, 'blocked_seconds': 0.0, 'max_seconds': 0.0}
+
+    async def monitor_loop_lag(interval=0.01, threshold=0.005):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            delay = loop.time() - start - interval
+            lag['samples'] += 1
+            if delay > threshold:
+                lag['blocked_seconds'] += delay
+                lag['max_seconds'] = max(lag['max_seconds'], delay)
+
+    async def start_monitor():
+        app.state.lag_monitor = asyncio.create_task(monitor_loop_lag())
+
+    async def bench_stats():
+        return {
+            'loop_lag': dict(lag),
+            'write_bytes': _proc_write_bytes(),
+            'ingest': memory_server.ingest_queue.status(),
+            'review_running': [name for name, task in memory_server.correction_tasks.items() if not task.done()],
+        }
+
+    app.add_event_handler("startup", start_monitor)
+    app.add_api_route("/bench_stats", bench_stats, methods=["GET"])
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+# --- 压测端 ---
+
+def prepare_workdir(workdir, names, fake_base_url):
+    """生成隔离的用户目录：角色配置、指向假服务的API配置"""
+    docs_dir = workdir / "Documents"
+    config_dir = docs_dir / "N.E.K.O" / "config"
+    config_dir.mkdir(parents=True, exist_ok=True)
+    characters = {
+        "主人": {"档案名": "压测主人", "性别": "男", "昵称": "主人"},
+        "猫娘": {name: {"性别": "女", "昵称": name} for name in names},
+        "当前猫娘": names[0],
+    }
+    (config_dir / "characters.json").write_text(json.dumps(characters, ensure_ascii=False), encoding='utf-8')
+    (config_dir / "core_config.json").write_text(json.dumps({
+        "coreApi": "qwen", "assistApi": "qwen", "coreApiKey": "sk-bench", "assistApiKeyQwen": "sk-bench",
+        "recent_memory_auto_review": True,
+    }), encoding='utf-8')
+
+    # api_providers.json 从工作目录下的 config 读取，把 qwen 的地址指向假服务
+    project_config = workdir / "config"
+    project_config.mkdir(exist_ok=True)
+    providers = json.loads((REPO_ROOT / "config" / "api_providers.json").read_text(encoding='utf-8'))
+    providers['assist_api_providers']['qwen']['openrouter_url'] = fake_base_url
+    (project_config / "api_providers.json").write_text(json.dumps(providers, ensure_ascii=False), encoding='utf-8')
+    return docs_dir
+
+
+def _turn_history(name, character_index, turn):
+    user_text = f"第{turn}轮：今天过得怎么样？我想和{name}聊聊第{character_index}号话题。"
+    ai_text = f"今天也很开心哦，第{turn}轮我们聊了很多，{name}记得你说过喜欢第{character_index}号话题。"
+    return [
+        {'role': 'user', 'content': [{'type': 'text', 'text': user_text}]},
+        {'role': 'assistant', 'content': [{'type': 'text', 'text': ai_text}]},
+    ]
+
+
+async def _timed(latencies, endpoint, coro):
+    start = time.perf_counter()
+    response = await coro
+    latencies.setdefault(endpoint, []).append(time.perf_counter() - start)
+    if response.status_code >= 400:
+        raise RuntimeError(f"{endpoint} 返回 {response.status_code}: {response.text[:200]}")
+    return response
+
+
+async def drive(base_url, names, args):
+    latencies = {}
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        async def run_character(index, name):
+            etag = None
+            for turn in range(args.turns):
+                payload = {'input_history': json.dumps(_turn_history(name, index, turn), ensure_ascii=False)}
+                endpoint = 'renew' if args.renew_every and (turn + 1) % args.renew_every == 0 else 'process'
+                await _timed(latencies, endpoint, client.post(f"/{endpoint}/{name}", json=payload))
+                headers = {'If-None-Match': etag} if etag else {}
+                response = await _timed(latencies, 'new_dialog', client.get(f"/new_dialog/{name}", headers=headers))
+                etag = response.headers.get('etag', etag)
+                await _timed(latencies, 'get_recent_history', client.get(f"/get_recent_history/{name}"))
+                if args.think_time:
+                    await asyncio.sleep(args.think_time)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(run_character(i, name) for i, name in enumerate(names)))
+        traffic_seconds = time.perf_counter() - start
+
+        # 处理完排队中的写入与后台记忆整理，再统计LLM调用与写盘量
+        await _timed(latencies, 'ingest_flush', client.post("/ingest_flush"))
+        deadline = time.monotonic() + args.drain_timeout
+        while time.monotonic() < deadline:
+            stats = (await client.get("/bench_stats")).json()
+            if not stats['review_running']:
+                break
+            await asyncio.sleep(0.2)
+        server_stats = (await client.get("/bench_stats")).json()
+    return latencies, traffic_seconds, server_stats
+
+
+def wait_for_server(base_url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"memory_server 启动失败，退出码 {process.returncode}")
+        try:
+            if httpx.get(f"{base_url}/bench_stats", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("memory_server 启动超时")
+
+
+def run(args):
+    from benchmarks.fake_openai import FakeOpenAIServer
+
+    names = [f"bench{i}" for i in range(args.characters)]
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="neko-memory-bench-"))
+    fake = FakeOpenAIServer(_free_port(), latency=args.llm_latency, token_rate=args.token_rate).start()
+    docs_dir = prepare_workdir(workdir, names, fake.base_url)
+    memory_dir = docs_dir / "N.E.K.O" / "memory"
+
+    port = _free_port()
+    env = dict(os.environ, HOME=str(workdir), XDG_DOCUMENTS_DIR=str(docs_dir),
+               PYTHONPATH=os.pathsep.join(filter(None, [str(REPO_ROOT), os.environ.get('PYTHONPATH')])))
+    command = [sys.executable, "-m", "benchmarks.memory_server_bench", "--serve", "--port", str(port),
+               "--ingest-debounce", str(args.ingest_debounce), "--ingest-max-delay", str(args.ingest_max_delay)]
+    log_file = open(workdir / "memory_server.log", "w", encoding='utf-8')
+    process = subprocess.Popen(command, cwd=str(workdir), env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_for_server(base_url, process)
+        write_bytes_before = _proc_write_bytes(process.pid)
+        size_before = _dir_size(memory_dir)
+        llm_before = fake.stats()['calls']
+
+        latencies, traffic_seconds, server_stats = asyncio.run(drive(base_url, names, args))
+
+        write_bytes_after = _proc_write_bytes(process.pid)
+        llm_calls = {k: v - llm_before.get(k, 0) for k, v in fake.stats()['calls'].items()}
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        log_file.close()
+        fake.stop()
+
+    turns = args.characters * args.turns
+    if write_bytes_before is not None and write_bytes_after:
+        disk_bytes, disk_source = write_bytes_after - write_bytes_before, "/proc/<pid>/io write_bytes"
+    else:
+        disk_bytes, disk_source = _dir_size(memory_dir) - size_before, "记忆目录大小变化（近似）"
+    report = {
+        'characters': args.characters,
+        'turns_per_character': args.turns,
+        'traffic_seconds': traffic_seconds,
+        'turns_per_second': turns / traffic_seconds if traffic_seconds else 0.0,
+        'latency_ms': {
+            endpoint: {
+                'count': len(values),
+                'p50': _percentile(values, 50) * 1000,
+                'p99': _percentile(values, 99) * 1000,
+                'mean': statistics.fmean(values) * 1000,
+            }
+            for endpoint, values in sorted(latencies.items())
+        },
+        'llm_calls': llm_calls,
+        'llm_calls_per_turn': {k: v / turns for k, v in llm_calls.items()},
+        'disk_bytes_per_turn': disk_bytes / turns,
+        'disk_bytes_source': disk_source,
+        'event_loop': server_stats['loop_lag'],
+        'workdir': str(workdir),
+    }
+    if not args.keep and not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+        report['workdir'] = None
+    return report
+
+
+def print_report(report):
+    print(f"\n角色数 {report['characters']}，每角色 {report['turns_per_character']} 轮，"
+          f"耗时 {report['traffic_seconds']:.2f}s（{report['turns_per_second']:.1f} 轮/秒）")
+    print(f"\n{'接口':<20}{'次数':>8}{'p50(ms)':>12}{'p99(ms)':>12}{'平均(ms)':>12}")
+    for endpoint, stats in report['latency_ms'].items():
+        print(f"{endpoint:<20}{stats['count']:>8}{stats['p50']:>12.1f}{stats['p99']:>12.1f}{stats['mean']:>12.1f}")
+    print("\n每轮LLM调用：" + ("，".join(f"{k} {v:.2f}" for k, v in sorted(report['llm_calls_per_turn'].items())) or "无"))
+    print(f"每轮写盘：{report['disk_bytes_per_turn']:.0f} 字节（{report['disk_bytes_source']}）")
+    lag = report['event_loop']
+    print(f"事件循环阻塞：累计 {lag['blocked_seconds'] * 1000:.1f}ms，最长 {lag['max_seconds'] * 1000:.1f}ms")
+    if report['workdir']:
+        print(f"工作目录：{report['workdir']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='memory_server 压测')
+    parser.add_argument('--characters', type=int, default=4, help='并发的角色数')
+    parser.add_argument('--turns', type=int, default=30, help='每个角色的对话轮数')
+    parser.add_argument('--renew-every', type=int, default=10, help='每隔多少轮发送一次 /renew（0为不发送）')
+    parser.add_argument('--think-time', type=float, default=0.0, help='每轮之间的间隔（秒）')
+    parser.add_argument('--llm-latency', type=float, default=0.3, help='假LLM每次调用的固定延迟（秒）')
+    parser.add_argument('--token-rate', type=float, default=80.0, help='假LLM的输出速率（token/秒）')
+    parser.add_argument('--ingest-debounce', type=float, default=0.5, help='memory_server 写入合并窗口（秒）')
+    parser.add_argument('--ingest-max-delay', type=float, default=5.0, help='memory_server 写入最长等待（秒）')
+    parser.add_argument('--drain-timeout', type=float, default=60.0, help='压测结束后等待后台任务完成的时间（秒）')
+    parser.add_argument('--workdir', help='工作目录（默认使用临时目录，结束后删除）')
+    parser.add_argument('--keep', action='store_true', help='保留临时工作目录以便查看日志与记忆文件')
+    parser.add_argument('--json', action='store_true', help='以JSON输出结果')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+TTS 音频回传路径的延迟基准。
+
+子进程模拟TTS worker，按固定间隔向 multiprocessing.Queue 写入音频帧（帧头8字节为写入时的
+time.monotonic()），主进程分别用两种方式取出并"发送"（记录到达发送点的时间）：
+- poll：原 tts_response_handler 的做法，empty()/get_nowait() 取空后 asyncio.sleep(0.01)
+- reader：TTSResponseReader，后台线程阻塞读取并唤醒事件循环
+
+报告从TTS产出到WebSocket发送点的延迟（p50 / p99 / 最大），以及空闲时主进程的CPU占用。
+
+用法（在项目根目录执行）：
+    python -m benchmarks.tts_delivery_bench
+    python -m benchmarks.tts_delivery_bench --frames 500 --interval 0.02 --idle 3 --json
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import struct
+import time
+from multiprocessing import Process, Queue as MPQueue
+
+from main_helper.tts_helper import TTSResponseReader
+
+FRAME_BYTES = 9600  # 48kHz int16 下100ms
+
+
+def fake_tts_worker(response_queue, frames, interval):
+    """按固定间隔产出带时间戳的音频帧，结束时发送 None"""
+    response_queue.put(("__ready__", True))
+    payload = bytes(FRAME_BYTES - 8)
+    for _ in range(frames):
+        response_queue.put(struct.pack('<d', time.monotonic()) + payload)
+        time.sleep(interval)
+    response_queue.put(None)
+
+
+async def consume_poll(response_queue, latencies):
+    while True:
+        while not response_queue.empty():
+            data = response_queue.get_nowait()
+            if data is None:
+                return
+            if isinstance(data, tuple) and len(data) == 2 and data[0] == "__ready__":
+                continue
+            latencies.append(time.monotonic() - struct.unpack_from('<d', data)[0])
+            await asyncio.sleep(0)  # 模拟 websocket.send_bytes 让出事件循环
+        await asyncio.sleep(0.01)
+
+
+async def consume_reader(response_queue, latencies):
+    reader = TTSResponseReader(response_queue).start()
+    try:
+        while True:
+            data = await reader.get()
+            if data is None:
+                return
+            if isinstance(data, tuple) and len(data) == 2 and data[0] == "__ready__":
+                continue
+            latencies.append(time.monotonic() - struct.unpack_from('<d', data)[0])
+            await asyncio.sleep(0)
+    finally:
+        reader.stop()
+
+
+async def measure_idle_cpu(consumer, seconds):
+    """没有任何音频时运行消费者，返回每秒消耗的CPU毫秒数"""
+    response_queue = MPQueue()
+    task = asyncio.create_task(consumer(response_queue, []))
+    await asyncio.sleep(0.2)
+    cpu_start = time.process_time()
+    await asyncio.sleep(seconds)
+    cpu = time.process_time() - cpu_start
+    response_queue.put(None)
+    await asyncio.wait_for(task, timeout=5)
+    return cpu / seconds * 1e3
+
+
+async def run_mode(consumer, frames, interval, idle_seconds):
+    response_queue = MPQueue()
+    latencies = []
+    worker = Process(target=fake_tts_worker, args=(response_queue, frames, interval), daemon=True)
+    worker.start()
+    await consumer(response_queue, latencies)
+    worker.join(5)
+    latencies_ms = sorted(v * 1e3 for v in latencies)
+    return {
+        'frames': len(latencies_ms),
+        'p50_ms': statistics.median(latencies_ms),
+        'p99_ms': latencies_ms[min(len(latencies_ms) - 1, int(len(latencies_ms) * 0.99))],
+        'max_ms': latencies_ms[-1],
+        'mean_ms': statistics.fmean(latencies_ms),
+        'idle_cpu_ms_per_s': await measure_idle_cpu(consumer, idle_seconds),
+    }
+
+
+async def run(frames, interval, idle_seconds):
+    report = {'frames': frames, 'interval_ms': interval * 1e3}
+    for name, consumer in (('poll', consume_poll), ('reader', consume_reader)):
+        report[name] = await run_mode(consumer, frames, interval, idle_seconds)
+    return report
+
+
+def print_report(report):
+    print(f"\n{report['frames']} 帧，每 {report['interval_ms']:.0f}ms 产出一帧")
+    print(f"\n{'方式':<10}{'p50(ms)':>10}{'p99(ms)':>10}{'最大(ms)':>10}{'平均(ms)':>10}{'空闲CPU(ms/s)':>16}")
+    for name in ('poll', 'reader'):
+        stats = report[name]
+        print(f"{name:<10}{stats['p50_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}"
+              f"{stats['mean_ms']:>10.2f}{stats['idle_cpu_ms_per_s']:>16.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TTS 音频回传路径延迟基准')
+    parser.add_argument('--frames', type=int, default=300, help='模拟的音频帧数')
+    parser.add_argument('--interval', type=float, default=0.023, help='TTS产出音频帧的间隔（秒）')
+    parser.add_argument('--idle', type=float, default=2.0, help='测量空闲CPU占用的时长（秒）')
+    parser.add_argument('--json', action='store_true', help='以JSON输出结果')
+    args = parser.parse_args()
+    report = asyncio.run(run(args.frames, args.interval, args.idle))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
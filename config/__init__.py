@@ -242,8 +242,45 @@ DEFAULT_CONFIG_DATA = {
 }
 
 
+# 记忆写入队列：同一角色在防抖窗口内的 /process、/renew 请求合并为一个批次处理
+# 队列不持久化，进程崩溃时最多丢失 MEMORY_INGEST_MAX_DELAY_SECONDS 内尚未处理的消息
+MEMORY_INGEST_DEBOUNCE_SECONDS = 5.0
+MEMORY_INGEST_MAX_DELAY_SECONDS = 30.0
+
+# 近期记忆压缩：消息数超过上限或总token数超过预算时压缩，压缩后保留的原文不超过保留预算
+RECENT_HISTORY_TOKEN_BUDGET = 2000
+RECENT_HISTORY_KEEP_TOKENS = 1000
+# 摘要超过该token数时进行第二轮压缩
+RECENT_SUMMARY_MAX_TOKENS = 500
+# token计数用的tiktoken编码表：本地没有缓存时是否联网下载，以及首次加载最多等待的秒数（超时则先用估算）
+TOKEN_ENCODING_ALLOW_DOWNLOAD = False
+TOKEN_ENCODING_LOAD_TIMEOUT_SECONDS = 5.0
+
+# 语义记忆检索：本地粗排(BM25+向量, RRF融合)后，仅当两路排序前k名的重合比例低于该阈值时才调用LLM精排
+SEMANTIC_RERANK_AGREEMENT_THRESHOLD = 0.6
+# 进入LLM精排的候选数上限（相对最终返回条数的倍数）
+SEMANTIC_RERANK_CANDIDATE_FACTOR = 2
+
 TIME_ORIGINAL_TABLE_NAME = "time_indexed_original"
 TIME_COMPRESSED_TABLE_NAME = "time_indexed_compressed"
+TIME_ROLLUP_TABLE_NAME = "time_indexed_rollup"
+# 按日/周/月汇总摘要的后台任务间隔，以及单次最多生成的汇总数（首次运行时逐步追赶历史）
+TIME_ROLLUP_INTERVAL_SECONDS = 3600
+TIME_ROLLUP_MAX_BUCKETS_PER_RUN = 20
+
+# 记忆服务的LLM调用调度：所有角色共享的并发上限，以及每个API端点的请求速率（令牌桶）
+LLM_SCHEDULER_MAX_CONCURRENCY = 4
+LLM_SCHEDULER_REQUESTS_PER_SECOND = 2.0
+LLM_SCHEDULER_BURST = 4
+# 遇到429时由调度器统一退避重试的次数
+LLM_SCHEDULER_MAX_RETRIES = 3
+
+# 实时语音输入：前端每32ms发来一帧，合并为100ms（16kHz int16）一块再发给Realtime API，
+# 不足一块的尾部最多滞留这么久就直接发出，避免拖慢服务端VAD
+AUDIO_INGEST_CHUNK_BYTES = 3200
+AUDIO_INGEST_MAX_HOLD_SECONDS = 0.1
+# CosyVoice 输出：重采样到48kHz后按固定帧长（采样数，4800即100ms）发给前端
+COSYVOICE_OUTPUT_FRAME_SAMPLES = 4800
 
 MODELS_WITH_EXTRA_BODY = ["qwen-flash-2025-07-28", "qwen3-vl-plus-2025-09-23"]
 
@@ -404,8 +441,27 @@ __all__ = [
     'DEFAULT_CORE_API_PROFILES',
     'DEFAULT_ASSIST_API_PROFILES',
     'DEFAULT_ASSIST_API_KEY_FIELDS',
+    'MEMORY_INGEST_DEBOUNCE_SECONDS',
+    'MEMORY_INGEST_MAX_DELAY_SECONDS',
+    'RECENT_HISTORY_TOKEN_BUDGET',
+    'RECENT_HISTORY_KEEP_TOKENS',
+    'RECENT_SUMMARY_MAX_TOKENS',
+    'TOKEN_ENCODING_ALLOW_DOWNLOAD',
+    'TOKEN_ENCODING_LOAD_TIMEOUT_SECONDS',
+    'SEMANTIC_RERANK_AGREEMENT_THRESHOLD',
+    'SEMANTIC_RERANK_CANDIDATE_FACTOR',
     'TIME_ORIGINAL_TABLE_NAME',
     'TIME_COMPRESSED_TABLE_NAME',
+    'TIME_ROLLUP_TABLE_NAME',
+    'TIME_ROLLUP_INTERVAL_SECONDS',
+    'TIME_ROLLUP_MAX_BUCKETS_PER_RUN',
+    'LLM_SCHEDULER_MAX_CONCURRENCY',
+    'LLM_SCHEDULER_REQUESTS_PER_SECOND',
+    'LLM_SCHEDULER_BURST',
+    'LLM_SCHEDULER_MAX_RETRIES',
+    'AUDIO_INGEST_CHUNK_BYTES',
+    'AUDIO_INGEST_MAX_HOLD_SECONDS',
+    'COSYVOICE_OUTPUT_FRAME_SAMPLES',
     'MODELS_WITH_EXTRA_BODY',
     'get_api_providers_config',
     'MAIN_SERVER_PORT',
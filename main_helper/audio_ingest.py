@@ -0,0 +1,97 @@
+# -- coding: utf-8 --
+"""
+实时语音输入的分块与编码。
+
+前端每32ms发来一帧int16 PCM，逐帧发给Realtime API时每帧都要经历一次base64、一次字典构造和
+一次json.dumps。这里把小帧合并成固定大小的块（预分配缓冲区，整块数据直接切片输入，不拷贝），
+再把base64结果写进可复用的消息模板，得到可直接以文本帧发送的UTF-8字节。
+"""
+import binascii
+import time
+
+from config import AUDIO_INGEST_CHUNK_BYTES
+
+
+class AudioChunker:
+    """把任意长度的PCM帧合并为 chunk_bytes 大小的块"""
+
+    def __init__(self, chunk_bytes=AUDIO_INGEST_CHUNK_BYTES):
+        # 保证按int16采样对齐
+        self.chunk_bytes = max(2, chunk_bytes - chunk_bytes % 2)
+        self._buf = bytearray(self.chunk_bytes)
+        self._view = memoryview(self._buf)
+        self._len = 0
+
+    @property
+    def pending(self):
+        """缓冲区中尚未凑满一块的字节数"""
+        return self._len
+
+    def feed(self, data):
+        """
+        写入一帧，逐个产出已凑满的块（memoryview）。
+        产出的视图可能指向内部缓冲区或输入数据本身，只在下一次 feed/take_pending 之前有效。
+        """
+        data = memoryview(data).cast('B')
+        size = len(data)
+        pos = 0
+        if self._len:
+            take = min(self.chunk_bytes - self._len, size)
+            self._view[self._len:self._len + take] = data[:take]
+            self._len += take
+            pos = take
+            if self._len < self.chunk_bytes:
+                return
+            self._len = 0
+            yield self._view
+        # 缓冲区为空时，输入中的整块直接切片产出
+        while size - pos >= self.chunk_bytes:
+            yield data[pos:pos + self.chunk_bytes]
+            pos += self.chunk_bytes
+        rest = size - pos
+        if rest:
+            self._view[:rest] = data[pos:]
+            self._len = rest
+
+    def take_pending(self):
+        """取出不足一块的剩余数据并清空缓冲区；视图在下一次 feed 之前有效"""
+        size, self._len = self._len, 0
+        return self._view[:size]
+
+    def clear(self):
+        self._len = 0
+
+
+class AudioAppendEncoder:
+    """把PCM块编码为 input_audio_buffer.append 事件，复用同一块消息缓冲区"""
+
+    _PREFIX = b'{"type":"input_audio_buffer.append","event_id":"event_'
+    _MIDDLE = b'","audio":"'
+    _SUFFIX = b'"}'
+
+    def __init__(self, chunk_bytes=AUDIO_INGEST_CHUNK_BYTES):
+        self._msg = bytearray()
+        self._reserve(chunk_bytes)
+
+    def _reserve(self, chunk_bytes):
+        # event_id 为毫秒时间戳，预留20位足够
+        size = len(self._PREFIX) + 20 + len(self._MIDDLE) + (chunk_bytes + 2) // 3 * 4 + len(self._SUFFIX)
+        if size > len(self._msg):
+            self._msg = bytearray(size)
+            self._msg[:len(self._PREFIX)] = self._PREFIX
+            self._view = memoryview(self._msg)
+
+    def encode(self, chunk):
+        """
+        返回事件JSON的UTF-8字节视图，与 send_event 生成的内容等价（base64无需JSON转义）。
+        视图指向内部缓冲区，只在下一次 encode 之前有效。
+        """
+        self._reserve(len(chunk))
+        audio_b64 = binascii.b2a_base64(chunk, newline=False)
+        event_id = b'%d' % int(time.time() * 1000)
+        pos = len(self._PREFIX)
+        for part in (event_id, self._MIDDLE, audio_b64, self._SUFFIX):
+            end = pos + len(part)
+            self._view[pos:end] = part
+            pos = end
+        return self._view[:pos]
@@ -16,10 +16,10 @@ from websockets import exceptions as web_exceptions
 from fastapi import WebSocket, WebSocketDisconnect
 from utils.frontend_utils import contains_chinese, replace_blank, replace_corner_mark, remove_bracket, \
     is_only_punctuation, split_paragraph
-from utils.audio import make_wav_header
+from utils.audio import make_wav_header, StreamingResampler
 from main_helper.omni_realtime_client import OmniRealtimeClient
 from main_helper.omni_offline_client import OmniOfflineClient
-from main_helper.tts_helper import get_tts_worker
+from main_helper.tts_helper import get_tts_worker, TTSResponseReader
 import base64
 from io import BytesIO
 from PIL import Image
@@ -28,7 +28,6 @@ from utils.config_manager import get_config_manager
 from multiprocessing import Process, Queue as MPQueue
 from uuid import uuid4
 import numpy as np
-import soxr
 import httpx 
 
 # Setup logger for this module
@@ -52,6 +51,7 @@ class LLMSessionManager:
         self.lock = asyncio.Lock()  # 使用异步锁替代同步锁
         self.websocket_lock = None  # websocket操作的共享锁，由main_server设置
         self.current_speech_id = None
+        self.audio_resampler = StreamingResampler()  # 原生语音输出的流式重采样（不使用TTS时）
         self.emoji_pattern = re.compile(r'[^\w\u4e00-\u9fff\s>][^\w\u4e00-\u9fff\s]{2,}[^\w\u4e00-\u9fff\s<]', flags=re.UNICODE)
         self.emoji_pattern2 = re.compile("["
         u"\U0001F600-\U0001F64F"  # emoticons
@@ -89,6 +89,9 @@ class LLMSessionManager:
         self.openrouter_url = core_config['OPENROUTER_URL']
         self.openrouter_api_key = core_config['OPENROUTER_API_KEY']
         self.memory_server_port = MEMORY_SERVER_PORT
+        # new_dialog 上下文的本地副本及其ETag，内容未变化时memory_server返回304，省去响应体
+        self.new_dialog_etag = None
+        self.new_dialog_text = ""
         self.audio_api_key = core_config['AUDIO_API_KEY']
         self.voice_id = self.lanlan_basic_config[self.lanlan_name].get('voice_id', '')
         # 注意：use_tts 会在 start_session 中根据 input_mode 重新设置
@@ -105,6 +108,7 @@ class LLMSessionManager:
         self.pending_session = None
         self.is_hot_swap_imminent = False
         self.tts_handler_task = None
+        self.tts_reader = None  # 把TTS响应队列接入事件循环的读取器
         # 热切换相关变量
         self.background_preparation_task = None
         self.final_swap_task = None
@@ -146,13 +150,11 @@ class LLMSessionManager:
 
     async def handle_new_message(self):
         """处理新模型输出：清空TTS队列并通知前端"""
+        # 新的回复开始，丢弃上一段原生语音的重采样状态
+        self.audio_resampler.reset()
         if self.use_tts and self.tts_process and self.tts_process.is_alive():
             # 清空响应队列中待发送的音频数据
-            while not self.tts_response_queue.empty():
-                try:
-                    self.tts_response_queue.get_nowait()
-                except:
-                    break
+            self._clear_tts_responses()
             # 发送终止信号以清空TTS请求队列并停止当前合成
             try:
                 self.tts_request_queue.put((None, None))
@@ -174,11 +176,7 @@ class LLMSessionManager:
             
             if self.tts_process and self.tts_process.is_alive():
                 # 清空响应队列中待发送的音频数据
-                while not self.tts_response_queue.empty():
-                    try:
-                        self.tts_response_queue.get_nowait()
-                    except:
-                        break
+                self._clear_tts_responses()
         
         # 文本模式下，无论是否使用TTS，都要发送文本到前端显示
         await self.send_lanlan_response(text, is_first_chunk)
@@ -207,6 +205,11 @@ class LLMSessionManager:
                 self.tts_request_queue.put((None, None))
             except Exception as e:
                 logger.warning(f"⚠️ 发送TTS结束信号失败: {e}")
+        elif not self.use_tts:
+            # 原生语音本轮结束，发出重采样器中剩余的尾部采样
+            tail = self.audio_resampler.flush()
+            if tail:
+                await self.send_speech(tail)
         self.sync_message_queue.put({'type': 'system', 'data': 'turn end'})
         
         # 直接向前端发送turn end消息
@@ -274,11 +277,10 @@ class LLMSessionManager:
         """Qwen音频回调：推送音频到WebSocket前端"""
         if not self.use_tts:
             if self.websocket and hasattr(self.websocket, 'client_state') and self.websocket.client_state == self.websocket.client_state.CONNECTED:
-                # 这里假设audio_data为PCM16字节流，直接推送
-                audio = np.frombuffer(audio_data, dtype=np.int16)
-                audio = (soxr.resample(audio.astype(np.float32) / 32768.0, 24000, 48000, quality='HQ')*32767.).clip(-32768, 32767).astype(np.int16)
-
-                await self.send_speech(audio.tobytes())
+                # 这里假设audio_data为PCM16字节流，流式重采样 24kHz -> 48kHz 后推送
+                audio = self.audio_resampler.resample(audio_data, self.current_speech_id)
+                if audio:
+                    await self.send_speech(audio)
                 # 你可以根据需要加上格式、isNewMessage等标记
                 # await self.websocket.send_json({"type": "cozy_audio", "format": "blob", "isNewMessage": True})
             else:
@@ -583,28 +585,20 @@ class LLMSessionManager:
                 start_time = time.time()
                 timeout = 8.0  # 最多等待8秒
                 
-                while time.time() - start_time < timeout:
-                    try:
-                        # 非阻塞检查队列
-                        if not self.tts_response_queue.empty():
-                            msg = self.tts_response_queue.get_nowait()
-                            # 检查是否是就绪信号
-                            if isinstance(msg, tuple) and len(msg) == 2 and msg[0] == "__ready__":
-                                tts_ready = msg[1]
-                                if tts_ready:
-                                    logger.info(f"✅ TTS进程已就绪 (用时: {time.time() - start_time:.2f}秒)")
-                                else:
-                                    logger.error("❌ TTS进程初始化失败")
-                                break
-                            else:
-                                # 不是就绪信号，放回队列
-                                self.tts_response_queue.put(msg)
-                                break
-                    except:
-                        pass
-                    
-                    # 小睡眠避免忙等
-                    await asyncio.sleep(0.05)
+                try:
+                    msg = await asyncio.wait_for(self._ensure_tts_reader().get(), timeout=timeout)
+                    # 检查是否是就绪信号
+                    if isinstance(msg, tuple) and len(msg) == 2 and msg[0] == "__ready__":
+                        tts_ready = msg[1]
+                        if tts_ready:
+                            logger.info(f"✅ TTS进程已就绪 (用时: {time.time() - start_time:.2f}秒)")
+                        else:
+                            logger.error("❌ TTS进程初始化失败")
+                    else:
+                        # 不是就绪信号，放回队首
+                        self.tts_reader.unget(msg)
+                except asyncio.TimeoutError:
+                    pass
                 
                 if not tts_ready:
                     if time.time() - start_time >= timeout:
@@ -862,9 +856,7 @@ class LLMSessionManager:
             
             initial_prompt = (f"你是一个角色扮演大师，并且精通电脑操作。请按要求扮演以下角色（{self.lanlan_name}），在对方请求时、回答“我试试”并尝试操纵电脑。" if self._is_agent_enabled() else f"你是一个角色扮演大师。请按要求扮演以下角色（{self.lanlan_name}）。") + self.lanlan_prompt
             self.initial_cache_snapshot_len = len(self.message_cache_for_new_session)
-            async with httpx.AsyncClient() as client:
-                resp = await client.get(f"http://localhost:{self.memory_server_port}/new_dialog/{self.lanlan_name}")
-                initial_prompt += resp.text + self._convert_cache_to_str(self.message_cache_for_new_session)
+            initial_prompt += await self._fetch_new_dialog() + self._convert_cache_to_str(self.message_cache_for_new_session)
             # print(initial_prompt)
             await self.pending_session.connect(initial_prompt, native_audio = not self.use_tts)
 
@@ -886,6 +878,17 @@ class LLMSessionManager:
             if self.background_preparation_task and self.background_preparation_task.done():
                 self.background_preparation_task = None
 
+    async def _fetch_new_dialog(self):
+        """获取new_dialog上下文，携带ETag，内容未变化时复用本地副本"""
+        headers = {"If-None-Match": self.new_dialog_etag} if self.new_dialog_etag else {}
+        async with httpx.AsyncClient() as client:
+            resp = await client.get(f"http://localhost:{self.memory_server_port}/new_dialog/{self.lanlan_name}", headers=headers)
+        if resp.status_code == 304:
+            return self.new_dialog_text
+        self.new_dialog_etag = resp.headers.get("etag")
+        self.new_dialog_text = resp.text
+        return resp.text
+
     async def _trigger_immediate_preparation_for_extra(self):
         """当需要注入额外提示时，如果当前未进入准备流程，立即开始准备并安排renew逻辑。"""
         try:
@@ -1161,7 +1164,11 @@ class LLMSessionManager:
                     logger.error("💥 Stream: Session websocket not available")
                     return
                 try:
-                    if isinstance(data, list):
+                    if isinstance(data, (bytes, bytearray, memoryview)):
+                        # 二进制帧：已是小端int16 PCM，直接转发
+                        await self.session.stream_audio(data)
+                    elif isinstance(data, list):
+                        # 兼容旧的JSON整数数组格式
                         audio_bytes = struct.pack(f'<{len(data)}h', *data)
                         await self.session.stream_audio(audio_bytes)
                     else:
@@ -1292,11 +1299,10 @@ class LLMSessionManager:
                 self.tts_request_queue.get_nowait()
         except:
             pass
-        try:
-            while not self.tts_response_queue.empty():
-                self.tts_response_queue.get_nowait()
-        except:
-            pass
+        self._clear_tts_responses()
+        if self.tts_reader:
+            self.tts_reader.stop()
+            self.tts_reader = None
         
         # 重置TTS缓存状态
         async with self.tts_cache_lock:
@@ -1404,14 +1410,33 @@ class LLMSessionManager:
         except Exception as e:
             logger.error(f"💥 WS Send Response Error: {e}")
 
+    def _ensure_tts_reader(self):
+        """为当前的TTS响应队列启动读取器；队列重建后旧的读取器随之停止"""
+        if self.tts_reader is None or self.tts_reader.mp_queue is not self.tts_response_queue:
+            if self.tts_reader:
+                self.tts_reader.stop()
+            self.tts_reader = TTSResponseReader(self.tts_response_queue).start()
+        return self.tts_reader
+
+    def _clear_tts_responses(self):
+        """打断时丢弃所有尚未发出的TTS音频"""
+        if self.tts_reader:
+            self.tts_reader.clear()
+            return
+        try:
+            while not self.tts_response_queue.empty():
+                self.tts_response_queue.get_nowait()
+        except:
+            pass
+
     async def tts_response_handler(self):
+        reader = self._ensure_tts_reader()
         while True:
-            while not self.tts_response_queue.empty():
-                data = self.tts_response_queue.get_nowait()
-                # 过滤掉就绪信号（格式为 ("__ready__", True/False)）
-                if isinstance(data, tuple) and len(data) == 2 and data[0] == "__ready__":
-                    # 这是就绪信号，不是音频数据，跳过
-                    continue
-                await self.send_speech(data)
-            await asyncio.sleep(0.01)
+            # 子进程产出音频后立即被唤醒，无需轮询
+            data = await reader.get()
+            # 过滤掉就绪信号（格式为 ("__ready__", True/False)）
+            if isinstance(data, tuple) and len(data) == 2 and data[0] == "__ready__":
+                # 这是就绪信号，不是音频数据，跳过
+                continue
+            await self.send_speech(data)
 
@@ -11,6 +11,8 @@ from typing import Optional, Callable, Dict, Any, Awaitable
 from enum import Enum
 from langchain_openai import ChatOpenAI
 from utils.config_manager import get_config_manager
+from main_helper.audio_ingest import AudioChunker, AudioAppendEncoder
+from config import AUDIO_INGEST_MAX_HOLD_SECONDS
 
 # Setup logger for this module
 logger = logging.getLogger(__name__)
@@ -104,6 +106,11 @@ class OmniRealtimeClient:
         self._output_transcript_buffer = ""
         self._modalities = ["text", "audio"]
         self._audio_in_buffer = False
+        # 麦克风输入：小帧合并成块后用模板编码发送
+        self._audio_chunker = AudioChunker()
+        self._audio_encoder = AudioAppendEncoder()
+        self._audio_send_lock = asyncio.Lock()
+        self._audio_flush_task = None
         self._skip_until_next_response = False
         # Track image recognition per turn
         self._image_recognized_this_turn = False
@@ -304,13 +311,32 @@ class OmniRealtimeClient:
     async def stream_audio(self, audio_chunk: bytes) -> None:
         """Stream raw audio data to the API."""
         # only support 16bit 16kHz mono pcm
-        audio_b64 = base64.b64encode(audio_chunk).decode()
+        # 凑满 AUDIO_INGEST_CHUNK_BYTES 才发送一次，不足一块的尾部最多滞留 AUDIO_INGEST_MAX_HOLD_SECONDS
+        async with self._audio_send_lock:
+            for chunk in self._audio_chunker.feed(audio_chunk):
+                await self._send_audio_chunk(chunk)
+        if self._audio_chunker.pending and (self._audio_flush_task is None or self._audio_flush_task.done()):
+            self._audio_flush_task = asyncio.create_task(self._flush_audio_later())
+
+    async def _send_audio_chunk(self, chunk) -> None:
+        # 消息缓冲区被复用，调用方需持有 _audio_send_lock
+        if self.ws:
+            try:
+                await self.ws.send(self._audio_encoder.encode(chunk), text=True)
+            except Exception as e:
+                logger.warning(f"⚠️ 发送音频失败: {e}")
+                raise
 
-        append_event = {
-            "type": "input_audio_buffer.append",
-            "audio": audio_b64
-        }
-        await self.send_event(append_event)
+    async def _flush_audio_later(self) -> None:
+        """到达最长滞留时间后，把不足一块的剩余音频直接发出"""
+        await asyncio.sleep(AUDIO_INGEST_MAX_HOLD_SECONDS)
+        async with self._audio_send_lock:
+            if not self._audio_chunker.pending:
+                return
+            try:
+                await self._send_audio_chunk(self._audio_chunker.take_pending())
+            except Exception:
+                pass
 
     async def _analyze_image_with_vision_model(self, image_b64: str) -> str:
         """Use VISION_MODEL to analyze image and return description."""
@@ -622,6 +648,12 @@ class OmniRealtimeClient:
                 logger.error(f"Error cancelling silence check task: {e}")
             finally:
                 self._silence_check_task = None
+
+        # 未发出的尾部音频随会话一起丢弃
+        if self._audio_flush_task:
+            self._audio_flush_task.cancel()
+            self._audio_flush_task = None
+        self._audio_chunker.clear()
         
         if self.ws:
             try:
@@ -3,7 +3,6 @@ TTS Helper模块
 负责处理TTS语音合成，支持自定义音色（阿里云CosyVoice）和默认音色（各core_api的原生TTS）
 """
 import numpy as np
-import soxr
 import time
 import asyncio
 import json
@@ -11,15 +10,100 @@ import base64
 import logging
 import websockets
 from enum import Enum
+from collections import deque
 from multiprocessing import Queue as MPQueue, Process
 import threading
+import queue
 import io
 import wave
 import aiohttp
 from functools import partial
+from utils.audio import StreamingResampler, FramedResampler
+from config import COSYVOICE_OUTPUT_FRAME_SAMPLES
 logger = logging.getLogger(__name__)
 
 
+class TTSResponseReader:
+    """
+    把TTS子进程的响应队列（multiprocessing.Queue）接入事件循环。
+
+    后台线程阻塞读取响应队列，读到的数据通过 call_soon_threadsafe 交给事件循环并唤醒 get()，
+    音频一产生就能发出，空闲时不轮询。每个响应队列对应一个 reader，生命周期与队列一致。
+
+    后台线程阻塞读取时持有队列的读锁，其他线程无法从队列中取数据，因此 clear() 不直接清空队列，
+    而是向队列写入一个打断标记：队列按先进先出传递，标记之前的数据都是打断时已经产生的，
+    后台线程把它们标为旧的代次，事件循环收到后直接丢弃；标记之后由TTS子进程写入的数据正常发出。
+    """
+
+    _CLEAR_MARKER = "__reader_clear__"
+
+    def __init__(self, mp_queue, loop=None):
+        self.mp_queue = mp_queue
+        self._loop = loop or asyncio.get_running_loop()
+        self._items = deque()
+        self._event = asyncio.Event()
+        self._generation = 0  # clear() 的次数，只在事件循环线程中读写
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="tts-response-reader", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """停止后台线程（线程最多在 0.5 秒内退出，不会再投递数据）"""
+        self._stopped.set()
+
+    def _run(self):
+        # 已从队列中读到的最新打断标记，其后读出的数据都属于该代次
+        generation = 0
+        while not self._stopped.is_set():
+            try:
+                # 带超时只为能响应 stop()；有数据时 get 会立即返回
+                item = self.mp_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError, ValueError):
+                break
+            if self._stopped.is_set():
+                break
+            if isinstance(item, tuple) and len(item) == 2 and item[0] == self._CLEAR_MARKER:
+                generation = item[1]
+                continue
+            try:
+                self._loop.call_soon_threadsafe(self._deliver, generation, item)
+            except RuntimeError:
+                # 事件循环已关闭
+                break
+
+    def _deliver(self, generation, item):
+        # 打断标记之前读出的数据属于被打断的语音，直接丢弃
+        if generation != self._generation:
+            return
+        self._items.append(item)
+        self._event.set()
+
+    async def get(self):
+        while not self._items:
+            self._event.clear()
+            await self._event.wait()
+        return self._items.popleft()
+
+    def unget(self, item):
+        """把取出的数据放回队首"""
+        self._items.appendleft(item)
+        self._event.set()
+
+    def clear(self):
+        """丢弃所有尚未发出的响应，包括此刻仍在子进程队列中的（在事件循环线程中调用）"""
+        self._generation += 1
+        self._items.clear()
+        try:
+            self.mp_queue.put_nowait((self._CLEAR_MARKER, self._generation))
+        except Exception as e:
+            logger.warning(f"写入TTS响应队列打断标记失败: {e}")
+
+
 def step_realtime_tts_worker(request_queue, response_queue, audio_api_key, voice_id, free_mode=False):
     """
     StepFun实时TTS worker（用于默认音色）
@@ -46,6 +130,7 @@ def step_realtime_tts_worker(request_queue, response_queue, audio_api_key, voice
         ws = None
         current_speech_id = None
         receive_task = None
+        resampler = StreamingResampler()
         session_id = None
         session_ready = asyncio.Event()
         
@@ -145,15 +230,20 @@ def step_realtime_tts_worker(request_queue, response_queue, audio_api_key, voice
                                     with io.BytesIO(audio_bytes) as wav_io:
                                         with wave.open(wav_io, 'rb') as wav_file:
                                             # 读取音频数据
+                                            in_rate = wav_file.getframerate()
                                             pcm_data = wav_file.readframes(wav_file.getnframes())
                                     
-                                    # 转换为 numpy 数组
-                                    audio_array = np.frombuffer(pcm_data, dtype=np.int16)
                                     # 重采样 24000Hz -> 48000Hz
-                                    resampled = np.repeat(audio_array, 48000 // 24000)
-                                    response_queue.put(resampled.tobytes())
+                                    resampled = resampler.resample(pcm_data, current_speech_id, in_rate)
+                                    if resampled:
+                                        response_queue.put(resampled)
                             except Exception as e:
                                 logger.error(f"处理音频数据时出错: {e}")
+                        elif event_type == "tts.response.audio.done":
+                            # 本段语音结束，取出重采样器中剩余的尾部采样
+                            tail = resampler.flush()
+                            if tail:
+                                response_queue.put(tail)
                 except websockets.exceptions.ConnectionClosed:
                     pass
                 except Exception as e:
@@ -255,15 +345,20 @@ def step_realtime_tts_worker(request_queue, response_queue, audio_api_key, voice
                                                 with io.BytesIO(audio_bytes) as wav_io:
                                                     with wave.open(wav_io, 'rb') as wav_file:
                                                         # 读取音频数据
+                                                        in_rate = wav_file.getframerate()
                                                         pcm_data = wav_file.readframes(wav_file.getnframes())
                                                 
-                                                # 转换为 numpy 数组
-                                                audio_array = np.frombuffer(pcm_data, dtype=np.int16)
                                                 # 重采样 24000Hz -> 48000Hz
-                                                resampled = np.repeat(audio_array, 48000 // 24000)
-                                                response_queue.put(resampled.tobytes())
+                                                resampled = resampler.resample(pcm_data, current_speech_id, in_rate)
+                                                if resampled:
+                                                    response_queue.put(resampled)
                                         except Exception as e:
                                             logger.error(f"处理音频数据时出错: {e}")
+                                    elif event_type == "tts.response.audio.done":
+                                        # 本段语音结束，取出重采样器中剩余的尾部采样
+                                        tail = resampler.flush()
+                                        if tail:
+                                            response_queue.put(tail)
                             except websockets.exceptions.ConnectionClosed:
                                 pass
                             except Exception as e:
@@ -347,6 +442,7 @@ def qwen_realtime_tts_worker(request_queue, response_queue, audio_api_key, voice
         ws = None
         current_speech_id = None
         receive_task = None
+        resampler = StreamingResampler()
         session_ready = asyncio.Event()
         
         try:
@@ -422,11 +518,16 @@ def qwen_realtime_tts_worker(request_queue, response_queue, audio_api_key, voice
                         elif event_type == "response.audio.delta":
                             try:
                                 audio_bytes = base64.b64decode(event.get("delta", ""))
-                                audio_array = np.frombuffer(audio_bytes, dtype=np.int16)
-                                resampled = np.repeat(audio_array, 2)
-                                response_queue.put(resampled.tobytes())
+                                resampled = resampler.resample(audio_bytes, current_speech_id)
+                                if resampled:
+                                    response_queue.put(resampled)
                             except Exception as e:
                                 logger.error(f"处理音频数据时出错: {e}")
+                        elif event_type == "response.audio.done":
+                            # 本段语音结束，取出重采样器中剩余的尾部采样
+                            tail = resampler.flush()
+                            if tail:
+                                response_queue.put(tail)
                 except websockets.exceptions.ConnectionClosed:
                     pass
                 except Exception as e:
@@ -511,11 +612,16 @@ def qwen_realtime_tts_worker(request_queue, response_queue, audio_api_key, voice
                                     elif event_type == "response.audio.delta":
                                         try:
                                             audio_bytes = base64.b64decode(event.get("delta", ""))
-                                            audio_array = np.frombuffer(audio_bytes, dtype=np.int16)
-                                            resampled = np.repeat(audio_array, 2)
-                                            response_queue.put(resampled.tobytes())
+                                            resampled = resampler.resample(audio_bytes, current_speech_id)
+                                            if resampled:
+                                                response_queue.put(resampled)
                                         except Exception as e:
                                             logger.error(f"处理音频数据时出错: {e}")
+                                    elif event_type == "response.audio.done":
+                                        # 本段语音结束，取出重采样器中剩余的尾部采样
+                                        tail = resampler.flush()
+                                        if tail:
+                                            response_queue.put(tail)
                             except websockets.exceptions.ConnectionClosed:
                                 pass
                             except Exception as e:
@@ -597,16 +703,17 @@ def cosyvoice_vc_tts_worker(request_queue, response_queue, audio_api_key, voice_
     class Callback(ResultCallback):
         def __init__(self, response_queue):
             self.response_queue = response_queue
-            self.cache = np.zeros(0).astype(np.float32)
+            self.speech_id = None
+            # 收到的音频包直接流式重采样，写入环形缓冲区，凑满一帧就发出
+            self.frames = FramedResampler(COSYVOICE_OUTPUT_FRAME_SAMPLES)
             
         def on_open(self): 
             pass
             
         def on_complete(self): 
-            if len(self.cache) > 0:
-                data = (soxr.resample(self.cache, 24000, 48000, quality='HQ') * 32768.).clip(-32768, 32767).astype(np.int16).tobytes()
-                self.response_queue.put(data)
-                self.cache = np.zeros(0).astype(np.float32)
+            # 本段语音结束，发出重采样尾部与不足一帧的剩余数据
+            for frame in self.frames.finish():
+                self.response_queue.put(frame)
                 
         def on_error(self, message: str): 
             print(f"TTS Error: {message}")
@@ -618,24 +725,15 @@ def cosyvoice_vc_tts_worker(request_queue, response_queue, audio_api_key, voice_
             pass
             
         def on_data(self, data: bytes) -> None:
-            audio = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
-            self.cache = np.concatenate([self.cache, audio])
-            if len(self.cache) >= 8000:
-                data = self.cache[:8000]
-                data = (soxr.resample(data, 24000, 48000, quality='HQ') * 32768.).clip(-32768, 32767).astype(np.int16).tobytes()
-                self.response_queue.put(data)
-                self.cache = self.cache[8000:]
+            for frame in self.frames.feed(data, self.speech_id):
+                self.response_queue.put(frame)
             
     callback = Callback(response_queue)
     current_speech_id = None
     synthesizer = None
     
     while True:
-        # 非阻塞检查队列，优先处理打断
-        if request_queue.empty():
-            time.sleep(0.01)
-            continue
-
+        # 阻塞等待下一个请求，有请求时立即处理，空闲时不占CPU
         sid, tts_text = request_queue.get()
 
         if sid is None:
@@ -655,6 +753,9 @@ def cosyvoice_vc_tts_worker(request_queue, response_queue, audio_api_key, voice_
                         synthesizer.close()
                     except Exception:
                         pass
+                # 新的一段语音：丢弃上一段未发出的缓存与重采样状态
+                callback.speech_id = sid
+                callback.frames.reset()
                 synthesizer = SpeechSynthesizer(
                     model="cosyvoice-v3-plus",
                     voice=voice_id,
@@ -669,7 +770,6 @@ def cosyvoice_vc_tts_worker(request_queue, response_queue, audio_api_key, voice_
                 continue
                     
         if tts_text is None or not tts_text.strip():
-            time.sleep(0.01)
             continue
             
         # 处理表情等逻辑
@@ -706,6 +806,7 @@ def cogtts_tts_worker(request_queue, response_queue, audio_api_key, voice_id):
         tts_url = "https://open.bigmodel.cn/api/paas/v4/audio/speech"
         current_speech_id = None
         text_buffer = []  # 累积文本缓冲区
+        resampler = StreamingResampler()
         
         # CogTTS 是基于 HTTP 的，无需建立持久连接，直接发送就绪信号
         logger.info("CogTTS TTS 已就绪，发送就绪信号")
@@ -795,8 +896,7 @@ def cogtts_tts_worker(request_queue, response_queue, audio_api_key, voice_id):
                                                                     # 从返回的 return_sample_rate 获取采样率
                                                                     sample_rate = delta.get('return_sample_rate', 24000)
                                                                     
-                                                                    # 转换为 float32 进行高质量重采样
-                                                                    audio_array = np.frombuffer(audio_bytes, dtype=np.int16).astype(np.float32) / 32768.0
+                                                                    audio_array = np.frombuffer(audio_bytes, dtype=np.int16)
                                                                     
                                                                     # 对第一个音频块，裁剪掉开头的噪音部分（CogTTS有初始化噪音）
                                                                     if not first_audio_received:
@@ -810,17 +910,21 @@ def cogtts_tts_worker(request_queue, response_queue, audio_api_key, voice_id):
                                                                         fade_samples = min(int(sample_rate * 0.01), len(audio_array))
                                                                         if fade_samples > 0:
                                                                             fade_curve = np.linspace(0.0, 1.0, fade_samples)
-                                                                            audio_array[:fade_samples] *= fade_curve
-                                                                    
-                                                                    # 使用 soxr 进行高质量重采样
-                                                                    resampled = soxr.resample(audio_array, sample_rate, 48000, quality='HQ')
-                                                                    # 转回 int16 格式
-                                                                    resampled_int16 = (resampled * 32768.0).clip(-32768, 32767).astype(np.int16)
-                                                                    response_queue.put(resampled_int16.tobytes())
+                                                                            audio_array = audio_array.copy()
+                                                                            audio_array[:fade_samples] = (audio_array[:fade_samples] * fade_curve).astype(np.int16)
+
+                                                                    # 流式重采样，同一段语音的各块共享滤波器状态
+                                                                    resampled = resampler.resample(audio_array, current_speech_id, sample_rate)
+                                                                    if resampled:
+                                                                        response_queue.put(resampled)
                                                         except json.JSONDecodeError as e:
                                                             logger.warning(f"解析SSE JSON失败: {e}")
                                                         except Exception as e:
                                                             logger.error(f"处理音频数据时出错: {e}")
+                                            # 音频流结束，取出尾部采样
+                                            tail = resampler.flush()
+                                            if tail:
+                                                response_queue.put(tail)
                                         else:
                                             error_text = await resp.text()
                                             logger.error(f"CogTTS API错误 ({resp.status}): {error_text}")
@@ -63,6 +63,7 @@ from config import MAIN_SERVER_PORT, MONITOR_SERVER_PORT, MEMORY_SERVER_PORT, MO
 from config.prompts_sys import emotion_analysis_prompt, proactive_chat_prompt
 import glob
 from utils.config_manager import get_config_manager
+from utils.journal_store import JournalStore, JOURNAL_SUFFIX
 # 导入创意工坊工具模块
 from utils.workshop_utils import (
     load_workshop_config,
@@ -830,6 +831,7 @@ async def update_core_config(request: Request):
         
         with open(core_config_path, 'w', encoding='utf-8') as f:
             json.dump(core_cfg, f, indent=2, ensure_ascii=False)
+        config_manager.invalidate_config_cache('core_config.json')
         
         # API配置更新后，需要先通知所有客户端，再关闭session，最后重新加载配置
         logger.info("API配置已更新，准备通知客户端并重置所有session...")
@@ -956,6 +958,23 @@ async def shutdown_event():
         logger.warning(f"向memory_server发送关闭信号时出错: {e}")
 
 
+# 麦克风音频的二进制帧：4字节头 [帧类型 u8][协议版本 u8][保留 u16] + 小端int16 PCM（16kHz单声道）
+# 相比 JSON 整数数组，省去逐个样本的解析与打包，上行数据量约为原来的1/3
+WS_AUDIO_FRAME_TYPE = 0x01
+WS_AUDIO_FRAME_VERSION = 1
+WS_AUDIO_FRAME_HEADER_SIZE = 4
+
+
+def _parse_audio_frame(payload: bytes):
+    """解析二进制音频帧，返回PCM数据；帧格式不正确时返回None"""
+    if (len(payload) < WS_AUDIO_FRAME_HEADER_SIZE
+            or payload[0] != WS_AUDIO_FRAME_TYPE
+            or payload[1] != WS_AUDIO_FRAME_VERSION
+            or (len(payload) - WS_AUDIO_FRAME_HEADER_SIZE) % 2):
+        return None
+    return payload[WS_AUDIO_FRAME_HEADER_SIZE:]
+
+
 @app.websocket("/ws/{lanlan_name}")
 async def websocket_endpoint(websocket: WebSocket, lanlan_name: str):
     await websocket.accept()
@@ -978,12 +997,24 @@ async def websocket_endpoint(websocket: WebSocket, lanlan_name: str):
 
     try:
         while True:
-            data = await websocket.receive_text()
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
             if session_id[lanlan_name] != this_session_id:
                 await session_manager[lanlan_name].send_status(f"切换至另一个终端...")
                 await websocket.close()
                 break
-            message = json.loads(data)
+
+            # 二进制帧只用于麦克风音频，其余消息仍为JSON文本
+            if frame.get("bytes") is not None:
+                pcm = _parse_audio_frame(frame["bytes"])
+                if pcm is None:
+                    logger.warning(f"收到无法识别的二进制帧，长度: {len(frame['bytes'])}")
+                    continue
+                asyncio.create_task(session_manager[lanlan_name].stream_data({"input_type": "audio", "data": pcm}))
+                continue
+
+            message = json.loads(frame["text"])
             action = message.get("action")
             # logger.debug(f"WebSocket received action: {action}") # Optional debug log
 
@@ -2805,6 +2836,9 @@ async def delete_catgirl(name: str):
             f'time_indexed_{name}',     # 时间索引数据库文件
             f'settings_{name}.json',    # 设置文件
             f'recent_{name}.json',      # 最近聊天记录文件
+            f'recent_{name}.json.journal',  # 最近聊天记录的追加写日志
+            f'recent_{name}.json.reviewed',  # 最近聊天记录的已审阅消息指纹
+            f'summary_cache_{name}.json',   # 对话摘要缓存
         ]
         
         for base_dir in memory_paths:
@@ -2924,7 +2958,9 @@ async def get_recent_files():
     from utils.config_manager import get_config_manager
     cm = get_config_manager()
     files = glob.glob(str(cm.memory_dir / 'recent*.json'))
-    file_names = [os.path.basename(f) for f in files]
+    # 尚未合并过的新角色只有追加日志，没有快照文件
+    files += [f[:-len(JOURNAL_SUFFIX)] for f in glob.glob(str(cm.memory_dir / f'recent*.json{JOURNAL_SUFFIX}'))]
+    file_names = sorted({os.path.basename(f) for f in files})
     return {"files": file_names}
 
 @app.get('/api/memory/review_config')
@@ -2984,10 +3020,15 @@ async def get_recent_file(filename: str):
     file_path = str(cm.memory_dir / filename)
     if not (filename.startswith('recent') and filename.endswith('.json')):
         return JSONResponse({"success": False, "error": "文件名不合法"}, status_code=400)
-    if not os.path.exists(file_path):
+    store = JournalStore(file_path)
+    if not (os.path.exists(file_path) or store.has_journal()):
         return JSONResponse({"success": False, "error": "文件不存在"}, status_code=404)
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
+    if store.has_journal():
+        # 尚有未合并的追加日志，返回快照 + 日志回放后的完整内容
+        content = json.dumps(store.load(), ensure_ascii=False, indent=2)
+    else:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
     return {"content": content}
 
 @app.get("/api/live2d/model_config/{model_name}")
@@ -4697,8 +4738,8 @@ async def save_recent_file(request: Request):
             }
         })
     try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(arr, f, ensure_ascii=False, indent=2)
+        # 原子替换快照并清空追加日志，避免旧日志被回放到编辑后的内容上
+        JournalStore(file_path).rewrite(arr)
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -4728,6 +4769,9 @@ async def update_catgirl_name(request: Request):
         old_file_path = str(cm.memory_dir / old_filename)
         new_file_path = str(cm.memory_dir / new_filename)
         
+        # 先把追加日志合并进快照，重命名时只需要处理一个文件（只有日志的新角色也会因此生成快照）
+        JournalStore(old_file_path).compact()
+        
         # 检查旧文件是否存在
         if not os.path.exists(old_file_path):
             logger.warning(f"记忆文件不存在: {old_file_path}")
@@ -4736,6 +4780,12 @@ async def update_catgirl_name(request: Request):
         # 如果新文件已存在，先删除
         if os.path.exists(new_file_path):
             os.remove(new_file_path)
+        for suffix in ('.journal', '.reviewed'):
+            if os.path.exists(new_file_path + suffix):
+                os.remove(new_file_path + suffix)
+        # 重命名会改写消息中的角色名，旧的审阅指纹不再对应，删除后重新审阅
+        if os.path.exists(old_file_path + '.reviewed'):
+            os.remove(old_file_path + '.reviewed')
         
         # 重命名文件
         os.rename(old_file_path, new_file_path)
@@ -4789,8 +4839,7 @@ async def update_catgirl_name(request: Request):
                         data['content'] = content
         
         # 保存更新后的内容
-        with open(new_file_path, 'w', encoding='utf-8') as f:
-            json.dump(file_content, f, ensure_ascii=False, indent=2)
+        JournalStore(new_file_path).rewrite(file_content)
         
         logger.info(f"已更新猫娘名称从 '{old_name}' 到 '{new_name}' 的记忆文件")
         return {"success": True}
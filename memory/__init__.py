@@ -1,3 +1,4 @@
+from .ingest import MemoryIngestQueue
 from .recent import CompressedRecentHistoryManager
 from .router import MemoryQueryRouter
 from .semantic import SemanticMemory
@@ -0,0 +1,458 @@
+"""
+角色记忆的流式导出/导入，用于备份与迁移。
+
+一个角色的全部记忆（近期记忆、设定、时间索引库、语义记忆向量库）导出为一个 gzip 压缩的 NDJSON 归档：
+- 第一行为归档头（格式、版本、角色名、导出时间）
+- 中间每行一条记录，带所属分区，如 recent、settings、time/<表名>、vectors/<集合名>
+- 最后一行为校验清单：每个分区的记录数与 sha256，以及全部记录行的 sha256
+
+导出与导入都逐行处理，内存占用与归档大小无关。导入前先完整校验一遍归档；导入进度记录在
+<归档>.progress.json 中，中断后再次执行会跳过已完成的分区与已提交的时间索引批次。
+导入会直接改写记忆文件，请在 memory_server 停止时执行，或执行后调用 /reload。
+
+用法：
+    python -m memory.archive export <角色名> <归档路径>
+    python -m memory.archive import <归档路径> [--as <角色名>] [--overwrite]
+    python -m memory.archive verify <归档路径>
+"""
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import os
+import zlib
+from datetime import datetime
+
+from sqlalchemy import text
+
+from config import TIME_ORIGINAL_TABLE_NAME, TIME_COMPRESSED_TABLE_NAME, TIME_ROLLUP_TABLE_NAME
+from memory.timeindex import open_engine
+from memory.vectorstore import collection_paths
+from utils.config_manager import get_config_manager
+from utils.journal_store import JournalStore, JOURNAL_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FORMAT = 'neko-memory-archive'
+ARCHIVE_VERSION = 1
+TIME_TABLES = (TIME_ORIGINAL_TABLE_NAME, TIME_COMPRESSED_TABLE_NAME, TIME_ROLLUP_TABLE_NAME)
+VECTOR_COLLECTIONS = ('Origin', 'Compressed')
+# 导入时间索引库时每个事务写入的行数，也是断点续传的粒度
+IMPORT_BATCH_SIZE = 500
+
+
+def memory_paths(lanlan_name):
+    """角色各记忆存储的路径，与 ConfigManager.get_character_data 的约定一致"""
+    memory_base = str(get_config_manager().memory_dir)
+    return {
+        'recent': os.path.join(memory_base, f'recent_{lanlan_name}.json'),
+        'settings': os.path.join(memory_base, f'settings_{lanlan_name}.json'),
+        'time': os.path.join(memory_base, f'time_indexed_{lanlan_name}'),
+        'semantic': os.path.join(memory_base, f'semantic_memory_{lanlan_name}'),
+    }
+
+
+# --- 导出 ---
+
+def _iter_vectors(persist_directory, collection):
+    matrix_path, records_path, meta_path = collection_paths(persist_directory, collection)
+    if not os.path.exists(meta_path) or not os.path.exists(records_path):
+        return
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    dim = meta.get('dim')
+    if not dim:
+        return
+    with open(records_path, 'r', encoding='utf-8') as records, open(matrix_path, 'rb') as matrix:
+        for line in records:
+            row = matrix.read(dim * 4)
+            if not line.endswith('\n') or len(row) < dim * 4:
+                break  # 崩溃遗留的不完整记录，与 LocalVectorStore 加载时的处理一致
+            yield {'record': json.loads(line), 'vector': base64.b64encode(row).decode('ascii'),
+                   'dim': dim, 'model': meta.get('model')}
+
+
+def iter_records(lanlan_name):
+    """按分区依次产出 (分区名, 记录)"""
+    paths = memory_paths(lanlan_name)
+
+    # 近期记忆受压缩约束，条数很少，可以整体读取
+    for item in JournalStore(paths['recent']).load():
+        yield 'recent', {'data': item}
+
+    if os.path.exists(paths['settings']):
+        with open(paths['settings'], 'r', encoding='utf-8') as f:
+            yield 'settings', {'data': json.load(f)}
+
+    if os.path.exists(paths['time']):
+        engine = open_engine(paths['time'])
+        try:
+            # 在同一个读事务中导出所有表，得到一致的快照
+            with engine.connect() as conn, conn.begin():
+                for table in TIME_TABLES:
+                    for row in conn.execute(text(f"SELECT * FROM {table} ORDER BY id")):
+                        yield f'time/{table}', {'row': dict(row._mapping)}
+        finally:
+            engine.dispose()
+
+    for collection in VECTOR_COLLECTIONS:
+        for record in _iter_vectors(paths['semantic'], collection):
+            yield f'vectors/{collection}', record
+
+
+def iter_archive_lines(lanlan_name):
+    """产出归档的每一行（bytes，含换行），最后一行为校验清单"""
+    header = {'type': 'header', 'format': ARCHIVE_FORMAT, 'version': ARCHIVE_VERSION,
+              'character': lanlan_name, 'created': datetime.now().isoformat()}
+    yield (json.dumps(header, ensure_ascii=False) + '\n').encode('utf-8')
+    total = hashlib.sha256()
+    sections = {}
+    for section, record in iter_records(lanlan_name):
+        line = (json.dumps({'section': section, **record}, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+        if section not in sections:
+            sections[section] = {'count': 0, 'hash': hashlib.sha256()}
+        sections[section]['count'] += 1
+        sections[section]['hash'].update(line)
+        total.update(line)
+        yield line
+    manifest = {
+        'type': 'manifest',
+        'sections': {name: {'count': s['count'], 'sha256': s['hash'].hexdigest()} for name, s in sections.items()},
+        'sha256': total.hexdigest(),
+    }
+    yield (json.dumps(manifest, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def iter_archive_gzip(lanlan_name, chunk_size=64 * 1024):
+    """以gzip压缩块的形式产出归档，供HTTP流式下载"""
+    compressor = zlib.compressobj(wbits=31)  # 31: gzip格式
+    buffer = []
+    size = 0
+    for line in iter_archive_lines(lanlan_name):
+        buffer.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            chunk = compressor.compress(b''.join(buffer))
+            buffer, size = [], 0
+            if chunk:
+                yield chunk
+    yield compressor.compress(b''.join(buffer)) + compressor.flush()
+
+
+def export_character(lanlan_name, archive_path):
+    """导出角色记忆到归档文件，返回校验清单"""
+    tmp_path = archive_path + '.tmp'
+    last = None
+    with gzip.open(tmp_path, 'wb') as f:
+        for line in iter_archive_lines(lanlan_name):
+            f.write(line)
+            last = line
+    os.replace(tmp_path, archive_path)
+    manifest = json.loads(last)
+    logger.info(f"[MemoryArchive] {lanlan_name} 已导出到 {archive_path}：" +
+                "，".join(f"{name} {s['count']}条" for name, s in manifest['sections'].items()))
+    return manifest
+
+
+# --- 校验 ---
+
+def _iter_archive(archive_path):
+    """产出 (原始行, 解析后的对象)，校验归档头"""
+    with gzip.open(archive_path, 'rb') as f:
+        header_line = f.readline()
+        try:
+            header = json.loads(header_line)
+        except json.JSONDecodeError:
+            raise ValueError(f"不是有效的记忆归档: {archive_path}")
+        if header.get('format') != ARCHIVE_FORMAT or header.get('version') != ARCHIVE_VERSION:
+            raise ValueError(f"不支持的归档格式: {header.get('format')} v{header.get('version')}")
+        yield header_line, header
+        for line in f:
+            if not line.endswith(b'\n'):
+                raise ValueError("归档被截断")
+            yield line, json.loads(line)
+
+
+def verify_archive(archive_path):
+    """完整读取一遍归档并核对校验清单，返回 (归档头, 校验清单)；不一致时抛出 ValueError"""
+    total = hashlib.sha256()
+    sections = {}
+    header = manifest = None
+    for line, obj in _iter_archive(archive_path):
+        if obj.get('type') == 'header':
+            header = obj
+        elif obj.get('type') == 'manifest':
+            manifest = obj
+        elif manifest is not None:
+            raise ValueError("校验清单之后还有数据")
+        else:
+            section = sections.setdefault(obj['section'], {'count': 0, 'hash': hashlib.sha256()})
+            section['count'] += 1
+            section['hash'].update(line)
+            total.update(line)
+    if manifest is None:
+        raise ValueError("归档缺少校验清单（导出未完成或文件被截断）")
+    actual = {name: {'count': s['count'], 'sha256': s['hash'].hexdigest()} for name, s in sections.items()}
+    if actual != manifest['sections'] or total.hexdigest() != manifest['sha256']:
+        mismatched = sorted(name for name in set(actual) | set(manifest['sections'])
+                            if actual.get(name) != manifest['sections'].get(name))
+        raise ValueError(f"归档校验失败，不一致的分区: {', '.join(mismatched) or '全部'}")
+    return header, manifest
+
+
+# --- 导入 ---
+
+class _JsonListWriter:
+    """把记录逐条写成JSON列表文件，分区结束时原子替换目标文件"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path + '.importing', 'w', encoding='utf-8')
+        self._file.write('[')
+        self._count = 0
+
+    def add(self, record):
+        if self._count:
+            self._file.write(',\n')
+        self._file.write(json.dumps(record['data'], ensure_ascii=False))
+        self._count += 1
+
+    def finish(self):
+        self._file.write(']')
+        self._file.close()
+        os.replace(self.path + '.importing', self.path)
+        # 快照被替换后旧日志本就不会回放，这里直接删除
+        if os.path.exists(self.path + JOURNAL_SUFFIX):
+            os.remove(self.path + JOURNAL_SUFFIX)
+
+
+class _SettingsWriter:
+    def __init__(self, path):
+        self.path = path
+        self._data = None
+
+    def add(self, record):
+        self._data = record['data']
+
+    def finish(self):
+        tmp_path = self.path + '.importing'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+class _VectorWriter:
+    """向量与记录先写入临时文件，分区结束时连同元数据一起替换"""
+
+    def __init__(self, persist_directory, collection):
+        os.makedirs(persist_directory, exist_ok=True)
+        self.paths = collection_paths(persist_directory, collection)
+        self._matrix = open(self.paths[0] + '.importing', 'wb')
+        self._records = open(self.paths[1] + '.importing', 'w', encoding='utf-8')
+        self._meta = None
+
+    def add(self, record):
+        self._meta = {'dim': record['dim'], 'model': record['model']}
+        self._matrix.write(base64.b64decode(record['vector']))
+        self._records.write(json.dumps(record['record'], ensure_ascii=False) + '\n')
+
+    def finish(self):
+        self._matrix.close()
+        self._records.close()
+        with open(self.paths[2] + '.importing', 'w', encoding='utf-8') as f:
+            json.dump(self._meta, f)
+        for path in self.paths:
+            os.replace(path + '.importing', path)
+
+
+class _TimeTableWriter:
+    """按批提交到时间索引库；保留原始id并使用 INSERT OR REPLACE，重放已提交的批次不会产生重复"""
+
+    def __init__(self, engine, table, on_commit):
+        self.engine = engine
+        self.table = table
+        self.on_commit = on_commit
+        self._batch = []
+
+    def add(self, record):
+        self._batch.append(record['row'])
+        if len(self._batch) >= IMPORT_BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if not self._batch:
+            return
+        columns = list(self._batch[0])
+        statement = text(f"INSERT OR REPLACE INTO {self.table} ({', '.join(columns)}) "
+                         f"VALUES ({', '.join(':' + c for c in columns)})")
+        with self.engine.begin() as conn:
+            conn.execute(statement, self._batch)
+        self.on_commit(len(self._batch))
+        self._batch = []
+
+    def finish(self):
+        self._flush()
+
+
+def _has_data(paths):
+    if JournalStore(paths['recent']).load() or os.path.exists(paths['settings']):
+        return True
+    if os.path.exists(paths['time']):
+        engine = open_engine(paths['time'])
+        try:
+            with engine.connect() as conn:
+                if any(conn.execute(text(f"SELECT 1 FROM {table} LIMIT 1")).first() for table in TIME_TABLES):
+                    return True
+        finally:
+            engine.dispose()
+    return any(os.path.exists(collection_paths(paths['semantic'], c)[1]) for c in VECTOR_COLLECTIONS)
+
+
+def _remove_stores(paths):
+    candidates = [paths['recent'], paths['recent'] + JOURNAL_SUFFIX, paths['settings'],
+                  paths['time'], paths['time'] + '-wal', paths['time'] + '-shm']
+    for collection in VECTOR_COLLECTIONS:
+        candidates.extend(collection_paths(paths['semantic'], collection))
+    for path in candidates:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _archive_identity(archive_path, manifest):
+    st = os.stat(archive_path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': manifest['sha256']}
+
+
+def import_character(archive_path, lanlan_name=None, overwrite=False):
+    """
+    从归档导入角色记忆，返回校验清单。
+
+    Args:
+        archive_path: 归档文件路径
+        lanlan_name: 导入为哪个角色，默认使用归档中的角色名
+        overwrite: 目标角色已有记忆时先删除再导入；否则拒绝导入
+    """
+    progress_path = archive_path + '.progress.json'
+    progress = None
+    if os.path.exists(progress_path):
+        with open(progress_path, 'r', encoding='utf-8') as f:
+            progress = json.load(f)
+
+    def save_progress():
+        tmp_path = progress_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(progress, f, ensure_ascii=False)
+        os.replace(tmp_path, progress_path)
+
+    if progress is not None:
+        st = os.stat(archive_path)
+        archive = progress['archive']
+        if (archive['size'], archive['mtime_ns']) != (st.st_size, st.st_mtime_ns) or \
+                (lanlan_name is not None and lanlan_name != progress['target']):
+            raise ValueError(f"{progress_path} 与当前归档或目标角色不匹配，请删除后重新导入")
+        lanlan_name = progress['target']
+        logger.info(f"[MemoryArchive] 继续导入 {lanlan_name}，已完成分区: {', '.join(progress['completed']) or '无'}")
+    else:
+        header, manifest = verify_archive(archive_path)
+        lanlan_name = lanlan_name or header['character']
+        paths = memory_paths(lanlan_name)
+        if _has_data(paths):
+            if not overwrite:
+                raise ValueError(f"角色 {lanlan_name} 已有记忆，如需覆盖请使用 overwrite")
+            _remove_stores(paths)
+        progress = {'archive': _archive_identity(archive_path, manifest), 'target': lanlan_name,
+                    'completed': [], 'committed': {}}
+        save_progress()
+
+    paths = memory_paths(lanlan_name)
+    get_config_manager().ensure_memory_directory()
+    engine = None
+    writer = None
+    section = None
+    skip = 0
+    manifest = None
+
+    def on_commit(count):
+        progress['committed'][section] = progress['committed'].get(section, 0) + count
+        save_progress()
+
+    def open_writer(name):
+        nonlocal engine
+        kind, _, sub = name.partition('/')
+        if kind == 'recent':
+            return _JsonListWriter(paths['recent'])
+        if kind == 'settings':
+            return _SettingsWriter(paths['settings'])
+        if kind == 'time' and sub in TIME_TABLES:
+            if engine is None:
+                engine = open_engine(paths['time'])
+            return _TimeTableWriter(engine, sub, on_commit)
+        if kind == 'vectors' and sub in VECTOR_COLLECTIONS:
+            return _VectorWriter(paths['semantic'], sub)
+        raise ValueError(f"未知的归档分区: {name}")
+
+    def finish_section():
+        if writer is not None:
+            writer.finish()
+            progress['completed'].append(section)
+            progress['committed'].pop(section, None)
+            save_progress()
+
+    try:
+        for _, obj in _iter_archive(archive_path):
+            kind = obj.get('type')
+            if kind == 'header':
+                continue
+            if kind == 'manifest':
+                manifest = obj
+                break
+            if obj['section'] != section:
+                finish_section()
+                section = obj['section']
+                done = section in progress['completed']
+                writer = None if done else open_writer(section)
+                # 只有时间索引库按批提交，其他分区未完成时整体重做
+                skip = progress['committed'].get(section, 0) if not done else 0
+            if writer is None:
+                continue
+            if skip:
+                skip -= 1
+                continue
+            writer.add(obj)
+        finish_section()
+    finally:
+        if engine is not None:
+            engine.dispose()
+
+    if manifest is None or manifest['sha256'] != progress['archive']['sha256']:
+        raise ValueError("归档在导入期间被修改，请删除进度文件后重新导入")
+    os.remove(progress_path)
+    logger.info(f"[MemoryArchive] 已从 {archive_path} 导入 {lanlan_name}：" +
+                "，".join(f"{name} {s['count']}条" for name, s in manifest['sections'].items()))
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='角色记忆的导出/导入')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='导出角色记忆')
+    export_parser.add_argument('lanlan_name')
+    export_parser.add_argument('archive_path')
+    import_parser = subparsers.add_parser('import', help='导入角色记忆（中断后重新执行即可续传）')
+    import_parser.add_argument('archive_path')
+    import_parser.add_argument('--as', dest='lanlan_name', help='导入为指定角色，默认使用归档中的角色名')
+    import_parser.add_argument('--overwrite', action='store_true', help='目标角色已有记忆时覆盖')
+    verify_parser = subparsers.add_parser('verify', help='校验归档')
+    verify_parser.add_argument('archive_path')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'export':
+        result = export_character(args.lanlan_name, args.archive_path)
+    elif args.command == 'import':
+        result = import_character(args.archive_path, args.lanlan_name, args.overwrite)
+    else:
+        result = verify_archive(args.archive_path)[1]
+    print(json.dumps(result['sections'], ensure_ascii=False, indent=2))
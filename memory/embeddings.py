@@ -0,0 +1,211 @@
+"""
+带缓存与请求合批的embedding封装。
+
+- 缓存：以 (模型名, 文本哈希) 为键持久化在 SQLite 中，超出容量时按最近使用时间淘汰。
+  重复的寒暄、常用语以及相同的回忆查询不会再产生API调用。
+- 合批：几毫秒内并发到达的 aembed_documents / aembed_query 请求会被合并为一次API请求。
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """(模型, 文本哈希) -> 向量 的持久化LRU缓存"""
+
+    def __init__(self, path, max_entries=50000):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_cache ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model, text):
+        return f"{model}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def get_many(self, keys):
+        """返回 {key: 向量}，只包含命中的键"""
+        if not keys:
+            return {}
+        found = {}
+        now = time.time()
+        with self._lock:
+            unique = list(set(keys))
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embedding_cache WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                self._conn.executemany(
+                    "UPDATE embedding_cache SET last_used = ? WHERE key = ?", [(now, k) for k in found]
+                )
+                self._conn.commit()
+        self.hits += sum(1 for k in keys if k in found)
+        self.misses += sum(1 for k in keys if k not in found)
+        return found
+
+    def put_many(self, items):
+        """items: {key: 向量}"""
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (key, vector, last_used) VALUES (?, ?, ?)",
+                [(k, np.asarray(v, dtype=np.float32).tobytes(), now) for k, v in items.items()]
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM embedding_cache WHERE key IN "
+                    "(SELECT key FROM embedding_cache ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+
+class CachedEmbeddings:
+    """包装任意 embeddings 对象（OpenAIEmbeddings 等），提供缓存与异步请求合批"""
+
+    def __init__(self, embeddings, cache: EmbeddingCache, batch_window=0.005, max_batch_size=64):
+        """
+        Args:
+            embeddings: 实际发起请求的embeddings对象
+            cache: 持久化缓存
+            batch_window: 合批等待时间（秒）
+            max_batch_size: 单次API请求的最大文本数
+        """
+        self.embeddings = embeddings
+        self.cache = cache
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.model = getattr(embeddings, 'model', None) or type(embeddings).__name__
+        self.api_calls = 0
+        self._pending = {}  # {key: (text, [asyncio.Future, ...])}，等待合批
+        self._inflight = {}  # {key: (text, [asyncio.Future, ...])}，已发出、结果尚未写入缓存
+        self._flush_handle = None
+
+    def _key(self, text):
+        return EmbeddingCache.make_key(self.model, text)
+
+    # --- 同步接口 ---
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        keys = [self._key(t) for t in texts]
+        found = self.cache.get_many(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            miss_keys = list(missing)
+            vectors = []
+            for start in range(0, len(miss_keys), self.max_batch_size):
+                chunk = miss_keys[start:start + self.max_batch_size]
+                self.api_calls += 1
+                vectors.extend(self.embeddings.embed_documents([missing[k] for k in chunk]))
+            new_items = dict(zip(miss_keys, vectors))
+            self.cache.put_many(new_items)
+            found.update(new_items)
+        return [found[k] for k in keys]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    # --- 异步接口（合批） ---
+
+    async def aembed_documents(self, texts):
+        texts = list(texts)
+        keys = [self._key(t) for t in texts]
+        # SQLite读写放到线程中，不阻塞事件循环
+        found = await asyncio.to_thread(self.cache.get_many, keys)
+        loop = asyncio.get_running_loop()
+        waiters = {}
+        for key, text in zip(keys, texts):
+            if key in found or key in waiters:
+                continue
+            future = loop.create_future()
+            waiters[key] = future
+            if key in self._inflight:
+                # 同一文本已在请求中，直接等待那次请求的结果
+                self._inflight[key][1].append(future)
+            elif key in self._pending:
+                self._pending[key][1].append(future)
+            else:
+                self._pending[key] = (text, [future])
+        if waiters:
+            if len(self._pending) >= self.max_batch_size:
+                self._schedule_flush(loop, 0)
+            elif self._pending:
+                self._schedule_flush(loop, self.batch_window)
+            results = await asyncio.gather(*waiters.values())
+            found.update(zip(waiters.keys(), results))
+        return [found[k] for k in keys]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+    def _schedule_flush(self, loop, delay):
+        if self._flush_handle is not None:
+            if delay > 0:
+                return
+            self._flush_handle.cancel()
+        self._flush_handle = loop.call_later(delay, lambda: asyncio.ensure_future(self._flush()))
+
+    async def _flush(self):
+        self._flush_handle = None
+        pending, self._pending = self._pending, {}
+        # 结果写入缓存之前，同一文本的新请求挂在 _inflight 上等待，不会重复发给API
+        self._inflight.update(pending)
+        keys = list(pending)
+        for start in range(0, len(keys), self.max_batch_size):
+            chunk = keys[start:start + self.max_batch_size]
+            try:
+                self.api_calls += 1
+                vectors = await self.embeddings.aembed_documents([pending[k][0] for k in chunk])
+            except Exception as e:
+                logger.error(f"Embedding请求失败: {e}")
+                for key in chunk:
+                    for future in self._inflight.pop(key)[1]:
+                        if not future.done():
+                            future.set_exception(e)
+                continue
+            try:
+                await asyncio.to_thread(self.cache.put_many, dict(zip(chunk, vectors)))
+            except Exception as e:
+                logger.warning(f"写入embedding缓存失败: {e}")
+            for key, vector in zip(chunk, vectors):
+                for future in self._inflight.pop(key)[1]:
+                    if not future.done():
+                        future.set_result(vector)
+
+    def stats(self):
+        return {**self.cache.stats(), 'api_calls': self.api_calls}
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryIngestQueue:
+    """
+    按角色合并记忆写入请求的防抖队列
+
+    /process 与 /renew 只负责入队并立即返回。同一角色在 debounce 窗口内到达的多批消息
+    会被合并为一个批次交给 handler：近期记忆只更新一次，但每个请求仍保留自己的消息与 detailed 标记，
+    可以按请求（会话）分别写入时间索引。
+    为避免持续有请求时永远不落盘，批次最迟在 max_delay 秒后强制处理。
+    读取近期记忆的接口（/new_dialog、/get_recent_history、/export）在读取前调用 flush()。
+
+    队列只在内存中：正常关闭时会先 flush，但进程崩溃或被强制结束时，最近 max_delay 秒内
+    尚未处理的消息会丢失。
+    """
+
+    def __init__(self, handler, debounce=5.0, max_delay=30.0):
+        """
+        Args:
+            handler: async (lanlan_name, payloads) -> None，处理一个合并后的批次，
+                payloads 为按入队顺序排列的 [(messages, detailed), ...]
+            debounce: 最后一次入队后等待多少秒无新请求才开始处理
+            max_delay: 批次中最早一条请求最多等待多少秒
+        """
+        self.handler = handler
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._pending = {}  # {lanlan_name: [(入队时间, messages, detailed), ...]}
+        self._workers = {}  # {lanlan_name: asyncio.Task}
+        self._wakeups = {}  # {lanlan_name: asyncio.Event}
+        self._stats = {}  # {lanlan_name: dict}
+        self._flushing = set()  # 正在强制落盘、跳过防抖等待的角色
+
+    def _get_stats(self, lanlan_name):
+        if lanlan_name not in self._stats:
+            self._stats[lanlan_name] = {
+                'batches': 0,
+                'payloads': 0,
+                'messages': 0,
+                'last_batch_size': 0,
+                'last_batch_seconds': 0.0,
+                'last_lag_seconds': 0.0,
+                'last_error': None,
+                'processing': False,
+            }
+        return self._stats[lanlan_name]
+
+    def enqueue(self, lanlan_name, messages, detailed=False):
+        """入队一批消息，返回该角色当前排队的请求数"""
+        self._pending.setdefault(lanlan_name, []).append((time.monotonic(), messages, detailed))
+        if lanlan_name in self._wakeups:
+            self._wakeups[lanlan_name].set()
+        worker = self._workers.get(lanlan_name)
+        if worker is None or worker.done():
+            self._workers[lanlan_name] = asyncio.create_task(self._worker(lanlan_name))
+        return len(self._pending[lanlan_name])
+
+    async def _wait_for_quiet(self, lanlan_name):
+        """等待 debounce 窗口内不再有新请求，或最早的请求已等满 max_delay"""
+        wakeup = self._wakeups.setdefault(lanlan_name, asyncio.Event())
+        while self._pending.get(lanlan_name) and lanlan_name not in self._flushing:
+            oldest = self._pending[lanlan_name][0][0]
+            remaining = self.max_delay - (time.monotonic() - oldest)
+            if remaining <= 0:
+                return
+            wakeup.clear()
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=min(self.debounce, remaining))
+            except asyncio.TimeoutError:
+                return
+
+    async def _worker(self, lanlan_name):
+        while self._pending.get(lanlan_name):
+            await self._wait_for_quiet(lanlan_name)
+            await self._process_pending(lanlan_name)
+
+    async def _process_pending(self, lanlan_name):
+        batch = self._pending.pop(lanlan_name, [])
+        if not batch:
+            return
+        payloads = [(messages, detailed) for _, messages, detailed in batch]
+        message_count = sum(len(messages) for messages, _ in payloads)
+        stats = self._get_stats(lanlan_name)
+        stats['processing'] = True
+        stats['last_lag_seconds'] = time.monotonic() - batch[0][0]
+        start = time.monotonic()
+        logger.info(f"[MemoryIngest] {lanlan_name} 合并 {len(batch)} 个请求，共 {message_count} 条消息")
+        try:
+            await self.handler(lanlan_name, payloads)
+            stats['last_error'] = None
+        except Exception as e:
+            logger.error(f"[MemoryIngest] {lanlan_name} 批次处理失败: {e}", exc_info=True)
+            stats['last_error'] = str(e)
+        finally:
+            stats['processing'] = False
+            stats['batches'] += 1
+            stats['payloads'] += len(batch)
+            stats['messages'] += message_count
+            stats['last_batch_size'] = len(batch)
+            stats['last_batch_seconds'] = time.monotonic() - start
+
+    async def flush(self, lanlan_name=None):
+        """立即处理排队中的请求（不等待防抖窗口），lanlan_name为None时处理所有角色"""
+        names = [lanlan_name] if lanlan_name is not None else list(set(self._pending) | set(self._workers))
+        for name in names:
+            self._flushing.add(name)
+            try:
+                if name in self._wakeups:
+                    self._wakeups[name].set()
+                worker = self._workers.get(name)
+                if worker and not worker.done():
+                    await worker
+                await self._process_pending(name)
+            finally:
+                self._flushing.discard(name)
+
+    def status(self):
+        """各角色的队列深度与延迟"""
+        now = time.monotonic()
+        result = {}
+        for name in set(self._pending) | set(self._stats):
+            pending = self._pending.get(name, [])
+            result[name] = {
+                'queue_depth': len(pending),
+                'queued_messages': sum(len(p) for _, p, _ in pending),
+                'lag_seconds': now - pending[0][0] if pending else 0.0,
+                **self._get_stats(name),
+            }
+        return result
@@ -0,0 +1,45 @@
+"""
+记忆组件共享的LLM客户端注册表。
+
+按 (模型, base_url, api_key, 温度, extra_body) 复用 ChatOpenAI 实例及其连接池，
+而不是每次调用都新建客户端、重新握手并重新读取配置文件。
+core_config.json 发生变化时清空注册表，配置热重载依然生效。
+"""
+import json
+import threading
+
+from langchain_openai import ChatOpenAI
+
+from utils.config_manager import get_config_manager
+
+_clients = {}
+_lock = threading.Lock()
+_core_config = None
+
+
+def get_core_config():
+    """ConfigManager 缓存的核心配置快照；快照更新（配置文件变化）时清空客户端注册表"""
+    global _core_config
+    core_config = get_config_manager().get_core_config()
+    with _lock:
+        if core_config is not _core_config:
+            _core_config = core_config
+            _clients.clear()
+    return core_config
+
+
+def get_chat_model(model, base_url, api_key, temperature=None, extra_body=None):
+    """获取共享的 ChatOpenAI 实例，参数相同的调用方复用同一个客户端"""
+    key = (model, base_url, api_key, temperature, json.dumps(extra_body, sort_keys=True))
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            kwargs = {'temperature': temperature} if temperature is not None else {}
+            client = ChatOpenAI(model=model, base_url=base_url, api_key=api_key, extra_body=extra_body, **kwargs)
+            _clients[key] = client
+        return client
+
+
+def stats():
+    with _lock:
+        return {'clients': len(_clients)}
@@ -0,0 +1,91 @@
+"""
+语义检索的本地粗排：BM25 + 向量相似度，使用倒数排名融合(RRF)合并。
+
+粗排负责去重和裁剪候选；只有当两路排序在前k名上分歧较大时，才需要调用LLM精排。
+"""
+import math
+import re
+from collections import Counter
+
+_WORD_PATTERN = re.compile(r'[a-z0-9]+|[\u4e00-\u9fff]')
+
+
+def tokenize(text):
+    """英文/数字按词切分，中文按单字 + 相邻双字切分"""
+    tokens = []
+    prev_cjk = None
+    for match in _WORD_PATTERN.finditer(text.lower()):
+        token = match.group()
+        if len(token) == 1 and '\u4e00' <= token <= '\u9fff':
+            tokens.append(token)
+            if prev_cjk is not None and match.start() == prev_cjk[1]:
+                tokens.append(prev_cjk[0] + token)
+            prev_cjk = (token, match.end())
+        else:
+            tokens.append(token)
+            prev_cjk = None
+    return tokens
+
+
+def bm25_scores(query, texts, k1=1.5, b=0.75):
+    """只在候选集合内部计算的BM25分数"""
+    docs = [Counter(tokenize(t)) for t in texts]
+    if not docs:
+        return []
+    avg_len = sum(sum(d.values()) for d in docs) / len(docs) or 1.0
+    query_terms = set(tokenize(query))
+    scores = []
+    for doc in docs:
+        doc_len = sum(doc.values())
+        score = 0.0
+        for term in query_terms:
+            tf = doc.get(term, 0)
+            if not tf:
+                continue
+            df = sum(1 for d in docs if term in d)
+            idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_len / avg_len))
+        scores.append(score)
+    return scores
+
+
+def reciprocal_rank_fusion(score_lists, k=60):
+    """score_lists: 多组与候选一一对应的分数（越大越好），返回融合分数"""
+    fused = [0.0] * (len(score_lists[0]) if score_lists else 0)
+    for scores in score_lists:
+        order = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+        for rank, idx in enumerate(order):
+            fused[idx] += 1.0 / (k + rank + 1)
+    return fused
+
+
+def prerank(query, scored_docs, k):
+    """
+    Args:
+        query: 查询文本
+        scored_docs: [(Document, 向量相似度), ...]，可能来自多个向量库，允许重复
+        k: 最终需要的条数，用于衡量两路排序在前k名上的一致程度
+
+    Returns:
+        (按融合分数排序的去重后文档列表, 一致度)
+        一致度为BM25与向量相似度各自的前k名的重合比例，越低说明本地排序越难以决定取舍
+    """
+    unique = {}
+    for doc, score in scored_docs:
+        key = re.sub(r'\s+', '', doc.page_content)
+        if key not in unique or score > unique[key][1]:
+            unique[key] = (doc, score)
+    candidates = list(unique.values())
+    if not candidates:
+        return [], 1.0
+    texts = [doc.page_content for doc, _ in candidates]
+    lexical = bm25_scores(query, texts)
+    vector = [s for _, s in candidates]
+    fused = reciprocal_rank_fusion([lexical, vector])
+    order = sorted(range(len(candidates)), key=lambda i: fused[i], reverse=True)
+
+    top_n = min(k, len(candidates))
+    top_lexical = set(sorted(range(len(candidates)), key=lambda i: lexical[i], reverse=True)[:top_n])
+    top_vector = set(sorted(range(len(candidates)), key=lambda i: vector[i], reverse=True)[:top_n])
+    agreement = len(top_lexical & top_vector) / top_n if top_n else 1.0
+    return [candidates[i][0] for i in order], agreement
@@ -1,8 +1,13 @@
 from datetime import datetime
-from config import MODELS_WITH_EXTRA_BODY
+from config import MODELS_WITH_EXTRA_BODY, RECENT_HISTORY_TOKEN_BUDGET, RECENT_HISTORY_KEEP_TOKENS, RECENT_SUMMARY_MAX_TOKENS
 from utils.config_manager import get_config_manager
-from langchain_openai import ChatOpenAI
+from utils.journal_store import JournalStore
+from memory.summary_cache import SummaryCache
+from memory.tokens import count_tokens, message_tokens, ensure_encoding
+from memory.llm_clients import get_chat_model, get_core_config
+from memory.scheduler import llm_scheduler, PRIORITY_INTERACTIVE, PRIORITY_INGEST, PRIORITY_BACKGROUND
 from langchain_core.messages import SystemMessage, messages_to_dict, messages_from_dict, HumanMessage, AIMessage
+import hashlib
 import json
 import os
 import asyncio
@@ -15,40 +20,198 @@ from config.prompts_sys import recent_history_manager_prompt, detailed_recent_hi
 from utils.logger_config import setup_logging
 logger, log_config = setup_logging(service_name="RecentMemory", log_level=logging.INFO)
 
+REVIEWED_SUFFIX = '.reviewed'  # 已审阅消息指纹文件，与历史记录文件放在一起
+
 class CompressedRecentHistoryManager:
-    def __init__(self, max_history_length=10):
+    def __init__(self, max_history_length=10, review_overlap=2, token_budget=RECENT_HISTORY_TOKEN_BUDGET, keep_tokens=RECENT_HISTORY_KEEP_TOKENS):
         self._config_manager = get_config_manager()
         # 通过get_character_data获取相关变量
         _, _, _, _, name_mapping, _, _, _, _, recent_log = self._config_manager.get_character_data()
         self.max_history_length = max_history_length
-        self.log_file_path = recent_log
+        self.review_overlap = review_overlap  # 增量审阅时，在新消息之前额外带上的已审阅消息数
+        self.token_budget = token_budget  # 历史记录总token数超过该值时触发压缩
+        self.keep_tokens = keep_tokens  # 压缩后保留的原文消息的token数上限
+        self.log_file_path = dict(recent_log)
         self.name_mapping = name_mapping
         self.user_histories = {}
+        self._stores = {}  # {文件路径: JournalStore}
+        # 内存中的历史记录是权威副本，仅当磁盘文件的 size/mtime 变化（如外部编辑）时才重新加载
+        self._history_stamps = {}  # {lanlan_name: (文件路径, JournalStore.stamp())}
+        self.cache_stats = {'hits': 0, 'misses': 0}
+        self._history_versions = {}  # {lanlan_name: int}，内存中的历史记录每变化一次加一
+        self._summary_caches = {}  # {lanlan_name: SummaryCache}
+        self._inflight_summaries = {}  # {缓存键: asyncio.Future}，合并并发的相同摘要请求
+        self._history_locks = {}  # {lanlan_name: asyncio.Lock}
+        self._reviewed = {}  # {lanlan_name: [消息指纹, ...]}，按顺序记录已审阅的消息，持久化在 <历史记录文件>.reviewed
+        self.compression_stats = {}  # {lanlan_name: dict}，压缩节省的token数与花费的LLM调用数
         for ln in self.log_file_path:
-            if os.path.exists(self.log_file_path[ln]):
-                with open(self.log_file_path[ln], encoding='utf-8') as f:
-                    self.user_histories[ln] = messages_from_dict(json.load(f))
-            else:
-                self.user_histories[ln] = []
+            self.user_histories[ln] = []
+            self._load_history(ln)
+
+    def _get_store(self, lanlan_name):
+        """获取角色历史记录文件对应的日志存储（快照 + 追加写日志）"""
+        file_path = self.log_file_path[lanlan_name]
+        if file_path not in self._stores:
+            self._stores[file_path] = JournalStore(file_path)
+        return self._stores[file_path]
+
+    def _load_history(self, lanlan_name):
+        """磁盘内容未变化时直接使用内存中的消息列表，否则重新读取并反序列化"""
+        if lanlan_name not in self.log_file_path:
+            return
+        store = self._get_store(lanlan_name)
+        # 新角色在第一次合并之前只有追加日志，没有快照文件
+        if not os.path.exists(store.path) and not store.has_journal():
+            return
+        stamp = (store.path, store.stamp())
+        if self._history_stamps.get(lanlan_name) == stamp and lanlan_name in self.user_histories:
+            self.cache_stats['hits'] += 1
+            return
+        self.cache_stats['misses'] += 1
+        try:
+            file_content = store.load()
+            if file_content:
+                self.user_histories[lanlan_name] = messages_from_dict(file_content)
+            self._history_stamps[lanlan_name] = stamp
+            self._bump_version(lanlan_name)
+        except (json.JSONDecodeError, Exception) as e:
+            logger.warning(f"读取 {lanlan_name} 的历史记录文件失败: {e}，使用空列表")
+            self.user_histories[lanlan_name] = []
+            self._history_stamps.pop(lanlan_name, None)
+            self._bump_version(lanlan_name)
+
+    def _reviewed_path(self, lanlan_name):
+        file_path = self.log_file_path.get(lanlan_name)
+        return file_path + REVIEWED_SUFFIX if file_path else None
+
+    def _get_reviewed(self, lanlan_name):
+        """已审阅消息的指纹序列；首次访问时从磁盘读取，重启后不会把整段历史重新审阅一遍"""
+        if lanlan_name not in self._reviewed:
+            reviewed = []
+            path = self._reviewed_path(lanlan_name)
+            if path and os.path.exists(path):
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        reviewed = list(json.load(f))
+                except Exception as e:
+                    logger.warning(f"读取 {lanlan_name} 的审阅记录失败: {e}，将重新审阅全部消息")
+            self._reviewed[lanlan_name] = reviewed
+        return self._reviewed[lanlan_name]
+
+    @staticmethod
+    def _reviewed_prefix(reviewed, fingerprints):
+        """
+        返回 fingerprints 开头已审阅的消息数。
+        压缩只会从前面移除消息、新消息只会追加在末尾，因此已审阅部分是审阅记录的一个后缀；
+        按位置对齐而不是按内容查找，重复出现的相同内容（如"好的"、复读）仍算作新消息。
+        """
+        for k in range(min(len(reviewed), len(fingerprints)), 0, -1):
+            if fingerprints[:k] == reviewed[-k:]:
+                return k
+        return 0
+
+    def _set_reviewed(self, lanlan_name, fingerprints):
+        self._reviewed[lanlan_name] = fingerprints
+        path = self._reviewed_path(lanlan_name)
+        if not path:
+            return
+        try:
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(fingerprints, f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"保存 {lanlan_name} 的审阅记录失败: {e}")
+
+    def _mark_synced(self, lanlan_name):
+        """自身写盘后记录新的文件状态，避免下次把刚写入的内容当作外部修改重新加载"""
+        store = self._get_store(lanlan_name)
+        self._history_stamps[lanlan_name] = (store.path, store.stamp())
+        self._bump_version(lanlan_name)
+
+    def _bump_version(self, lanlan_name):
+        self._history_versions[lanlan_name] = self._history_versions.get(lanlan_name, 0) + 1
+
+    def get_history_version(self, lanlan_name):
+        """返回角色历史记录的版本号，只要内存或磁盘上的历史记录发生变化，版本号就会改变"""
+        if lanlan_name in self.log_file_path:
+            self._load_history(lanlan_name)
+        return self._history_versions.get(lanlan_name, 0)
+
+    def get_cache_stats(self):
+        """返回历史记录缓存的命中/未命中计数"""
+        total = self.cache_stats['hits'] + self.cache_stats['misses']
+        return {
+            **self.cache_stats,
+            'hit_rate': self.cache_stats['hits'] / total if total else 0.0,
+            'cached_characters': len(self._history_stamps),
+            'summary_cache': {name: cache.stats() for name, cache in self._summary_caches.items()},
+        }
+
+    @staticmethod
+    def _fingerprint(msg):
+        content = json.dumps(getattr(msg, 'content', str(msg)), ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(f"{getattr(msg, 'type', '')}\n{content}".encode('utf-8')).hexdigest()
+
+    def _get_compression_stats(self, lanlan_name):
+        if lanlan_name not in self.compression_stats:
+            self.compression_stats[lanlan_name] = {
+                'compressions': 0,
+                'llm_calls': 0,
+                'tokens_compressed': 0,
+                'tokens_after': 0,
+                'tokens_saved': 0,
+                'history_tokens': 0,
+            }
+        return self.compression_stats[lanlan_name]
+
+    def get_compression_stats(self):
+        """各角色压缩节省的token数与花费的LLM调用数，用于调整 /new_dialog 上下文的成本"""
+        return {
+            name: {**stats, 'tokens_saved_per_call': stats['tokens_saved'] / stats['llm_calls'] if stats['llm_calls'] else 0.0}
+            for name, stats in self.compression_stats.items()
+        }
+
+    def _get_summary_cache(self, lanlan_name):
+        """获取角色的摘要缓存，持久化在记忆目录下的 summary_cache_<角色名>.json"""
+        if lanlan_name not in self._summary_caches:
+            memory_base = str(self._config_manager.memory_dir)
+            self._summary_caches[lanlan_name] = SummaryCache(os.path.join(memory_base, f'summary_cache_{lanlan_name}.json'))
+        return self._summary_caches[lanlan_name]
+
+    def flush_summary_caches(self):
+        """把各角色摘要缓存中尚未落盘的内容写入文件（关闭或替换实例前调用）"""
+        for cache in self._summary_caches.values():
+            cache.flush()
     
     def _get_llm(self):
         """动态获取LLM实例以支持配置热重载"""
-        core_config = self._config_manager.get_core_config()
+        core_config = get_core_config()
         api_key = core_config['OPENROUTER_API_KEY'] if core_config['OPENROUTER_API_KEY'] else None
-        return ChatOpenAI(model=core_config['SUMMARY_MODEL'], base_url=core_config['OPENROUTER_URL'], api_key=api_key, temperature=0.3, extra_body={"enable_thinking": False} if core_config['SUMMARY_MODEL'] in MODELS_WITH_EXTRA_BODY else None)
+        return get_chat_model(core_config['SUMMARY_MODEL'], core_config['OPENROUTER_URL'], api_key, temperature=0.3, extra_body={"enable_thinking": False} if core_config['SUMMARY_MODEL'] in MODELS_WITH_EXTRA_BODY else None)
     
     def _get_review_llm(self):
         """动态获取审核LLM实例以支持配置热重载"""
-        core_config = self._config_manager.get_core_config()
+        core_config = get_core_config()
         api_key = core_config['OPENROUTER_API_KEY'] if core_config['OPENROUTER_API_KEY'] else None
-        return ChatOpenAI(model=core_config['CORRECTION_MODEL'], base_url=core_config['OPENROUTER_URL'], api_key=api_key, temperature=0.1, extra_body={"enable_thinking": False} if core_config['CORRECTION_MODEL'] in MODELS_WITH_EXTRA_BODY else None)
+        return get_chat_model(core_config['CORRECTION_MODEL'], core_config['OPENROUTER_URL'], api_key, temperature=0.1, extra_body={"enable_thinking": False} if core_config['CORRECTION_MODEL'] in MODELS_WITH_EXTRA_BODY else None)
+
+    def _history_lock(self, lanlan_name):
+        """串行化同一角色的历史记录改写：压缩（含等待LLM）与审阅结果的替换不会交错"""
+        if lanlan_name not in self._history_locks:
+            self._history_locks[lanlan_name] = asyncio.Lock()
+        return self._history_locks[lanlan_name]
 
     async def update_history(self, new_messages, lanlan_name, detailed=False):
+        async with self._history_lock(lanlan_name):
+            await self._update_history(new_messages, lanlan_name, detailed)
+
+    async def _update_history(self, new_messages, lanlan_name, detailed=False):
         # 检查角色是否存在于配置中，如果不存在则创建默认路径
         try:
             _, _, _, _, _, _, _, _, _, recent_log = self._config_manager.get_character_data()
             # 更新文件路径映射
-            self.log_file_path = recent_log
+            self.log_file_path = dict(recent_log)
             
             # 如果角色不在配置中，使用默认路径创建
             if lanlan_name not in recent_log:
@@ -77,60 +240,70 @@ class CompressedRecentHistoryManager:
         if lanlan_name not in self.user_histories:
             self.user_histories[lanlan_name] = []
         
-        # 如果文件存在，加载历史记录
-        if lanlan_name in self.log_file_path and os.path.exists(self.log_file_path[lanlan_name]):
-            try:
-                with open(self.log_file_path[lanlan_name], encoding='utf-8') as f:
-                    file_content = json.load(f)
-                    if file_content:
-                        self.user_histories[lanlan_name] = messages_from_dict(file_content)
-            except (json.JSONDecodeError, Exception) as e:
-                logger.warning(f"读取 {lanlan_name} 的历史记录文件失败: {e}，使用空列表")
-                self.user_histories[lanlan_name] = []
+        # 首次计数前在线程中加载tiktoken编码表，不阻塞事件循环
+        await ensure_encoding()
+
+        # 如果文件存在且在内存缓存之后被修改过，重新加载历史记录（快照 + 日志回放）
+        self._load_history(lanlan_name)
 
         try:
             self.user_histories[lanlan_name].extend(new_messages)
             logger.info(f"[RecentHistory] {lanlan_name} 添加了 {len(new_messages)} 条新消息，当前共 {len(self.user_histories[lanlan_name])} 条")
 
-            # 确保文件目录存在
-            file_path = self.log_file_path[lanlan_name]
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            
-            with open(file_path, "w", encoding='utf-8') as f:  # Save the updated history to file before compressing
-                json.dump(messages_to_dict(self.user_histories[lanlan_name]), f, indent=2, ensure_ascii=False)
+            # 压缩前先把新消息追加到日志，写入量只与新消息数量有关
+            store = self._get_store(lanlan_name)
+            store.append(messages_to_dict(new_messages))
+            self._mark_synced(lanlan_name)
+
+            history = self.user_histories[lanlan_name]
+            token_counts = [message_tokens(msg) for msg in history]
+            stats = self._get_compression_stats(lanlan_name)
+            stats['history_tokens'] = sum(token_counts)
+            if len(history) <= self.max_history_length and stats['history_tokens'] <= self.token_budget:
+                return
 
-            if len(self.user_histories[lanlan_name]) > self.max_history_length:
-                # 压缩旧消息
-                to_compress = self.user_histories[lanlan_name][:-self.max_history_length+1]
-                compressed = [(await self.compress_history(to_compress, lanlan_name, detailed))[0]]
+            # 从最新的消息往前保留，直到达到消息数上限或保留的token预算，更早的消息（含旧备忘录）压缩为一条备忘录
+            keep = 0
+            kept_tokens = 0
+            for tokens in reversed(token_counts):
+                if keep >= min(self.max_history_length - 1, len(history) - 1) or (keep and kept_tokens + tokens > self.keep_tokens):
+                    break
+                keep += 1
+                kept_tokens += tokens
+            split = len(history) - keep
+            to_compress = history[:split]
+            # 压缩结果是下一次 /new_dialog 的内容，优先调度
+            compressed = (await self.compress_history(to_compress, lanlan_name, detailed, priority=PRIORITY_INTERACTIVE))[0]
 
-                # 只保留最近的max_history_length条消息
-                self.user_histories[lanlan_name] = compressed + self.user_histories[lanlan_name][-self.max_history_length+1:]
+            self.user_histories[lanlan_name] = [compressed] + history[split:]
+            compressed_tokens = sum(token_counts[:split])
+            memo_tokens = message_tokens(compressed)
+            stats['compressions'] += 1
+            stats['tokens_compressed'] += compressed_tokens
+            stats['tokens_after'] += memo_tokens
+            stats['tokens_saved'] += compressed_tokens - memo_tokens
+            stats['history_tokens'] = memo_tokens + kept_tokens
         except Exception as e:
             logger.error(f"[RecentHistory] 更新历史记录时出错: {e}", exc_info=True)
             # 即使出错，也尝试保存当前状态
             try:
-                file_path = self.log_file_path[lanlan_name]
-                os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                with open(file_path, "w", encoding='utf-8') as f:
-                    json.dump(messages_to_dict(self.user_histories.get(lanlan_name, [])), f, indent=2, ensure_ascii=False)
+                self._get_store(lanlan_name).rewrite(messages_to_dict(self.user_histories.get(lanlan_name, [])))
+                self._mark_synced(lanlan_name)
             except Exception as save_error:
                 logger.error(f"[RecentHistory] 保存历史记录失败: {save_error}", exc_info=True)
             return
 
-        # 最终保存
+        # 压缩改写了历史，原子地整体替换快照
         try:
-            file_path = self.log_file_path[lanlan_name]
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            with open(file_path, "w", encoding='utf-8') as f:
-                json.dump(messages_to_dict(self.user_histories[lanlan_name]), f, indent=2, ensure_ascii=False)
-            logger.info(f"[RecentHistory] {lanlan_name} 历史记录已保存到文件: {file_path}")
+            store.rewrite(messages_to_dict(self.user_histories[lanlan_name]))
+            self._mark_synced(lanlan_name)
+            logger.info(f"[RecentHistory] {lanlan_name} 历史记录已保存到文件: {store.path}")
         except Exception as e:
             logger.error(f"[RecentHistory] 最终保存历史记录失败: {e}", exc_info=True)
 
 
     # detailed: 保留尽可能多的细节
-    async def compress_history(self, messages, lanlan_name, detailed=False):
+    async def compress_history(self, messages, lanlan_name, detailed=False, priority=PRIORITY_INGEST):
         name_mapping = self.name_mapping.copy()
         name_mapping['ai'] = lanlan_name
         lines = []
@@ -158,13 +331,28 @@ class CompressedRecentHistoryManager:
         else:
             prompt = detailed_recent_history_manager_prompt % messages_text
 
+        # 同一段内容的重复摘要请求（重跑、重试、并发）只调用一次LLM：先查内容寻址缓存，再合并正在进行中的相同请求
+        cache = self._get_summary_cache(lanlan_name)
+        key = SummaryCache.make_key(messages_text, 'detailed' if detailed else 'brief')
+        cached = cache.get(key)
+        if cached is not None:
+            return SystemMessage(content=f"先前对话的备忘录: {cached['memo']}"), cached['summary']
+        if key not in self._inflight_summaries:
+            future = asyncio.ensure_future(self._summarize(prompt, cache, key, lanlan_name, priority))
+            future.add_done_callback(lambda _: self._inflight_summaries.pop(key, None))
+            self._inflight_summaries[key] = future
+        return await asyncio.shield(self._inflight_summaries[key])
+
+    async def _summarize(self, prompt, cache, key, lanlan_name=None, priority=PRIORITY_INGEST):
         retries = 0
         max_retries = 3
         while retries < max_retries:
             try:
                 # 尝试将响应内容解析为JSON
                 llm = self._get_llm()
-                response_content = (await llm.ainvoke(prompt)).content
+                if lanlan_name:
+                    self._get_compression_stats(lanlan_name)['llm_calls'] += 1
+                response_content = (await llm_scheduler.ainvoke(llm, prompt, lanlan_name, priority)).content
                 # 修复类型问题：确保response_content是字符串
                 if isinstance(response_content, list):
                     response_content = str(response_content)
@@ -175,24 +363,20 @@ class CompressedRecentHistoryManager:
                 if '对话摘要' in summary_json:
                     print(f"💗摘要结果：{summary_json['对话摘要']}")
                     summary = summary_json['对话摘要']
-                    if len(summary) > 500:
-                        summary = await self.further_compress(summary)
+                    if count_tokens(str(summary)) > RECENT_SUMMARY_MAX_TOKENS:
+                        summary = await self.further_compress(summary, lanlan_name, priority)
                         if summary is None:
                             continue
                     # Listen. Here, summary_json['对话摘要'] is not supposed to be anything else than str, but Qwen is shit.
+                    cache.put(key, {'memo': summary, 'summary': str(summary_json['对话摘要'])})
                     return SystemMessage(content=f"先前对话的备忘录: {summary}"), str(summary_json['对话摘要'])
                 else:
                     print('💥 摘要failed: ', response_content)
                     retries += 1
             except RateLimitError as e:
-                retries += 1
-                if retries >= max_retries:
-                    print(f'❌ 摘要模型失败，已达到最大重试次数: {e}')
-                    break
-                # 指数退避: 1, 2, 4 秒
-                wait_time = 2 ** (retries - 1)
-                print(f'⚠️ 遇到429错误，等待 {wait_time} 秒后重试 (第 {retries}/{max_retries} 次)')
-                await asyncio.sleep(wait_time)
+                # 调度器已统一退避重试过
+                print(f'❌ 摘要模型失败，已达到最大重试次数: {e}')
+                break
             except Exception as e:
                 print(f'❌ 摘要模型失败：{e}')
                 # 如果解析失败，重试
@@ -200,14 +384,16 @@ class CompressedRecentHistoryManager:
         # 如果所有重试都失败，返回None
         return SystemMessage(content=f"先前对话的备忘录: 无。"), ""
 
-    async def further_compress(self, initial_summary):
+    async def further_compress(self, initial_summary, lanlan_name=None, priority=PRIORITY_INGEST):
         retries = 0
         max_retries = 3
         while retries < max_retries:
             try:
                 # 尝试将响应内容解析为JSON
                 llm = self._get_llm()
-                response_content = (await llm.ainvoke(further_summarize_prompt % initial_summary)).content
+                if lanlan_name:
+                    self._get_compression_stats(lanlan_name)['llm_calls'] += 1
+                response_content = (await llm_scheduler.ainvoke(llm, further_summarize_prompt % initial_summary, lanlan_name, priority)).content
                 # 修复类型问题：确保response_content是字符串
                 if isinstance(response_content, list):
                     response_content = str(response_content)
@@ -222,14 +408,8 @@ class CompressedRecentHistoryManager:
                     print('💥 第二轮摘要failed: ', response_content)
                     retries += 1
             except RateLimitError as e:
-                retries += 1
-                if retries >= max_retries:
-                    print(f'❌ 第二轮摘要模型失败，已达到最大重试次数: {e}')
-                    return None
-                # 指数退避: 1, 2, 4 秒
-                wait_time = 2 ** (retries - 1)
-                print(f'⚠️ 遇到429错误，等待 {wait_time} 秒后重试 (第 {retries}/{max_retries} 次)')
-                await asyncio.sleep(wait_time)
+                print(f'❌ 第二轮摘要模型失败，已达到最大重试次数: {e}')
+                return None
             except Exception as e:
                 print(f'❌ 第二轮摘要模型失败：{e}')
                 retries += 1
@@ -240,7 +420,7 @@ class CompressedRecentHistoryManager:
         try:
             _, _, _, _, _, _, _, _, _, recent_log = self._config_manager.get_character_data()
             # 更新文件路径映射
-            self.log_file_path = recent_log
+            self.log_file_path = dict(recent_log)
             
             # 如果角色不在配置中，使用默认路径
             if lanlan_name not in recent_log:
@@ -266,16 +446,8 @@ class CompressedRecentHistoryManager:
         if lanlan_name not in self.user_histories:
             self.user_histories[lanlan_name] = []
         
-        # 如果文件存在，加载历史记录
-        if lanlan_name in self.log_file_path and os.path.exists(self.log_file_path[lanlan_name]):
-            try:
-                with open(self.log_file_path[lanlan_name], encoding='utf-8') as f:
-                    file_content = json.load(f)
-                    if file_content:
-                        self.user_histories[lanlan_name] = messages_from_dict(file_content)
-            except (json.JSONDecodeError, Exception) as e:
-                logger.warning(f"读取 {lanlan_name} 的历史记录文件失败: {e}，使用空列表")
-                self.user_histories[lanlan_name] = []
+        # 如果文件存在且在内存缓存之后被修改过，重新加载历史记录（快照 + 日志回放）
+        self._load_history(lanlan_name)
         
         return self.user_histories.get(lanlan_name, [])
 
@@ -304,13 +476,22 @@ class CompressedRecentHistoryManager:
         except Exception as e:
             print(f"⚠️ 读取配置文件失败：{e}，继续执行审阅")
         
-        # 获取当前历史记录
-        
-        current_history = self.get_recent_history(lanlan_name)
+        # 获取当前历史记录（复制一份，审阅期间新到达的消息会追加到原列表中）
+        current_history = list(self.get_recent_history(lanlan_name))
         
         if not current_history:
             print(f"💡 {lanlan_name} 的历史记录为空，无需审阅")
             return False
+
+        # 只审阅尚未审阅过的消息（开头的备忘录随压缩变化，不单独触发审阅），并带上少量已审阅的上文
+        fingerprints = [self._fingerprint(msg) for msg in current_history]
+        body_start = 1 if isinstance(current_history[0], SystemMessage) else 0
+        first_new = body_start + self._reviewed_prefix(self._get_reviewed(lanlan_name), fingerprints[body_start:])
+        if first_new >= len(current_history):
+            print(f"💡 {lanlan_name} 没有新的消息，无需审阅")
+            return False
+        start = max(0, first_new - self.review_overlap)
+        segment = current_history[start:]
         
         # 检查是否被取消
         if cancel_event and cancel_event.is_set():
@@ -322,7 +503,7 @@ class CompressedRecentHistoryManager:
         name_mapping['ai'] = lanlan_name
         
         history_text = ""
-        for msg in current_history:
+        for msg in segment:
             if hasattr(msg, 'type') and msg.type in name_mapping:
                 role = name_mapping[msg.type]
             else:
@@ -352,7 +533,7 @@ class CompressedRecentHistoryManager:
                 # 使用LLM审阅历史记录
                 prompt = history_review_prompt % (self.name_mapping['human'], name_mapping['ai'], history_text, self.name_mapping['human'], name_mapping['ai'])
                 review_llm = self._get_review_llm()
-                response_content = (await review_llm.ainvoke(prompt)).content
+                response_content = (await llm_scheduler.ainvoke(review_llm, prompt, lanlan_name, PRIORITY_BACKGROUND)).content
                 
                 # 检查是否被取消（LLM调用后）
                 if cancel_event and cancel_event.is_set():
@@ -389,12 +570,29 @@ class CompressedRecentHistoryManager:
                             # 默认作为用户消息处理
                             corrected_messages.append(HumanMessage(content=content))
                     
-                    # 更新历史记录
-                    self.user_histories[lanlan_name] = corrected_messages
+                    # 持有历史记录锁：正在进行的压缩结束后再校验，替换期间也不会有压缩插入
+                    async with self._history_lock(lanlan_name):
+                        if cancel_event and cancel_event.is_set():
+                            print(f"⚠️ {lanlan_name} 的记忆整理被取消（等待历史记录锁后）")
+                            return False
+                        # 审阅期间历史可能被压缩或追加了新消息：只有所审阅的片段及其之前的部分未变时才替换该片段
+                        latest = self.get_recent_history(lanlan_name)
+                        latest_fingerprints = [self._fingerprint(msg) for msg in latest[:len(current_history)]]
+                        if latest_fingerprints != fingerprints:
+                            print(f"⚠️ {lanlan_name} 的历史记录在审阅期间被改动，放弃本次整理结果")
+                            return False
+                        new_history = latest[:start] + corrected_messages + latest[len(current_history):]
+
+                        # 更新历史记录
+                        self.user_histories[lanlan_name] = new_history
                     
-                    # 保存到文件
-                    with open(self.log_file_path[lanlan_name], "w", encoding='utf-8') as f:
-                        json.dump(messages_to_dict(corrected_messages), f, indent=2, ensure_ascii=False)
+                        # 保存到文件
+                        self._get_store(lanlan_name).rewrite(messages_to_dict(new_history))
+                        self._mark_synced(lanlan_name)
+                        reviewed_messages = new_history[:start + len(corrected_messages)]
+                        if reviewed_messages and isinstance(reviewed_messages[0], SystemMessage):
+                            reviewed_messages = reviewed_messages[1:]
+                        self._set_reviewed(lanlan_name, [self._fingerprint(msg) for msg in reviewed_messages])
                     
                     print(f"✅ {lanlan_name} 的记忆已修正并保存")
                     return True
@@ -403,18 +601,8 @@ class CompressedRecentHistoryManager:
                     return False
                     
             except RateLimitError as e:
-                retries += 1
-                if retries >= max_retries:
-                    print(f'❌ 记忆整理失败，已达到最大重试次数: {e}')
-                    return False
-                # 指数退避: 1, 2, 4 秒
-                wait_time = 2 ** (retries - 1)
-                print(f'⚠️ 遇到429错误，等待 {wait_time} 秒后重试 (第 {retries}/{max_retries} 次)')
-                await asyncio.sleep(wait_time)
-                # 检查是否被取消
-                if cancel_event and cancel_event.is_set():
-                    print(f"⚠️ {lanlan_name} 的记忆整理在重试等待期间被取消")
-                    return False
+                print(f'❌ 记忆整理失败，已达到最大重试次数: {e}')
+                return False
             except Exception as e:
                 logger.error(f"❌ 历史记录审阅失败：{e}")
                 return False
@@ -428,3 +616,7 @@ class CompressedRecentHistoryManager:
         清除用户的聊天历史
         """
         self.user_histories[lanlan_name] = []
+        # 下次读取时以磁盘内容为准（审阅记录同样重新从磁盘读取）
+        self._reviewed.pop(lanlan_name, None)
+        self._history_stamps.pop(lanlan_name, None)
+        self._bump_version(lanlan_name)
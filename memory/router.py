@@ -8,7 +8,7 @@ from langgraph.graph import StateGraph, END
 from typing import TypedDict, List, Dict, Any
 from langchain_core.messages import BaseMessage
 import json
-from langchain_openai import ChatOpenAI
+from memory.llm_clients import get_chat_model, get_core_config
 from config import ROUTER_MODEL
 from utils.config_manager import get_config_manager
 
@@ -28,8 +28,8 @@ class MemoryQueryRouter:
     
     def _get_llm(self):
         """动态获取LLM实例以支持配置热重载"""
-        core_config = self._config_manager.get_core_config()
-        return ChatOpenAI(model=ROUTER_MODEL, base_url=core_config['OPENROUTER_URL'], api_key=core_config['OPENROUTER_API_KEY'])
+        core_config = get_core_config()
+        return get_chat_model(ROUTER_MODEL, core_config['OPENROUTER_URL'], core_config['OPENROUTER_API_KEY'])
 
     def _build_graph(self):
         # 构建LangGraph流程图
@@ -0,0 +1,200 @@
+"""
+记忆服务的LLM调用调度器。
+
+所有角色的摘要、记忆整理、精排等LLM调用都经过同一个调度器：
+- 全局并发上限，多个角色同时写入时不会一起涌向API
+- 每个API端点一个令牌桶，请求速率平滑；遇到429时整个端点统一退避，而不是各调用方各自重试
+- 按优先级出队（影响下一次对话上下文的摘要先于后台记忆整理），同一优先级内各角色轮流出队；
+  并发名额与端点令牌都按优先级分配，排在后面的高优先级请求不会被先到的后台请求挡住
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+
+from openai import RateLimitError
+
+from config import LLM_SCHEDULER_MAX_CONCURRENCY, LLM_SCHEDULER_REQUESTS_PER_SECOND, LLM_SCHEDULER_BURST, LLM_SCHEDULER_MAX_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# 数值越小越先执行
+PRIORITY_INTERACTIVE = 0  # 近期记忆压缩（/new_dialog 的内容）、检索精排
+PRIORITY_INGEST = 1  # 写入时的会话摘要
+PRIORITY_BACKGROUND = 2  # 记忆整理、时间汇总、设定提取
+
+
+class TokenBucket:
+    """令牌桶：按 rate 个/秒补充，最多积攒 capacity 个"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def wait_time(self, now):
+        """距离可以取走一个令牌还需等待的秒数"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.paused_until > now:
+            return self.paused_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        """端点返回429后，在 seconds 秒内不再发出新请求，并清空积攒的令牌"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = min(self.tokens, 0)
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency=LLM_SCHEDULER_MAX_CONCURRENCY, rate=LLM_SCHEDULER_REQUESTS_PER_SECOND,
+                 burst=LLM_SCHEDULER_BURST, max_retries=LLM_SCHEDULER_MAX_RETRIES):
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self._buckets = {}  # {端点: TokenBucket}
+        self._waiters = {}  # {优先级: OrderedDict{lanlan_name: deque[(Future, 端点)]}}
+        self._active = 0
+        self._timer = None  # 令牌补充后重新分配名额的定时器 (事件循环, 触发时间, TimerHandle)
+        self.stats = {'calls': 0, 'rate_limited': 0, 'failed': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
+
+    def _bucket(self, endpoint):
+        if endpoint not in self._buckets:
+            self._buckets[endpoint] = TokenBucket(self.rate, self.burst)
+        return self._buckets[endpoint]
+
+    def _dispatch(self):
+        """
+        有空闲并发名额、且对应端点有令牌时，按优先级、同一优先级内按角色轮流唤醒等待者。
+        令牌也按优先级分配：端点令牌不足时，该端点上优先级更低的请求不会抢先取走下一个令牌；
+        等待令牌期间不占用并发名额。
+        """
+        now = time.monotonic()
+        next_wait = None
+        granted = True
+        while granted and self._active < self.max_concurrency:
+            granted = False
+            blocked = set()  # 本轮中令牌不足的端点
+            for priority in sorted(self._waiters):
+                queues = self._waiters[priority]
+                for lanlan_name in list(queues):
+                    if self._active >= self.max_concurrency:
+                        break
+                    waiters = queues[lanlan_name]
+                    while waiters and waiters[0][0].done():
+                        waiters.popleft()
+                    if not waiters:
+                        del queues[lanlan_name]
+                        continue
+                    # 取该角色第一个令牌可用的请求；令牌不足的端点不影响该角色发往其他端点的请求
+                    chosen = None
+                    for index, (future, endpoint) in enumerate(waiters):
+                        if future.done() or endpoint in blocked:
+                            continue
+                        wait = self._bucket(endpoint).wait_time(now)
+                        if wait > 0:
+                            blocked.add(endpoint)
+                            next_wait = wait if next_wait is None else min(next_wait, wait)
+                            continue
+                        chosen = index
+                        break
+                    if chosen is None:
+                        continue
+                    future, endpoint = waiters[chosen]
+                    del waiters[chosen]
+                    self._bucket(endpoint).take()
+                    # 该角色排到队尾，下一个名额给其他角色
+                    del queues[lanlan_name]
+                    if waiters:
+                        queues[lanlan_name] = waiters
+                    self._active += 1
+                    future.set_result(None)
+                    granted = True
+                if not queues:
+                    del self._waiters[priority]
+        if next_wait is not None and self._active < self.max_concurrency:
+            self._schedule_dispatch(now + next_wait)
+
+    def _schedule_dispatch(self, when):
+        loop = asyncio.get_running_loop()
+        if self._timer is not None and self._timer[0] is loop:
+            if self._timer[1] <= when:
+                return
+            self._timer[2].cancel()
+        handle = loop.call_later(max(0.0, when - time.monotonic()), self._on_timer)
+        self._timer = (loop, when, handle)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    async def _acquire(self, lanlan_name, priority, endpoint=None):
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(priority, OrderedDict()).setdefault(lanlan_name, deque()).append((future, endpoint))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 已分到名额但调用方被取消，归还名额
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+
+    def _release(self):
+        self._active -= 1
+        self._dispatch()
+
+    async def ainvoke(self, llm, prompt, lanlan_name=None, priority=PRIORITY_BACKGROUND):
+        """
+        经调度器调用 llm.ainvoke(prompt)。429由调度器统一退避重试，重试用尽后抛出 RateLimitError；
+        其他异常原样抛出，由调用方决定是否重试。
+        """
+        endpoint = getattr(llm, 'openai_api_base', None)
+        retries = 0
+        while True:
+            start = time.monotonic()
+            # 分到名额时已取得该端点的令牌；令牌桶的等待与429退避都发生在获取名额之前
+            await self._acquire(lanlan_name, priority, endpoint)
+            try:
+                waited = time.monotonic() - start
+                self.stats['wait_seconds'] += waited
+                self.stats['max_wait_seconds'] = max(self.stats['max_wait_seconds'], waited)
+                self.stats['calls'] += 1
+                return await llm.ainvoke(prompt)
+            except RateLimitError as e:
+                self.stats['rate_limited'] += 1
+                retries += 1
+                if retries >= self.max_retries:
+                    self.stats['failed'] += 1
+                    raise
+                # 优先采用服务端给出的 Retry-After，否则指数退避: 1, 2, 4 秒
+                wait_time = 2 ** (retries - 1)
+                try:
+                    wait_time = float(e.response.headers.get('retry-after', wait_time))
+                except (AttributeError, TypeError, ValueError):
+                    pass
+                self._bucket(endpoint).pause(wait_time)
+                logger.warning(f"[LLMScheduler] {endpoint} 返回429，该端点暂停 {wait_time} 秒 (第 {retries}/{self.max_retries} 次)")
+            finally:
+                self._release()
+
+    def status(self):
+        """当前排队情况与累计统计"""
+        return {
+            'active': self._active,
+            'max_concurrency': self.max_concurrency,
+            'queued': {
+                priority: {name: sum(not f.done() for f, _ in waiters) for name, waiters in queues.items()}
+                for priority, queues in self._waiters.items()
+            },
+            **self.stats,
+        }
+
+
+llm_scheduler = LLMScheduler()
@@ -1,17 +1,42 @@
 # from langchain_chroma import Chroma
-# ↑ 这个库引入了Chroma和onnx依赖，显著增大了一键包体积，暂时注释掉
+# ↑ 这个库引入了Chroma和onnx依赖，显著增大了一键包体积，改用 memory.vectorstore 中的本地向量库
 from typing import List
 from langchain_core.documents import Document
 from datetime import datetime
 from memory.recent import CompressedRecentHistoryManager
-from config import SEMANTIC_MODEL, RERANKER_MODEL, MODELS_WITH_EXTRA_BODY
+from memory.vectorstore import LocalVectorStore, HashingEmbeddings
+from memory.embeddings import CachedEmbeddings, EmbeddingCache
+from memory.prerank import prerank
+from config import SEMANTIC_MODEL, RERANKER_MODEL, MODELS_WITH_EXTRA_BODY, SEMANTIC_RERANK_AGREEMENT_THRESHOLD, SEMANTIC_RERANK_CANDIDATE_FACTOR
 from utils.config_manager import get_config_manager
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_openai import OpenAIEmbeddings
+from memory.llm_clients import get_chat_model, get_core_config
+from memory.scheduler import llm_scheduler, PRIORITY_INTERACTIVE
 from config.prompts_sys import semantic_manager_prompt
 import json
-import asyncio
+import os
 from openai import RateLimitError
 
+# 所有角色共享的带缓存embedding实例 {(url, model, api_key): CachedEmbeddings}
+_shared_embeddings = {}
+_embedding_cache = None
+
+def _get_embeddings():
+    """使用配置的embedding接口（带持久化缓存与请求合批）；未配置API Key时退化为本地确定性embedding"""
+    global _embedding_cache
+    config_manager = get_config_manager()
+    core_config = get_core_config()
+    if not core_config['OPENROUTER_API_KEY']:
+        return HashingEmbeddings()
+    key = (core_config['OPENROUTER_URL'], SEMANTIC_MODEL, core_config['OPENROUTER_API_KEY'])
+    if key not in _shared_embeddings:
+        if _embedding_cache is None:
+            config_manager.ensure_memory_directory()
+            _embedding_cache = EmbeddingCache(os.path.join(str(config_manager.memory_dir), 'embedding_cache.sqlite'))
+        base = OpenAIEmbeddings(base_url=core_config['OPENROUTER_URL'], model=SEMANTIC_MODEL, api_key=core_config['OPENROUTER_API_KEY'], check_embedding_ctx_length=False)
+        _shared_embeddings[key] = CachedEmbeddings(base, _embedding_cache)
+    return _shared_embeddings[key]
+
 class SemanticMemory:
     def __init__(self, recent_history_manager: CompressedRecentHistoryManager, persist_directory=None):
         self._config_manager = get_config_manager()
@@ -25,35 +50,47 @@ class SemanticMemory:
             self.original_memory[i] = SemanticMemoryOriginal(persist_directory, i, name_mapping)
             self.compressed_memory[i] = SemanticMemoryCompressed(persist_directory, i, recent_history_manager, name_mapping)
     
+    @staticmethod
+    def get_embedding_stats():
+        """embedding缓存命中与实际API调用次数"""
+        return {model: emb.stats() for (_, model, _), emb in _shared_embeddings.items()}
+
     def _get_reranker(self):
         """动态获取Reranker LLM实例以支持配置热重载"""
-        core_config = self._config_manager.get_core_config()
-        return ChatOpenAI(model=RERANKER_MODEL, base_url=core_config['OPENROUTER_URL'], api_key=core_config['OPENROUTER_API_KEY'], temperature=0.1, extra_body={"enable_thinking": False} if RERANKER_MODEL in MODELS_WITH_EXTRA_BODY else None)
+        core_config = get_core_config()
+        return get_chat_model(RERANKER_MODEL, core_config['OPENROUTER_URL'], core_config['OPENROUTER_API_KEY'], temperature=0.1, extra_body={"enable_thinking": False} if RERANKER_MODEL in MODELS_WITH_EXTRA_BODY else None)
 
     async def store_conversation(self, event_id, messages, lanlan_name):
-        self.original_memory[lanlan_name].store_conversation(event_id, messages)
+        await self.original_memory[lanlan_name].astore_conversation(event_id, messages)
         await self.compressed_memory[lanlan_name].store_compressed_summary(event_id, messages)
 
-    async def hybrid_search(self, query, lanlan_name, with_rerank=True, k=10):
+    async def hybrid_search(self, query, lanlan_name, with_rerank=True, k=10, top_k=5, fast=False):
+        """
+        每个向量库各取k条候选，先在本地去重并粗排（BM25 + 向量相似度，RRF融合），
+        只有粗排结果难以取舍时才调用LLM精排出top_k条；fast=True 时完全跳过LLM精排。
+        """
         # 从原始和压缩记忆中获取结果
-        original_results = self.original_memory[lanlan_name].retrieve_by_query(query, k)
-        compressed_results = self.compressed_memory[lanlan_name].retrieve_by_query(query, k)
-        combined = original_results + compressed_results
-
-        if with_rerank:
-            return await self.rerank_results(query, combined)
-        else:
-            return combined
-
-    async def query(self, query, lanlan_name):
+        if lanlan_name not in self.original_memory:
+            return []
+        original_results = await self.original_memory[lanlan_name].aretrieve_with_score(query, k)
+        compressed_results = await self.compressed_memory[lanlan_name].aretrieve_with_score(query, k)
+        candidates, agreement = prerank(query, original_results + compressed_results, top_k)
+
+        if not with_rerank:
+            return candidates
+        if fast or len(candidates) <= top_k or agreement >= SEMANTIC_RERANK_AGREEMENT_THRESHOLD:
+            return candidates[:top_k]
+        return await self.rerank_results(query, candidates[:top_k * SEMANTIC_RERANK_CANDIDATE_FACTOR], top_k, lanlan_name)
+
+    async def query(self, query, lanlan_name, fast=False):
         results_text = "\n".join([
             f"记忆片段{i} | \n{doc.page_content}\n"
-            for i, doc in enumerate(await self.hybrid_search(query, lanlan_name))
+            for i, doc in enumerate(await self.hybrid_search(query, lanlan_name, fast=fast))
         ])
         return f"""======{lanlan_name}尝试回忆=====\n{query}\n\n====={lanlan_name}的相关记忆=====\n{results_text}"""
 
-    async def rerank_results(self, query, results: list, k=5) -> list:
-        # 使用LLM重新排序结果
+    async def rerank_results(self, query, results: list, k=5, lanlan_name=None) -> list:
+        # 使用LLM重新排序结果；results已按本地粗排排好序，失败时直接退回粗排结果
         results_text = "\n\n".join([
             f"记忆片段 {i + 1}:\n{doc.page_content}"
             for i, doc in enumerate(results)
@@ -65,53 +102,44 @@ class SemanticMemory:
         while retries < max_retries:
             try:
                 reranker = self._get_reranker()
-                response = await reranker.ainvoke(prompt)
+                response = await llm_scheduler.ainvoke(reranker, prompt, lanlan_name, PRIORITY_INTERACTIVE)
             except RateLimitError as e:
-                retries += 1
-                if retries >= max_retries:
-                    print(f'❌ Rerank query失败，已达到最大重试次数: {e}')
-                    return []
-                # 指数退避: 1, 2, 4 秒
-                wait_time = 2 ** (retries - 1)
-                print(f'⚠️ 遇到429错误，等待 {wait_time} 秒后重试 (第 {retries}/{max_retries} 次)')
-                await asyncio.sleep(wait_time)
-                continue
+                # 调度器已统一退避重试过
+                print(f'❌ Rerank query失败，已达到最大重试次数: {e}')
+                return results[:k]
             except Exception as e:
                 retries += 1
                 print(f'❌ Rerank query失败: {e}')
                 if retries >= max_retries:
-                    return []
+                    return results[:k]
                 continue
 
             try:
                 # 解析排序后的文档编号
                 reranked_indices = json.loads(response.content)
-                # 按新顺序排序结果
-                reranked_results = [results[idx] for idx in reranked_indices[:k] if 0 <= idx < len(results)]
+                # 按新顺序排序结果（提示词中的编号从1开始）
+                reranked_results = [results[idx - 1] for idx in reranked_indices[:k] if 1 <= idx <= len(results)]
                 return reranked_results
             except Exception as e:
                 retries += 1
                 print(f'❌ Rerank结果解析失败: {e}')
                 if retries >= max_retries:
-                    return []
-        return []
+                    return results[:k]
+        return results[:k]
 
 
 class SemanticMemoryOriginal:
     def __init__(self, persist_directory, lanlan_name, name_mapping):
-        config_manager = get_config_manager()
-        core_config = config_manager.get_core_config()
-        self.embeddings = OpenAIEmbeddings(base_url=core_config['OPENROUTER_URL'], model=SEMANTIC_MODEL, api_key=core_config['OPENROUTER_API_KEY'])
-        # self.vectorstore = Chroma(
-        #     collection_name="Origin",
-        #     persist_directory=persist_directory[lanlan_name],
-        #     embedding_function=self.embeddings
-        # )
-        self.vectorstore = None
+        self.embeddings = _get_embeddings()
+        self.vectorstore = LocalVectorStore(
+            persist_directory=persist_directory[lanlan_name],
+            collection_name="Origin",
+            embedding_function=self.embeddings
+        )
         self.lanlan_name = lanlan_name
         self.name_mapping = name_mapping
 
-    def store_conversation(self, event_id, messages):
+    def _to_texts(self, event_id, messages):
         # 将对话转换为文本
         texts = []
         metadatas = []
@@ -141,28 +169,38 @@ class SemanticMemoryOriginal:
                 "minute": "%02d" % (datetime.now().minute),
                 "timestamp": datetime.now().isoformat()
             })
+        return texts, metadatas
 
+    def store_conversation(self, event_id, messages):
+        texts, metadatas = self._to_texts(event_id, messages)
         # 存储到向量数据库
         self.vectorstore.add_texts(texts=texts, metadatas=metadatas)
 
+    async def astore_conversation(self, event_id, messages):
+        texts, metadatas = self._to_texts(event_id, messages)
+        await self.vectorstore.aadd_texts(texts=texts, metadatas=metadatas)
+
     def retrieve_by_query(self, query, k=10):
         # 在原始对话上进行精确语义搜索
         return self.vectorstore.similarity_search(query, k=k)
 
+    async def aretrieve_by_query(self, query, k=10):
+        return await self.vectorstore.asimilarity_search(query, k=k)
+
+    async def aretrieve_with_score(self, query, k=10):
+        return await self.vectorstore.asimilarity_search_with_score(query, k=k)
+
 
 class SemanticMemoryCompressed:
     def __init__(self, persist_directory, lanlan_name, recent_history_manager: CompressedRecentHistoryManager, name_mapping):
         self.lanlan_name = lanlan_name
         self.name_mapping = name_mapping
-        config_manager = get_config_manager()
-        core_config = config_manager.get_core_config()
-        self.embeddings = OpenAIEmbeddings(base_url=core_config['OPENROUTER_URL'], model=SEMANTIC_MODEL, api_key=core_config['OPENROUTER_API_KEY'])
-        self.vectorstore = None
-        # self.vectorstore = Chroma(
-        #     collection_name="Compressed",
-        #     persist_directory=persist_directory[lanlan_name],
-        #     embedding_function=self.embeddings
-        # )
+        self.embeddings = _get_embeddings()
+        self.vectorstore = LocalVectorStore(
+            persist_directory=persist_directory[lanlan_name],
+            collection_name="Compressed",
+            embedding_function=self.embeddings
+        )
         self.recent_history_manager = recent_history_manager
 
     async def store_compressed_summary(self, event_id, messages):
@@ -170,7 +208,7 @@ class SemanticMemoryCompressed:
         _, summary = await self.recent_history_manager.compress_history(messages, self.lanlan_name)
         if not summary:
             return
-        self.vectorstore.add_texts(
+        await self.vectorstore.aadd_texts(
             texts=[summary],
             metadatas=[{
                 "event_id": event_id,
@@ -187,4 +225,10 @@ class SemanticMemoryCompressed:
 
     def retrieve_by_query(self, query, k=10):
         # 在压缩摘要上进行语义搜索
-        return self.vectorstore.similarity_search(query, k=k)
\ No newline at end of file
+        return self.vectorstore.similarity_search(query, k=k)
+
+    async def aretrieve_by_query(self, query, k=10):
+        return await self.vectorstore.asimilarity_search(query, k=k)
+
+    async def aretrieve_with_score(self, query, k=10):
+        return await self.vectorstore.asimilarity_search_with_score(query, k=k)
@@ -1,52 +1,161 @@
+import copy
 import json
+import os
 import asyncio
-from langchain_openai import ChatOpenAI
+from memory.llm_clients import get_chat_model, get_core_config
+from memory.scheduler import llm_scheduler, PRIORITY_BACKGROUND
 from openai import RateLimitError
 from config import SETTING_PROPOSER_MODEL, SETTING_VERIFIER_MODEL
 from utils.config_manager import get_config_manager
 from config.prompts_sys import settings_extractor_prompt, settings_verifier_prompt
 
 
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def _is_empty(value):
+    return value is None or value == '' or value == [] or value == {}
+
+
+def diff_settings(old, new):
+    """
+    逐字段比较新旧设定，返回 (合并结果, 冲突字段)。
+
+    新增字段、旧值为空的字段以及列表的新增元素直接合并；只有同一字段新旧取值不同
+    时才记为冲突，形如 {字段: (旧值, 新值)}，嵌套字典按同样结构递归。
+    """
+    merged = copy.deepcopy(old)
+    conflicts = {}
+    for key, value in new.items():
+        if _is_empty(value) or old.get(key) == value:
+            continue
+        old_value = old.get(key)
+        if _is_empty(old_value):
+            merged[key] = copy.deepcopy(value)
+        elif isinstance(old_value, dict) and isinstance(value, dict):
+            merged[key], sub_conflicts = diff_settings(old_value, value)
+            if sub_conflicts:
+                conflicts[key] = sub_conflicts
+        elif isinstance(old_value, list) and isinstance(value, list):
+            merged[key] = old_value + [v for v in value if v not in old_value]
+        else:
+            conflicts[key] = (old_value, value)
+    return merged, conflicts
+
+
+def _split_conflicts(conflicts):
+    """把冲突字段拆成只包含这些字段的 (旧设定, 新设定)"""
+    old, new = {}, {}
+    for key, value in conflicts.items():
+        if isinstance(value, tuple):
+            old[key], new[key] = value
+        else:
+            old[key], new[key] = _split_conflicts(value)
+    return old, new
+
+
+def _deep_update(target, updates):
+    for key, value in updates.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _deep_update(target[key], value)
+        else:
+            target[key] = value
+    return target
+
+
 class ImportantSettingsManager:
     def __init__(self):
         self.settings = {}
         self.settings_file = None
         self._config_manager = get_config_manager()
+        self._locks = {}  # {lanlan_name: asyncio.Lock}，串行化同一角色的设定更新
+        self._character_data = None  # 上次使用的 ConfigManager 角色数据快照
+        self._settings_stamps = {}  # {lanlan_name: (设定文件路径, (size, mtime_ns))}
+        self._merged_settings = {}  # {lanlan_name: 合并基础配置后的设定}
     
     def _get_proposer(self):
         """动态获取Proposer LLM实例以支持配置热重载"""
-        core_config = self._config_manager.get_core_config()
-        return ChatOpenAI(model=SETTING_PROPOSER_MODEL, base_url=core_config['OPENROUTER_URL'], api_key=core_config['OPENROUTER_API_KEY'], temperature=0.5)
+        core_config = get_core_config()
+        return get_chat_model(SETTING_PROPOSER_MODEL, core_config['OPENROUTER_URL'], core_config['OPENROUTER_API_KEY'], temperature=0.5)
     
     def _get_verifier(self):
         """动态获取Verifier LLM实例以支持配置热重载"""
-        core_config = self._config_manager.get_core_config()
-        return ChatOpenAI(model=SETTING_VERIFIER_MODEL, base_url=core_config['OPENROUTER_URL'], api_key=core_config['OPENROUTER_API_KEY'], temperature=0.5)
+        core_config = get_core_config()
+        return get_chat_model(SETTING_VERIFIER_MODEL, core_config['OPENROUTER_URL'], core_config['OPENROUTER_API_KEY'], temperature=0.5)
 
-    def load_settings(self):
-        # It is important to update the settings with the latest character on-disk files
-        _, _, master_basic_config, lanlan_basic_config, name_mapping, _, _, _, setting_store, _ = self._config_manager.get_character_data()
+    def _refresh_character_data(self):
+        """角色配置文件变化时才重新读取角色数据"""
+        character_data = self._config_manager.get_character_data()
+        if character_data is self._character_data:
+            return
+        _, _, master_basic_config, lanlan_basic_config, name_mapping, _, _, _, setting_store, _ = character_data
         self.settings_file = setting_store
         self.master_basic_config = master_basic_config
-        self.lanlan_basic_config = lanlan_basic_config
+        # 不在设定中展示的字段，复制一份过滤后保存，不修改原配置
+        self.lanlan_basic_config = {
+            name: {k: v for k, v in config.items() if k not in ('system_prompt', 'live2d', 'voice_id')}
+            for name, config in lanlan_basic_config.items()
+        }
         self.name_mapping = name_mapping
+        self._character_data = character_data
+        self._merged_settings.clear()
 
+    def _settings_path(self, lanlan_name):
+        if self.settings_file and lanlan_name in self.settings_file:
+            return self.settings_file[lanlan_name]
+        return os.path.join(str(self._config_manager.memory_dir), f'settings_{lanlan_name}.json')
+
+    def load_settings(self):
+        # It is important to update the settings with the latest character on-disk files
+        self._refresh_character_data()
         for i in self.settings_file:
-            try:
-                self.lanlan_basic_config[i].pop('system_prompt', None)
-                self.lanlan_basic_config[i].pop('live2d', None)
-                self.lanlan_basic_config[i].pop('voice_id', None)
-                with open(self.settings_file[i], 'r', encoding='utf-8') as f:
-                    self.settings[i] = json.load(f)
-            except (FileNotFoundError, json.JSONDecodeError):
-                self.settings[i] = {i: {}, self.name_mapping['human']: {}}
+            self._load_character_settings(i)
+
+    def get_settings_version(self, lanlan_name):
+        """设定文件的路径与 (size, mtime_ns)，文件不存在时后者为None。用于判断依赖设定的缓存是否失效"""
+        # 与读取设定时使用同一个路径，角色配置中指定了其他设定文件时也能感知变化
+        self._refresh_character_data()
+        settings_path = self._settings_path(lanlan_name)
+        return settings_path, _file_stamp(settings_path)
+
+    def _load_character_settings(self, lanlan_name):
+        """只读取一个角色的设定文件；文件的 size/mtime 未变化时直接使用内存中的内容"""
+        self._refresh_character_data()
+        settings_path = self._settings_path(lanlan_name)
+        stamp = (settings_path, _file_stamp(settings_path))
+        if self._settings_stamps.get(lanlan_name) == stamp and lanlan_name in self.settings:
+            return self.settings[lanlan_name]
+        try:
+            with open(settings_path, 'r', encoding='utf-8') as f:
+                self.settings[lanlan_name] = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.settings[lanlan_name] = {lanlan_name: {}, self.name_mapping['human']: {}}
+        self._settings_stamps[lanlan_name] = stamp
+        self._merged_settings.pop(lanlan_name, None)
+        return self.settings[lanlan_name]
 
     def save_settings(self, lanlan_name):
-        with open(self.settings_file[lanlan_name], 'w', encoding='utf-8') as f:
+        # 先写临时文件再原子替换，写入中途崩溃不会留下损坏的设定文件
+        settings_path = self._settings_path(lanlan_name)
+        tmp_path = settings_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             json.dump(self.settings[lanlan_name], f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, settings_path)
+        self._settings_stamps[lanlan_name] = (settings_path, _file_stamp(settings_path))
+        self._merged_settings.pop(lanlan_name, None)
 
     async def detect_and_resolve_contradictions(self, old_settings, new_settings, lanlan_name):
         # 使用LLM检测矛盾并解决它们
+        if not settings_verifier_prompt:
+            # 未配置校验提示词时，以新提取的设定为准
+            return new_settings
         prompt = settings_verifier_prompt % (json.dumps(old_settings, ensure_ascii=False), json.dumps(new_settings, ensure_ascii=False))
         prompt = prompt.replace("{LANLAN_NAME}", lanlan_name)
 
@@ -55,20 +164,14 @@ class ImportantSettingsManager:
         while retries < max_retries:
             try:
                 verifier = self._get_verifier()
-                response = await verifier.ainvoke(prompt)
+                response = await llm_scheduler.ainvoke(verifier, prompt, lanlan_name, PRIORITY_BACKGROUND)
                 result = response.content
                 if result.startswith("```"):
                     result = result .replace("```json", "").replace("```", "").strip()
             except RateLimitError as e:
-                retries += 1
-                if retries >= max_retries:
-                    print(f"❌ Setting resolver query失败，已达到最大重试次数: {e}")
-                    return old_settings
-                # 指数退避: 1, 2, 4 秒
-                wait_time = 2 ** (retries - 1)
-                print(f'⚠️ 遇到429错误，等待 {wait_time} 秒后重试 (第 {retries}/{max_retries} 次)')
-                await asyncio.sleep(wait_time)
-                continue
+                # 调度器已统一退避重试过
+                print(f"❌ Setting resolver query失败，已达到最大重试次数: {e}")
+                return old_settings
             except Exception as e:
                 print(f"❌ Setting resolver query出错: {e}")
                 retries += 1
@@ -107,17 +210,10 @@ class ImportantSettingsManager:
         while retries < max_retries:
             try:
                 proposer = self._get_proposer()
-                response = await proposer.ainvoke(prompt)
+                response = await llm_scheduler.ainvoke(proposer, prompt, lanlan_name, PRIORITY_BACKGROUND)
             except RateLimitError as e:
-                retries += 1
-                if retries >= max_retries:
-                    print(f"❌ Setting LLM query失败，已达到最大重试次数: {e}")
-                    return
-                # 指数退避: 1, 2, 4 秒
-                wait_time = 2 ** (retries - 1)
-                print(f'⚠️ 遇到429错误，等待 {wait_time} 秒后重试 (第 {retries}/{max_retries} 次)')
-                await asyncio.sleep(wait_time)
-                continue
+                print(f"❌ Setting LLM query失败，已达到最大重试次数: {e}")
+                return
             except Exception as e:
                 print(f"❌ Setting LLM query出错: {e}")
                 retries += 1
@@ -132,14 +228,27 @@ class ImportantSettingsManager:
                 retries += 1
             break
 
-        # 检测并解决矛盾
-        if len(new_settings)>0:
-            self.load_settings()
-            self.settings[lanlan_name] = await self.detect_and_resolve_contradictions(self.settings[lanlan_name], new_settings, lanlan_name)
-            self.save_settings(lanlan_name)
+        # 检测并解决矛盾：先在本地逐字段比较，只把取值冲突的字段交给校验模型
+        if isinstance(new_settings, dict) and len(new_settings) > 0:
+            async with self._locks.setdefault(lanlan_name, asyncio.Lock()):
+                old_settings = self._load_character_settings(lanlan_name)
+                merged, conflicts = diff_settings(old_settings, new_settings)
+                if conflicts:
+                    old_conflicts, new_conflicts = _split_conflicts(conflicts)
+                    resolved = await self.detect_and_resolve_contradictions(old_conflicts, new_conflicts, lanlan_name)
+                    if isinstance(resolved, dict):
+                        _deep_update(merged, resolved)
+                if merged == old_settings:
+                    return
+                self.settings[lanlan_name] = merged
+                self.save_settings(lanlan_name)
 
     def get_settings(self, lanlan_name):
-        self.load_settings()
-        self.settings[lanlan_name][lanlan_name].update(self.lanlan_basic_config[lanlan_name])
-        self.settings[lanlan_name][self.name_mapping['human']].update(self.master_basic_config)
-        return self.settings[lanlan_name]
\ No newline at end of file
+        """角色设定与基础配置合并后的结果，只读取该角色的文件，且仅在文件变化后重新合并"""
+        settings = self._load_character_settings(lanlan_name)
+        if lanlan_name not in self._merged_settings:
+            merged = copy.deepcopy(settings)
+            merged.setdefault(lanlan_name, {}).update(self.lanlan_basic_config.get(lanlan_name, {}))
+            merged.setdefault(self.name_mapping['human'], {}).update(self.master_basic_config)
+            self._merged_settings[lanlan_name] = merged
+        return self._merged_settings[lanlan_name]
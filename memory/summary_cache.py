@@ -0,0 +1,112 @@
+from collections import OrderedDict
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class SummaryCache:
+    """
+    按内容寻址的摘要缓存（LRU，有容量上限，持久化到角色的记忆目录）
+
+    键为 hash(提示词变体 + 渲染后的对话文本)，只对"同一段内容被再次请求摘要"有效：
+    时间汇总在重启后重跑、失败后重试、并发的相同请求（由调用方合并为一次）。
+    各记忆模块之间并不共享条目：近期记忆压缩的是"旧备忘录 + 较早的消息"，时间索引摘要的是每个写入请求，
+    两者不是同一段内容；只有语义记忆（当前在 memory_server 中未启用）与时间索引摘要的是同一批消息。
+
+    写入只标记为脏，在事件循环中延迟 save_delay 秒后放到线程里整体落盘，连续的写入合并为一次；
+    没有运行中的事件循环时同步落盘。关闭前调用 flush() 写出尚未落盘的内容。
+    """
+
+    def __init__(self, path, max_entries=256, save_delay=2.0):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.save_delay = save_delay
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._version = 0  # 每次写入递增，防止较旧的快照覆盖较新的文件
+        self._saved_version = 0
+        self._save_handle = None
+        self._write_lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def make_key(messages_text, variant):
+        return hashlib.sha256(f"{variant}\n{messages_text}".encode('utf-8')).hexdigest()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for key, value in data:
+                self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        except Exception as e:
+            logger.warning(f"读取摘要缓存失败: {e}，使用空缓存")
+            self._entries.clear()
+
+    def _write(self, items, version):
+        """把快照写入文件（可在线程中执行）"""
+        with self._write_lock:
+            if version <= self._saved_version:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                tmp_path = self.path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(items, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+                self._saved_version = version
+            except Exception as e:
+                logger.warning(f"保存摘要缓存失败: {e}")
+
+    def _schedule_save(self):
+        if self._save_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        self._save_handle = loop.call_later(self.save_delay, self._save_in_background, loop)
+
+    def _save_in_background(self, loop):
+        self._save_handle = None
+        # 快照在事件循环线程中取，写文件放到线程池
+        loop.run_in_executor(None, self._write, list(self._entries.items()), self._version)
+
+    def flush(self):
+        """同步写出尚未落盘的内容"""
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        if self._version > self._saved_version:
+            self._write(list(self._entries.items()), self._version)
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._version += 1
+        self._schedule_save()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
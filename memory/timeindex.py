@@ -1,109 +1,292 @@
-from langchain_community.chat_message_histories import SQLChatMessageHistory
-from langchain_core.messages import SystemMessage
-from sqlalchemy import create_engine, text
-from config import TIME_ORIGINAL_TABLE_NAME, TIME_COMPRESSED_TABLE_NAME
+from langchain_core.messages import SystemMessage, message_to_dict
+from sqlalchemy import create_engine, event, text
+from config import TIME_ORIGINAL_TABLE_NAME, TIME_COMPRESSED_TABLE_NAME, TIME_ROLLUP_TABLE_NAME, TIME_ROLLUP_MAX_BUCKETS_PER_RUN
 from utils.config_manager import get_config_manager
-from datetime import datetime
+from memory.scheduler import PRIORITY_BACKGROUND
+from datetime import datetime, timedelta
+import asyncio
+import concurrent.futures
+import json
 import logging
 import os
+import queue
+import threading
 
 logger = logging.getLogger(__name__)
 
+# 时间索引库的结构版本，记录在 PRAGMA user_version 中
+# 0: 旧版（SQLChatMessageHistory 建表 + 事后 ALTER TABLE 补 timestamp 列，无索引）
+# 1: 显式建表（含 timestamp 列），timestamp / session_id 索引
+# 2: 按日/周/月汇总的摘要表
+SCHEMA_VERSION = 2
+
+# 汇总粒度，由细到粗
+ROLLUP_LEVELS = ('day', 'week', 'month')
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+def _create_tables(conn):
+    for table in (TIME_ORIGINAL_TABLE_NAME, TIME_COMPRESSED_TABLE_NAME):
+        # 列定义与 SQLChatMessageHistory 保持一致，旧数据无需转换
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "id INTEGER NOT NULL PRIMARY KEY, "
+            "session_id TEXT, "
+            "message TEXT, "
+            "timestamp DATETIME)"
+        ))
+        columns = [row[1] for row in conn.execute(text(f"PRAGMA table_info({table})")).fetchall()]
+        if 'timestamp' not in columns:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN timestamp DATETIME"))
+
+
+def _create_indexes(conn):
+    for table in (TIME_ORIGINAL_TABLE_NAME, TIME_COMPRESSED_TABLE_NAME):
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{table}_timestamp ON {table} (timestamp)"))
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{table}_session_id ON {table} (session_id)"))
+
+
+def _create_rollup_table(conn):
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {TIME_ROLLUP_TABLE_NAME} ("
+        "id INTEGER NOT NULL PRIMARY KEY, "
+        "level TEXT NOT NULL, "
+        "bucket_start DATETIME NOT NULL, "
+        "bucket_end DATETIME NOT NULL, "
+        "summary TEXT NOT NULL, "
+        "source_count INTEGER NOT NULL DEFAULT 0, "
+        "created_at DATETIME)"
+    ))
+    conn.execute(text(
+        f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{TIME_ROLLUP_TABLE_NAME}_level_start "
+        f"ON {TIME_ROLLUP_TABLE_NAME} (level, bucket_start)"
+    ))
+
+
+# 按版本顺序执行的迁移，MIGRATIONS[i] 把库从版本 i 升级到 i+1
+MIGRATIONS = [
+    lambda conn: (_create_tables(conn), _create_indexes(conn)),
+    _create_rollup_table,
+]
+
+
+def bucket_start(level, dt):
+    """dt 所在的日/周（周一开始）/月的起始时间"""
+    if level == 'month':
+        return datetime(dt.year, dt.month, 1)
+    day = datetime(dt.year, dt.month, dt.day)
+    if level == 'week':
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def bucket_end(level, start):
+    if level == 'month':
+        return datetime(start.year + 1, 1, 1) if start.month == 12 else datetime(start.year, start.month + 1, 1)
+    if level == 'week':
+        return start + timedelta(days=7)
+    return start + timedelta(days=1)
+
+
+def _parse_time(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+
+
+def _message_content(message):
+    try:
+        return json.loads(message)['data']['content']
+    except Exception:
+        return message
+
+
+def migrate(engine):
+    """
+    把数据库升级到 SCHEMA_VERSION，整个迁移在一个事务中完成。
+    pysqlite 默认会在DDL前自动提交，因此在自动提交模式下显式 BEGIN，让建表、建索引与 user_version 一起提交或回滚。
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute(text("PRAGMA user_version")).scalar() or 0
+            if version >= SCHEMA_VERSION:
+                conn.exec_driver_sql("COMMIT")
+                return version
+            for target in range(version, SCHEMA_VERSION):
+                MIGRATIONS[target](conn)
+            # PRAGMA 不支持参数绑定
+            conn.execute(text(f"PRAGMA user_version = {int(SCHEMA_VERSION)}"))
+            conn.exec_driver_sql("COMMIT")
+        except BaseException:
+            conn.exec_driver_sql("ROLLBACK")
+            raise
+    logger.info(f"[TimeIndexedMemory] {engine.url.database} 结构已从版本 {version} 升级到 {SCHEMA_VERSION}")
+    return SCHEMA_VERSION
+
+
+def open_engine(db_path):
+    """打开角色的时间索引库（WAL），并升级到最新结构"""
+    engine = create_engine(f"sqlite:///{db_path}")
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    migrate(engine)
+    return engine
+
+
+class SQLiteWriter:
+    """
+    单个数据库的专用写线程
+
+    所有写操作在该线程上串行执行，不占用事件循环；队列有上限，写入堆积时
+    调用方在线程池中等待入队（背压），而不会阻塞其他请求。
+    读操作不经过写线程，借助WAL可与写入并发进行。
+    """
+
+    def __init__(self, name, max_pending=32):
+        self.name = name
+        self._queue = queue.Queue(maxsize=max_pending)
+        # 入队与关闭互斥：关闭后不再接受写入，已入队的写入都排在结束标记之前
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"sqlite-writer-{name}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            fn, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn())
+            except BaseException as e:
+                future.set_exception(e)
+
+    def _put(self, item, block):
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError(f"{self.name} 的写线程已关闭")
+                try:
+                    # 阻塞入队时分段等待，避免长时间持锁导致 close 无法执行
+                    self._queue.put(item, block=block, timeout=0.1 if block else None)
+                    return
+                except queue.Full:
+                    if not block:
+                        raise
+
+    async def submit(self, fn):
+        """在写线程上执行 fn() 并等待结果；写线程关闭后抛出 RuntimeError"""
+        future = concurrent.futures.Future()
+        try:
+            self._put((fn, future), block=False)
+        except queue.Full:
+            logger.debug(f"[TimeIndexedMemory] {self.name} 写队列已满，等待写入完成")
+            await asyncio.to_thread(self._put, (fn, future), True)
+        return await asyncio.wrap_future(future)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _fail_pending(self):
+        """让仍在队列中的写入以异常结束，避免调用方永久等待"""
+        failed = 0
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return failed
+            if item is None:
+                continue
+            _, future = item
+            if future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError(f"{self.name} 的写线程已关闭，写入未执行"))
+                failed += 1
+
+    def close(self, timeout=30):
+        """处理完已入队的写操作后退出线程；超时仍未执行的写入以异常结束"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+        failed = self._fail_pending()
+        if failed:
+            logger.warning(f"[TimeIndexedMemory] {self.name} 写线程关闭超时，{failed} 个写入未执行")
+        if self._thread.is_alive():
+            # 结束标记可能已被取出，重新放入，让写线程处理完当前写入后退出
+            self._queue.put_nowait(None)
+
+
 class TimeIndexedMemory:
     def __init__(self, recent_history_manager):
         self.engine = {}
+        self.writers = {}
         self.recent_history_manager = recent_history_manager
         _, _, _, _, _, _, _, time_store, _, _ = get_config_manager().get_character_data()
         for i in time_store:
-            self.engine[i] = create_engine(f"sqlite:///{time_store[i]}")
+            self._init_engine(i, time_store[i])
 
-            _ = SQLChatMessageHistory(
-                connection=self.engine[i],
-                session_id="",
-                table_name=TIME_ORIGINAL_TABLE_NAME,
-            )
-
-            _ = SQLChatMessageHistory(
-                connection=self.engine[i],
-                session_id="",
-                table_name=TIME_COMPRESSED_TABLE_NAME,
-            )
-            self.check_table_schema(i)
+    def _init_engine(self, lanlan_name, db_path):
+        engine = open_engine(db_path)
+        self.engine[lanlan_name] = engine
+        self.writers[lanlan_name] = SQLiteWriter(lanlan_name)
+        return engine
 
-    def add_timestamp_column(self, lanlan_name):
-        with self.engine[lanlan_name].connect() as conn:
-            conn.execute(text(f"ALTER TABLE {TIME_ORIGINAL_TABLE_NAME} ADD COLUMN timestamp DATETIME"))
-            conn.execute(text(f"ALTER TABLE {TIME_COMPRESSED_TABLE_NAME} ADD COLUMN timestamp DATETIME"))
-            conn.commit()
+    def close(self):
+        """停止写线程（会先处理完队列中的写入）并释放连接"""
+        for writer in self.writers.values():
+            writer.close()
+        for engine in self.engine.values():
+            engine.dispose()
 
     def check_table_schema(self, lanlan_name):
-        with self.engine[lanlan_name].connect() as conn:
-            result = conn.execute(text(f"PRAGMA table_info({TIME_ORIGINAL_TABLE_NAME})"))
-            columns = result.fetchall()
-            for i in columns:
-                if i[1] == 'timestamp':
-                    return
-            self.add_timestamp_column(lanlan_name)
+        return migrate(self.engine[lanlan_name])
+
+    def _default_path(self, lanlan_name):
+        config_mgr = get_config_manager()
+        # 确保memory目录存在
+        config_mgr.ensure_memory_directory()
+        return os.path.join(str(config_mgr.memory_dir), f'time_indexed_{lanlan_name}')
 
     async def store_conversation(self, event_id, messages, lanlan_name, timestamp=None):
         # 检查角色是否存在于配置中，如果不存在则创建默认路径
         try:
             _, _, _, _, _, _, _, time_store, _, _ = get_config_manager().get_character_data()
-            
+            time_store = dict(time_store)
+
             # 如果角色不在配置中，使用默认路径创建
             if lanlan_name not in time_store:
-                config_mgr = get_config_manager()
-                # 确保memory目录存在
-                config_mgr.ensure_memory_directory()
-                memory_base = str(config_mgr.memory_dir)
-                default_path = os.path.join(memory_base, f'time_indexed_{lanlan_name}')
-                time_store[lanlan_name] = default_path
-                logger.info(f"[TimeIndexedMemory] 角色 '{lanlan_name}' 不在配置中，使用默认路径: {default_path}")
-            
+                time_store[lanlan_name] = self._default_path(lanlan_name)
+                logger.info(f"[TimeIndexedMemory] 角色 '{lanlan_name}' 不在配置中，使用默认路径: {time_store[lanlan_name]}")
+
             # 确保数据库引擎存在
             if lanlan_name not in self.engine:
-                # 创建数据库引擎和表
-                db_path = time_store[lanlan_name]
-                self.engine[lanlan_name] = create_engine(f"sqlite:///{db_path}")
-                _ = SQLChatMessageHistory(
-                    connection=self.engine[lanlan_name],
-                    session_id="",
-                    table_name=TIME_ORIGINAL_TABLE_NAME,
-                )
-                _ = SQLChatMessageHistory(
-                    connection=self.engine[lanlan_name],
-                    session_id="",
-                    table_name=TIME_COMPRESSED_TABLE_NAME,
-                )
-                self.check_table_schema(lanlan_name)
-                logger.info(f"[TimeIndexedMemory] 为角色 {lanlan_name} 创建数据库引擎: {db_path}")
+                self._init_engine(lanlan_name, time_store[lanlan_name])
+                logger.info(f"[TimeIndexedMemory] 为角色 {lanlan_name} 创建数据库引擎: {time_store[lanlan_name]}")
         except Exception as e:
             logger.error(f"检查角色配置失败: {e}")
             # 即使配置检查失败，也尝试使用默认路径
             try:
-                config_mgr = get_config_manager()
-                # 确保memory目录存在
-                config_mgr.ensure_memory_directory()
-                memory_base = str(config_mgr.memory_dir)
-                default_path = os.path.join(memory_base, f'time_indexed_{lanlan_name}')
                 if lanlan_name not in self.engine:
-                    self.engine[lanlan_name] = create_engine(f"sqlite:///{default_path}")
-                    _ = SQLChatMessageHistory(
-                        connection=self.engine[lanlan_name],
-                        session_id="",
-                        table_name=TIME_ORIGINAL_TABLE_NAME,
-                    )
-                    _ = SQLChatMessageHistory(
-                        connection=self.engine[lanlan_name],
-                        session_id="",
-                        table_name=TIME_COMPRESSED_TABLE_NAME,
-                    )
-                    self.check_table_schema(lanlan_name)
+                    default_path = self._default_path(lanlan_name)
+                    self._init_engine(lanlan_name, default_path)
                     logger.info(f"[TimeIndexedMemory] 使用默认路径创建数据库: {default_path}")
             except Exception as e2:
                 logger.error(f"创建默认数据库失败: {e2}")
                 return
-        
+
         if timestamp is None:
             timestamp = datetime.now()
 
@@ -111,31 +294,27 @@ class TimeIndexedMemory:
             logger.error(f"角色 '{lanlan_name}' 的数据库引擎不存在")
             return
 
-        origin_history = SQLChatMessageHistory(
-            connection=self.engine[lanlan_name],
-            session_id=event_id,
-            table_name=TIME_ORIGINAL_TABLE_NAME,
-        )
-
-        compressed_history = SQLChatMessageHistory(
-            connection=self.engine[lanlan_name],
-            session_id=event_id,
-            table_name=TIME_COMPRESSED_TABLE_NAME,
-        )
+        summary = (await self.recent_history_manager.compress_history(messages, lanlan_name))[1]
 
-        origin_history.add_messages(messages)
-        compressed_history.add_message(SystemMessage((await self.recent_history_manager.compress_history(messages, lanlan_name))[1]))
+        original_rows = [
+            {"session_id": event_id, "message": json.dumps(message_to_dict(m)), "timestamp": timestamp}
+            for m in messages
+        ]
+        summary_row = {"session_id": event_id, "message": json.dumps(message_to_dict(SystemMessage(summary))), "timestamp": timestamp}
+        await self.writers[lanlan_name].submit(lambda: self._insert(lanlan_name, original_rows, summary_row))
 
-        with self.engine[lanlan_name].connect() as conn:
-            conn.execute(
-                text(f"UPDATE {TIME_ORIGINAL_TABLE_NAME} SET timestamp = :timestamp WHERE session_id = :session_id"),
-                {"timestamp": timestamp, "session_id": event_id}
-            )
+    def _insert(self, lanlan_name, original_rows, summary_row):
+        # 原始消息与摘要在同一事务中写入，timestamp 直接随行写入
+        with self.engine[lanlan_name].begin() as conn:
+            if original_rows:
+                conn.execute(
+                    text(f"INSERT INTO {TIME_ORIGINAL_TABLE_NAME} (session_id, message, timestamp) VALUES (:session_id, :message, :timestamp)"),
+                    original_rows
+                )
             conn.execute(
-                text(f"UPDATE {TIME_COMPRESSED_TABLE_NAME} SET timestamp = :timestamp WHERE session_id = :session_id"),
-                {"timestamp": timestamp, "session_id": event_id}
+                text(f"INSERT INTO {TIME_COMPRESSED_TABLE_NAME} (session_id, message, timestamp) VALUES (:session_id, :message, :timestamp)"),
+                summary_row
             )
-            conn.commit()
 
     def retrieve_summary_by_timeframe(self, lanlan_name, start_time, end_time):
         with self.engine[lanlan_name].connect() as conn:
@@ -152,4 +331,131 @@ class TimeIndexedMemory:
                 text(f"SELECT session_id, message FROM {TIME_ORIGINAL_TABLE_NAME} WHERE timestamp BETWEEN :start_time AND :end_time"),
                 {"start_time": start_time, "end_time": end_time}
             )
-            return result.fetchall()
\ No newline at end of file
+            return result.fetchall()
+
+    async def aretrieve_summary_by_timeframe(self, lanlan_name, start_time, end_time):
+        return await asyncio.to_thread(self.retrieve_summary_by_timeframe, lanlan_name, start_time, end_time)
+
+    async def aretrieve_original_by_timeframe(self, lanlan_name, start_time, end_time):
+        return await asyncio.to_thread(self.retrieve_original_by_timeframe, lanlan_name, start_time, end_time)
+
+    # --- 按日/周/月汇总 ---
+
+    def _fetch_sessions(self, lanlan_name, start_time, end_time):
+        """[start_time, end_time) 内的会话摘要，返回 [(级别, 开始, 结束, 摘要), ...]"""
+        with self.engine[lanlan_name].connect() as conn:
+            rows = conn.execute(
+                text(f"SELECT message, timestamp FROM {TIME_COMPRESSED_TABLE_NAME} "
+                     "WHERE timestamp >= :start_time AND timestamp < :end_time ORDER BY timestamp"),
+                {"start_time": start_time, "end_time": end_time}
+            ).fetchall()
+        entries = []
+        for message, timestamp in rows:
+            timestamp = _parse_time(timestamp)
+            entries.append(('session', timestamp, timestamp, _message_content(message)))
+        return entries
+
+    def _cover(self, lanlan_name, start_time, end_time, levels):
+        """
+        用尽可能粗的已有汇总覆盖 [start_time, end_time)，没有汇总的部分退回会话摘要。
+        无论时间跨度多长，返回的条数都只与跨越的月数相关，而不是会话数。
+        """
+        with self.engine[lanlan_name].connect() as conn:
+            rows = conn.execute(
+                text(f"SELECT level, bucket_start, bucket_end, summary FROM {TIME_ROLLUP_TABLE_NAME} "
+                     "WHERE bucket_start >= :start_time AND bucket_start < :end_time"),
+                {"start_time": start_time, "end_time": end_time}
+            ).fetchall()
+        rollups = {(level, _parse_time(bs)): summary for level, bs, _, summary in rows if level in levels}
+
+        entries = []
+        gap_start = None
+        cursor = start_time
+        while cursor < end_time:
+            chosen = None
+            for level in reversed(levels):
+                start = bucket_start(level, cursor)
+                end = bucket_end(level, start)
+                if start == cursor and end <= end_time and (level, start) in rollups:
+                    chosen = (level, start, end, rollups[(level, start)])
+                    break
+            if chosen is None:
+                if gap_start is None:
+                    gap_start = cursor
+                cursor = min(bucket_start('day', cursor) + timedelta(days=1), end_time)
+                continue
+            if gap_start is not None:
+                entries.extend(self._fetch_sessions(lanlan_name, gap_start, cursor))
+                gap_start = None
+            entries.append(chosen)
+            cursor = chosen[2]
+        if gap_start is not None:
+            entries.extend(self._fetch_sessions(lanlan_name, gap_start, end_time))
+        return entries
+
+    def retrieve_rollup_by_timeframe(self, lanlan_name, start_time, end_time):
+        """按时间范围回忆：返回覆盖该范围的最粗粒度汇总 [(级别, 开始, 结束, 摘要), ...]"""
+        return self._cover(lanlan_name, start_time, end_time, ROLLUP_LEVELS)
+
+    async def aretrieve_rollup_by_timeframe(self, lanlan_name, start_time, end_time):
+        return await asyncio.to_thread(self.retrieve_rollup_by_timeframe, lanlan_name, start_time, end_time)
+
+    def _pending_buckets(self, lanlan_name, level, now):
+        """该粒度下已经结束、且晚于最后一条汇总的时间桶（按时间顺序）"""
+        limit = bucket_start(level, now)
+        with self.engine[lanlan_name].connect() as conn:
+            last_end = conn.execute(
+                text(f"SELECT MAX(bucket_end) FROM {TIME_ROLLUP_TABLE_NAME} WHERE level = :level"),
+                {"level": level}
+            ).scalar()
+            since = _parse_time(last_end) if last_end else datetime.min
+            days = conn.execute(
+                text(f"SELECT DISTINCT substr(timestamp, 1, 10) FROM {TIME_COMPRESSED_TABLE_NAME} "
+                     "WHERE timestamp >= :since AND timestamp < :limit"),
+                {"since": since, "limit": limit}
+            ).fetchall()
+        starts = {bucket_start(level, datetime.fromisoformat(day)) for day, in days if day}
+        return sorted(s for s in starts if s >= since and bucket_end(level, s) <= limit)
+
+    def _store_rollup(self, lanlan_name, level, start, end, summary, source_count):
+        with self.engine[lanlan_name].begin() as conn:
+            conn.execute(
+                text(f"INSERT OR REPLACE INTO {TIME_ROLLUP_TABLE_NAME} "
+                     "(level, bucket_start, bucket_end, summary, source_count, created_at) "
+                     "VALUES (:level, :bucket_start, :bucket_end, :summary, :source_count, :created_at)"),
+                {"level": level, "bucket_start": start, "bucket_end": end, "summary": summary,
+                 "source_count": source_count, "created_at": datetime.now()}
+            )
+
+    async def rollup(self, lanlan_name, now=None, max_buckets=TIME_ROLLUP_MAX_BUCKETS_PER_RUN):
+        """
+        把会话摘要汇总为日摘要，日摘要汇总为周摘要，再汇总为月摘要（月摘要的输入是
+        月内完整的周摘要加上首尾零散的日摘要）。只处理已经结束的时间桶，按时间顺序推进，
+        单次最多生成 max_buckets 条，返回本次生成的条数。
+        """
+        if lanlan_name not in self.engine:
+            return 0
+        now = now or datetime.now()
+        created = 0
+        for i, level in enumerate(ROLLUP_LEVELS):
+            for start in await asyncio.to_thread(self._pending_buckets, lanlan_name, level, now):
+                if created >= max_buckets:
+                    return created
+                end = bucket_end(level, start)
+                if i == 0:
+                    sources = await asyncio.to_thread(self._fetch_sessions, lanlan_name, start, end)
+                else:
+                    sources = await asyncio.to_thread(self._cover, lanlan_name, start, end, ROLLUP_LEVELS[:i])
+                if not sources:
+                    continue
+                messages = [SystemMessage(f"[{entry_start:%Y-%m-%d %H:%M}] {summary}") for _, entry_start, _, summary in sources]
+                summary = (await self.recent_history_manager.compress_history(messages, lanlan_name, priority=PRIORITY_BACKGROUND))[1]
+                if not summary:
+                    # 不跳过失败的时间桶，下次从这里继续
+                    logger.warning(f"[TimeIndexedMemory] {lanlan_name} {level} {start:%Y-%m-%d} 汇总失败")
+                    break
+                await self.writers[lanlan_name].submit(
+                    lambda: self._store_rollup(lanlan_name, level, start, end, summary, len(sources))
+                )
+                created += 1
+        return created
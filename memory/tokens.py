@@ -0,0 +1,93 @@
+"""
+消息token计数。
+
+优先使用 tiktoken（langchain-openai 的依赖）；编码表尚未加载或无法加载时（如离线环境首次运行）
+退化为本地估算：中日韩字符按每字1个token，其余字符按约4个字符1个token。
+
+编码表只在 ensure_encoding() 中加载：在线程中执行并限时等待，不会阻塞事件循环。
+本地没有缓存的编码表时默认不联网下载（TOKEN_ENCODING_ALLOW_DOWNLOAD）。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+
+from config import TOKEN_ENCODING_ALLOW_DOWNLOAD, TOKEN_ENCODING_LOAD_TIMEOUT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_CJK_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+# tiktoken 下载 cl100k_base 的地址，缓存文件名为其sha1（与 tiktoken.load.read_file_cached 一致）
+_ENCODING_BLOB = "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken"
+
+_encoding = None
+_encoding_failed = False
+_load_future = None
+
+
+def _encoding_cached():
+    """tiktoken 的本地缓存中是否已有 cl100k_base 编码表"""
+    cache_dir = os.environ.get("TIKTOKEN_CACHE_DIR", os.environ.get("DATA_GYM_CACHE_DIR"))
+    if cache_dir is None:
+        cache_dir = os.path.join(tempfile.gettempdir(), "data-gym-cache")
+    if not cache_dir:
+        return False
+    return os.path.exists(os.path.join(cache_dir, hashlib.sha1(_ENCODING_BLOB.encode()).hexdigest()))
+
+
+def _load_encoding():
+    global _encoding, _encoding_failed
+    try:
+        import tiktoken
+        if not TOKEN_ENCODING_ALLOW_DOWNLOAD and not _encoding_cached():
+            raise RuntimeError("本地没有缓存的cl100k_base编码表，且未允许下载")
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        _encoding_failed = True
+        logger.info(f"tiktoken不可用，使用本地估算token数: {e}")
+
+
+async def ensure_encoding(timeout=TOKEN_ENCODING_LOAD_TIMEOUT_SECONDS):
+    """
+    首次调用时在线程中加载编码表，最多等待 timeout 秒。
+    超时后加载在后台继续，完成前 count_tokens 使用估算；之后的调用不再等待。
+    """
+    global _load_future
+    if _encoding is not None or _encoding_failed or _load_future is not None:
+        return
+    _load_future = asyncio.ensure_future(asyncio.to_thread(_load_encoding))
+    try:
+        await asyncio.wait_for(asyncio.shield(_load_future), timeout)
+    except asyncio.TimeoutError:
+        logger.info(f"加载tiktoken编码表超过 {timeout} 秒，暂时使用本地估算token数")
+
+
+def estimate_tokens(text):
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def count_tokens(text):
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+def message_tokens(msg):
+    content = getattr(msg, 'content', msg)
+    if not isinstance(content, str):
+        parts = []
+        for item in content if isinstance(content, list) else [content]:
+            if isinstance(item, dict):
+                parts.append(item.get('text') or json.dumps(item, ensure_ascii=False))
+            else:
+                parts.append(str(item))
+        content = "\n".join(parts)
+    # 每条消息额外计入角色名等格式开销
+    return count_tokens(content) + 4
@@ -0,0 +1,266 @@
+"""
+轻量级本地向量库，替代因体积原因被移除的Chroma。
+
+每个集合在角色的语义记忆目录下保存三个文件：
+- <集合名>.f32：按行存放的归一化float32向量矩阵，以memmap方式读取
+- <集合名>.jsonl：与矩阵逐行对应的文本与元数据
+- <集合名>.meta.json：向量维度与生成向量所用的embedding模型
+
+检索为暴力余弦相似度（归一化后的矩阵乘法），单个角色的记忆规模下足够快。
+embedding模型变化、或崩溃后向量与记录对不上时，会用保存的原文重新生成全部向量；记录不会因此被截断。
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import List
+
+import numpy as np
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+
+class HashingEmbeddings:
+    """
+    本地确定性embedding（字符n-gram特征哈希），不依赖任何网络服务。
+    用于未配置API Key时的降级，以及测试中替代远程embedding。
+    """
+
+    def __init__(self, dim=256, ngram_range=(1, 3)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.model = f"local-hashing-{dim}"
+
+    def _embed(self, text):
+        vec = np.zeros(self.dim, dtype=np.float32)
+        text = re.sub(r'\s+', ' ', text.lower())
+        for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+            for i in range(len(text) - n + 1):
+                digest = hashlib.md5(text[i:i + n].encode('utf-8')).digest()
+                index = int.from_bytes(digest[:4], 'little') % self.dim
+                vec[index] += 1.0 if digest[4] & 1 else -1.0
+        return vec.tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+    async def aembed_documents(self, texts):
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text):
+        return self.embed_query(text)
+
+
+def embedding_model_name(embeddings):
+    return getattr(embeddings, 'model', None) or type(embeddings).__name__
+
+
+def collection_paths(persist_directory, collection_name):
+    """向量库的三个文件：(float32向量矩阵, 记录NDJSON, 元数据JSON)"""
+    base = os.path.join(str(persist_directory), collection_name)
+    return base + '.f32', base + '.jsonl', base + '.meta.json'
+
+
+class LocalVectorStore:
+    """兼容 add_texts / similarity_search 接口的本地向量库"""
+
+    def __init__(self, persist_directory, collection_name, embedding_function):
+        self.persist_directory = str(persist_directory)
+        self.collection_name = collection_name
+        self.embeddings = embedding_function
+        self._matrix_path, self._records_path, self._meta_path = collection_paths(self.persist_directory, collection_name)
+        self._records = []
+        self._matrix = None  # np.memmap，惰性加载
+        self._meta = {'dim': None, 'model': None}
+        self._stale = False  # 矩阵与记录对不上，需要用原文重新生成向量
+        self._load()
+
+    # --- 持久化 ---
+
+    def _load(self):
+        if os.path.exists(self._meta_path):
+            try:
+                with open(self._meta_path, 'r', encoding='utf-8') as f:
+                    self._meta.update(json.load(f))
+            except Exception as e:
+                logger.warning(f"读取向量库元数据失败: {e}")
+        torn = False
+        if os.path.exists(self._records_path):
+            with open(self._records_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        torn = True  # 崩溃遗留的不完整记录
+                        break
+                    try:
+                        self._records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        torn = True
+                        break
+        if torn:
+            # 去掉不完整的尾部，避免之后追加的记录接在它后面
+            logger.warning(f"向量库 {self.collection_name} 的记录文件尾部不完整，保留前 {len(self._records)} 条")
+            self._write_records()
+        if not self._records:
+            return
+        dim = self._meta.get('dim')
+        if not dim:
+            # 元数据缺失时无法确定矩阵的行数：保留全部记录，下次使用前用原文重新生成向量
+            logger.warning(f"向量库 {self.collection_name} 缺少元数据，将用保存的原文重新生成向量")
+            self._stale = True
+            return
+        rows = self._matrix_rows()
+        if rows < len(self._records):
+            logger.warning(f"向量库 {self.collection_name} 的向量少于记录（向量 {rows}，记录 {len(self._records)}），将用保存的原文重新生成向量")
+            self._stale = True
+        elif os.path.getsize(self._matrix_path) != len(self._records) * dim * 4:
+            # 先写向量再写记录：写入中途崩溃时多出的向量行（或半行）没有对应记录，直接截掉
+            logger.warning(f"向量库 {self.collection_name} 的向量多于记录（向量 {rows}，记录 {len(self._records)}），截断到 {len(self._records)}")
+            with open(self._matrix_path, 'r+b') as f:
+                f.truncate(len(self._records) * dim * 4)
+
+    def _matrix_rows(self):
+        dim = self._meta.get('dim')
+        if not dim or not os.path.exists(self._matrix_path):
+            return 0
+        return os.path.getsize(self._matrix_path) // (dim * 4)
+
+    def _write_records(self):
+        os.makedirs(self.persist_directory, exist_ok=True)
+        tmp_path = self._records_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in self._records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, self._records_path)
+
+    def _write_meta(self):
+        os.makedirs(self.persist_directory, exist_ok=True)
+        tmp_path = self._meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._meta, f)
+        os.replace(tmp_path, self._meta_path)
+
+    def _get_matrix(self):
+        if self._matrix is None:
+            rows = self._matrix_rows()
+            if rows == 0:
+                return np.zeros((0, self._meta.get('dim') or 0), dtype=np.float32)
+            self._matrix = np.memmap(self._matrix_path, dtype=np.float32, mode='r', shape=(rows, self._meta['dim']))
+        return self._matrix
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _append_vectors(self, vectors, records):
+        vectors = self._normalize(vectors)
+        if self._meta.get('dim') != vectors.shape[1]:
+            self._meta['dim'] = int(vectors.shape[1])
+        self._meta['model'] = embedding_model_name(self.embeddings)
+        self._write_meta()
+        self._matrix = None  # 释放memmap后再追加写
+        os.makedirs(self.persist_directory, exist_ok=True)
+        # 先写向量再写记录：崩溃时多出的向量行会在下次加载时被截掉
+        with open(self._matrix_path, 'ab') as f:
+            f.write(vectors.tobytes())
+        with open(self._records_path, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._records.extend(records)
+
+    def _needs_rebuild(self):
+        return bool(self._records) and (self._stale or self._meta.get('model') != embedding_model_name(self.embeddings))
+
+    def _rebuild_from(self, vectors):
+        """
+        embedding模型变化或向量与记录对不上时，用新生成的向量整体替换矩阵。
+        记录文件不变；新矩阵先写入临时文件再原子替换，替换完成后才更新元数据，
+        中途崩溃时旧矩阵与记录原样保留，元数据仍指向旧模型，下次会重新构建。
+        """
+        self._matrix = None
+        if self._records:
+            vectors = self._normalize(vectors)
+            os.makedirs(self.persist_directory, exist_ok=True)
+            tmp_path = self._matrix_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(vectors.tobytes())
+            os.replace(tmp_path, self._matrix_path)
+            self._meta['dim'] = int(vectors.shape[1])
+        self._meta['model'] = embedding_model_name(self.embeddings)
+        self._write_meta()
+        self._stale = False
+        logger.info(f"向量库 {self.collection_name} 已用模型 {self._meta.get('model')} 重建，共 {len(self._records)} 条")
+
+    # --- 对外接口 ---
+
+    def __len__(self):
+        return len(self._records)
+
+    def add_texts(self, texts: List[str], metadatas=None, ids=None):
+        texts = list(texts)
+        if not texts:
+            return []
+        if self._needs_rebuild():
+            self._rebuild_from(self.embeddings.embed_documents([r['text'] for r in self._records]))
+        return self._add_embedded(texts, self.embeddings.embed_documents(texts), metadatas, ids)
+
+    async def aadd_texts(self, texts: List[str], metadatas=None, ids=None):
+        texts = list(texts)
+        if not texts:
+            return []
+        if self._needs_rebuild():
+            self._rebuild_from(await self.embeddings.aembed_documents([r['text'] for r in self._records]))
+        return self._add_embedded(texts, await self.embeddings.aembed_documents(texts), metadatas, ids)
+
+    def _add_embedded(self, texts, vectors, metadatas, ids):
+        metadatas = metadatas or [{} for _ in texts]
+        start = len(self._records)
+        ids = ids or [f"{self.collection_name}-{start + i}" for i in range(len(texts))]
+        records = [{'id': i, 'text': t, 'metadata': m} for i, t, m in zip(ids, texts, metadatas)]
+        self._append_vectors(vectors, records)
+        return ids
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4):
+        matrix = self._get_matrix()
+        if len(matrix) == 0:
+            return []
+        query = self._normalize(embedding)[0]
+        if query.shape[0] != matrix.shape[1]:
+            logger.warning(f"查询向量维度 {query.shape[0]} 与向量库维度 {matrix.shape[1]} 不一致")
+            return []
+        scores = matrix @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        results = []
+        for idx in top:
+            record = self._records[idx]
+            metadata = dict(record.get('metadata') or {})
+            metadata.setdefault('id', record['id'])
+            results.append((Document(page_content=record['text'], metadata=metadata), float(scores[idx])))
+        return results
+
+    def similarity_search_with_score(self, query: str, k=4):
+        if self._needs_rebuild():
+            self._rebuild_from(self.embeddings.embed_documents([r['text'] for r in self._records]))
+        return self.similarity_search_by_vector_with_score(self.embeddings.embed_query(query), k)
+
+    def similarity_search(self, query: str, k=4):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    async def asimilarity_search_with_score(self, query: str, k=4):
+        if self._needs_rebuild():
+            self._rebuild_from(await self.embeddings.aembed_documents([r['text'] for r in self._records]))
+        return self.similarity_search_by_vector_with_score(await self.embeddings.aembed_query(query), k)
+
+    async def asimilarity_search(self, query: str, k=4):
+        return [doc for doc, _ in await self.asimilarity_search_with_score(query, k)]
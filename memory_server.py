@@ -1,17 +1,23 @@
 # -*- coding: utf-8 -*-
 import sys, os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-from memory import CompressedRecentHistoryManager, SemanticMemory, ImportantSettingsManager, TimeIndexedMemory
-from fastapi import FastAPI
+from memory import CompressedRecentHistoryManager, SemanticMemory, ImportantSettingsManager, TimeIndexedMemory, MemoryIngestQueue
+from memory import llm_clients, archive
+from memory.scheduler import llm_scheduler
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 import json
 import uvicorn
 from langchain_core.messages import convert_to_messages
 from uuid import uuid4
-from config import MEMORY_SERVER_PORT
+from urllib.parse import quote
+from config import MEMORY_SERVER_PORT, MEMORY_INGEST_DEBOUNCE_SECONDS, MEMORY_INGEST_MAX_DELAY_SECONDS, TIME_ROLLUP_INTERVAL_SECONDS
 from utils.config_manager import get_config_manager
 from pydantic import BaseModel
 import re
+import hashlib
 import asyncio
+from datetime import datetime
 import logging
 import argparse
 
@@ -34,6 +40,13 @@ time_manager = TimeIndexedMemory(recent_history_manager)
 # 用于保护重新加载操作的锁
 _reload_lock = asyncio.Lock()
 
+# 正则表达式：删除所有类型括号及其内容（包括[]、()、{}、<>、【】、（）等）
+_BRACKETS_PATTERN = re.compile(r'(\[.*?\]|\(.*?\)|（.*?）|【.*?】|\{.*?\}|<.*?>)')
+
+# new_dialog 渲染结果缓存 {lanlan_name: (版本键, ETag, 渲染结果)}
+# 版本键由近期历史版本号、设定文件状态和角色配置文件状态组成，任一变化即失效
+_new_dialog_cache = {}
+
 async def reload_memory_components():
     """重新加载记忆组件配置（用于新角色创建后）
     
@@ -50,11 +63,19 @@ async def reload_memory_components():
             new_settings = ImportantSettingsManager()
             new_time = TimeIndexedMemory(new_recent)
             
+            old_time = time_manager
+            old_recent = recent_history_manager
+
             # 然后原子性地交换引用
             recent_history_manager = new_recent
             semantic_manager = new_semantic
             settings_manager = new_settings
             time_manager = new_time
+            _new_dialog_cache.clear()
+            # 等后台正在进行的时间索引写入结束，旧实例的写线程处理完已排队的写入后退出
+            await _wait_background_stores(timeout=30)
+            await asyncio.to_thread(old_time.close)
+            await asyncio.to_thread(old_recent.flush_summary_caches)
             
             logger.info("[MemoryServer] ✅ 记忆组件配置重新加载完成")
             return True
@@ -69,6 +90,8 @@ enable_shutdown = False
 # 全局变量用于管理correction任务
 correction_tasks = {}  # {lanlan_name: asyncio.Task}
 correction_cancel_flags = {}  # {lanlan_name: asyncio.Event}
+correction_pending = set()  # 审阅进行中又有新消息写入、需要在结束后再审阅一轮的角色
+_background_stores = {}  # {lanlan_name: asyncio.Task}，批次的时间索引写入与review重启（在后台按顺序执行）
 
 @app.post("/shutdown")
 async def shutdown_memory_server():
@@ -86,11 +109,39 @@ async def shutdown_memory_server():
         logger.error(f"处理关闭信号时出错: {e}")
         return {"status": "error", "message": str(e)}
 
+async def _rollup_loop():
+    """定期把时间索引记忆中的会话摘要汇总为日/周/月摘要"""
+    while True:
+        for lanlan_name in list(time_manager.engine):
+            try:
+                created = await time_manager.rollup(lanlan_name)
+                if created:
+                    logger.info(f"[MemoryServer] {lanlan_name} 新增 {created} 条时间汇总")
+            except Exception as e:
+                logger.error(f"[MemoryServer] {lanlan_name} 时间汇总失败: {e}", exc_info=True)
+        await asyncio.sleep(TIME_ROLLUP_INTERVAL_SECONDS)
+
+_rollup_task = None
+
+@app.on_event("startup")
+async def startup_event_handler():
+    global _rollup_task
+    _rollup_task = asyncio.create_task(_rollup_loop())
+
 @app.on_event("shutdown")
 async def shutdown_event_handler():
     """应用关闭时执行清理工作"""
     logger.info("Memory server正在关闭...")
-    # 这里可以添加任何需要的清理工作
+    if _rollup_task:
+        _rollup_task.cancel()
+    # 处理写入队列中尚未落盘的请求，避免丢失聊天记录
+    try:
+        await asyncio.wait_for(ingest_queue.flush(), timeout=60)
+    except Exception as e:
+        logger.error(f"关闭前处理写入队列失败: {e}")
+    await _wait_background_stores(timeout=60)
+    await asyncio.to_thread(time_manager.close)
+    await asyncio.to_thread(recent_history_manager.flush_summary_caches)
     logger.info("Memory server已关闭")
 
 
@@ -119,89 +170,112 @@ async def _run_review_in_background(lanlan_name: str):
         # 重置取消标志
         if lanlan_name in correction_cancel_flags:
             correction_cancel_flags[lanlan_name].clear()
+        # 审阅期间有新消息写入，再审阅一轮（只会提交新增的消息）
+        if lanlan_name in correction_pending:
+            correction_pending.discard(lanlan_name)
+            correction_tasks[lanlan_name] = asyncio.create_task(_run_review_in_background(lanlan_name))
 
-@app.post("/process/{lanlan_name}")
-async def process_conversation(request: HistoryRequest, lanlan_name: str):
-    global correction_tasks
-    try:
-        # 检查角色是否存在于配置中，如果不存在则记录信息但继续处理（允许新角色）
-        try:
-            character_data = _config_manager.load_characters()
-            catgirl_names = list(character_data.get('猫娘', {}).keys())
-            if lanlan_name not in catgirl_names:
-                logger.info(f"[MemoryServer] 角色 '{lanlan_name}' 不在配置中，但继续处理（可能是新创建的角色）")
-        except Exception as e:
-            logger.warning(f"检查角色配置失败: {e}，继续处理")
-        
+async def _restart_review(lanlan_name: str):
+    """在后台审阅该角色新增的历史记录"""
+    if lanlan_name in correction_tasks and not correction_tasks[lanlan_name].done():
+        # 审阅是增量的，且保存前会校验所审阅的片段未被改动，因此不必中断正在进行的审阅，
+        # 等它结束后再审阅一轮新消息即可
+        correction_pending.add(lanlan_name)
+        return
+    
+    # 启动新的review任务
+    task = asyncio.create_task(_run_review_in_background(lanlan_name))
+    correction_tasks[lanlan_name] = task
+
+async def _store_payloads(lanlan_name: str, payloads: list, previous: asyncio.Task = None):
+    """后台把每个请求的消息以各自的会话ID写入时间索引（含摘要LLM调用），再重启review"""
+    if previous is not None:
+        # 同一角色的批次按顺序写入
+        await asyncio.gather(previous, return_exceptions=True)
+    for input_history, _ in payloads:
         uid = str(uuid4())
-        input_history = convert_to_messages(json.loads(request.input_history))
-        logger.info(f"[MemoryServer] 收到 {lanlan_name} 的对话历史处理请求，消息数: {len(input_history)}")
-        await recent_history_manager.update_history(input_history, lanlan_name)
-        """
-        下面屏蔽了两个模块，因为这两个模块需要消耗token，但当前版本实用性近乎于0。尤其是，Qwen与GPT等旗舰模型相比性能差距过大。
-        """
+        # 下面屏蔽了两个模块，因为这两个模块需要消耗token，但当前版本实用性近乎于0。尤其是，Qwen与GPT等旗舰模型相比性能差距过大。
         # await settings_manager.extract_and_update_settings(input_history, lanlan_name)
         # await semantic_manager.store_conversation(uid, input_history, lanlan_name)
-        await time_manager.store_conversation(uid, input_history, lanlan_name)
-        
-        # 在后台启动review_history任务
-        if lanlan_name in correction_tasks and not correction_tasks[lanlan_name].done():
-            # 如果已有任务在运行，取消它
-            correction_tasks[lanlan_name].cancel()
-            try:
-                await correction_tasks[lanlan_name]
-            except asyncio.CancelledError:
-                pass
-        
-        # 启动新的review任务
-        task = asyncio.create_task(_run_review_in_background(lanlan_name))
-        correction_tasks[lanlan_name] = task
-        
-        return {"status": "processed"}
+        try:
+            await time_manager.store_conversation(uid, input_history, lanlan_name)
+        except Exception as e:
+            logger.error(f"[MemoryServer] {lanlan_name} 写入时间索引失败: {e}", exc_info=True)
+
+    # 在后台启动review_history任务
+    await _restart_review(lanlan_name)
+
+async def _ingest_batch(lanlan_name: str, payloads: list):
+    """
+    处理写入队列合并后的一个批次：近期记忆只更新一次；时间索引的摘要与写入、review重启放到后台，
+    flush（/new_dialog 等读取接口）只等待近期记忆更新完成
+    """
+    input_history = [msg for messages, _ in payloads for msg in messages]
+    detailed = any(d for _, d in payloads)
+    await recent_history_manager.update_history(input_history, lanlan_name, detailed=detailed)
+    task = asyncio.create_task(_store_payloads(lanlan_name, payloads, _background_stores.get(lanlan_name)))
+    _background_stores[lanlan_name] = task
+
+    def _forget(done):
+        if _background_stores.get(lanlan_name) is done:
+            del _background_stores[lanlan_name]
+    task.add_done_callback(_forget)
+
+async def _wait_background_stores(timeout):
+    """等待后台的时间索引写入完成（关闭或替换记忆组件前调用）"""
+    tasks = list(_background_stores.values())
+    if tasks:
+        await asyncio.wait(tasks, timeout=timeout)
+
+ingest_queue = MemoryIngestQueue(_ingest_batch, debounce=MEMORY_INGEST_DEBOUNCE_SECONDS, max_delay=MEMORY_INGEST_MAX_DELAY_SECONDS)
+
+def _enqueue_history(request: HistoryRequest, lanlan_name: str, detailed: bool):
+    # 检查角色是否存在于配置中，如果不存在则记录信息但继续处理（允许新角色）
+    try:
+        character_data = _config_manager.load_characters()
+        catgirl_names = list(character_data.get('猫娘', {}).keys())
+        if lanlan_name not in catgirl_names:
+            logger.info(f"[MemoryServer] 角色 '{lanlan_name}' 不在配置中，但继续处理（可能是新创建的角色）")
+    except Exception as e:
+        logger.warning(f"检查角色配置失败: {e}，继续处理")
+    
+    input_history = convert_to_messages(json.loads(request.input_history))
+    depth = ingest_queue.enqueue(lanlan_name, input_history, detailed)
+    logger.info(f"[MemoryServer] 收到 {lanlan_name} 的对话历史处理请求，消息数: {len(input_history)}，排队请求数: {depth}")
+    return JSONResponse({"status": "queued", "queue_depth": depth}, status_code=202)
+
+@app.post("/process/{lanlan_name}")
+async def process_conversation(request: HistoryRequest, lanlan_name: str):
+    try:
+        return _enqueue_history(request, lanlan_name, detailed=False)
     except Exception as e:
         logger.error(f"处理对话历史失败: {e}")
         return {"status": "error", "message": str(e)}
 
 @app.post("/renew/{lanlan_name}")
 async def process_conversation_for_renew(request: HistoryRequest, lanlan_name: str):
-    global correction_tasks
     try:
-        # 检查角色是否存在于配置中，如果不存在则记录信息但继续处理（允许新角色）
-        try:
-            character_data = _config_manager.load_characters()
-            catgirl_names = list(character_data.get('猫娘', {}).keys())
-            if lanlan_name not in catgirl_names:
-                logger.info(f"[MemoryServer] renew: 角色 '{lanlan_name}' 不在配置中，但继续处理（可能是新创建的角色）")
-        except Exception as e:
-            logger.warning(f"检查角色配置失败: {e}，继续处理")
-        
-        uid = str(uuid4())
-        input_history = convert_to_messages(json.loads(request.input_history))
-        logger.info(f"[MemoryServer] renew: 收到 {lanlan_name} 的对话历史处理请求，消息数: {len(input_history)}")
-        await recent_history_manager.update_history(input_history, lanlan_name, detailed=True)
-        # await settings_manager.extract_and_update_settings(input_history, lanlan_name)
-        # await semantic_manager.store_conversation(uid, input_history, lanlan_name)
-        await time_manager.store_conversation(uid, input_history, lanlan_name)
-        
-        # 在后台启动review_history任务
-        if lanlan_name in correction_tasks and not correction_tasks[lanlan_name].done():
-            # 如果已有任务在运行，取消它
-            correction_tasks[lanlan_name].cancel()
-            try:
-                await correction_tasks[lanlan_name]
-            except asyncio.CancelledError:
-                pass
-        
-        # 启动新的review任务
-        task = asyncio.create_task(_run_review_in_background(lanlan_name))
-        correction_tasks[lanlan_name] = task
-        
-        return {"status": "processed"}
+        return _enqueue_history(request, lanlan_name, detailed=True)
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+@app.get("/ingest_status")
+def get_ingest_status():
+    """查看各角色写入队列的深度与延迟"""
+    return {
+        "debounce_seconds": ingest_queue.debounce,
+        "max_delay_seconds": ingest_queue.max_delay,
+        "characters": ingest_queue.status(),
+    }
+
+@app.post("/ingest_flush")
+async def flush_ingest_queue(lanlan_name: str = None):
+    """立即处理排队中的写入请求，不等待防抖窗口"""
+    await ingest_queue.flush(lanlan_name)
+    return {"status": "flushed"}
+
 @app.get("/get_recent_history/{lanlan_name}")
-def get_recent_history(lanlan_name: str):
+async def get_recent_history(lanlan_name: str):
     # 检查角色是否存在于配置中
     try:
         character_data = _config_manager.load_characters()
@@ -213,9 +287,11 @@ def get_recent_history(lanlan_name: str):
         logger.error(f"检查角色配置失败: {e}")
         return "开始聊天前，没有历史记录。\n"
     
+    # 先处理排队中的写入，保证刚结束的一轮对话包含在内
+    await ingest_queue.flush(lanlan_name)
     history = recent_history_manager.get_recent_history(lanlan_name)
     _, _, _, _, name_mapping, _, _, _, _, _ = _config_manager.get_character_data()
-    name_mapping['ai'] = lanlan_name
+    name_mapping = {**name_mapping, 'ai': lanlan_name}
     result = f"开始聊天前，{lanlan_name}又在脑海内整理了近期发生的事情。\n"
     for i in history:
         if i.type == 'system':
@@ -226,9 +302,34 @@ def get_recent_history(lanlan_name: str):
             result += f"{name_mapping[i.type]} | {joined}\n"
     return result
 
+@app.get("/cache_stats")
+def get_cache_stats():
+    """查看记忆缓存的命中情况，用于确认热路径上已不再读盘"""
+    return {
+        "recent_history": recent_history_manager.get_cache_stats(),
+        "compression": recent_history_manager.get_compression_stats(),
+        "embeddings": semantic_manager.get_embedding_stats(),
+        "llm_scheduler": llm_scheduler.status(),
+        "llm_clients": llm_clients.stats(),
+    }
+
 @app.get("/search_for_memory/{lanlan_name}/{query}")
-async def get_memory(query: str, lanlan_name:str):
-    return await semantic_manager.query(query, lanlan_name)
+async def get_memory(query: str, lanlan_name:str, fast: bool = False):
+    # fast=true 时只使用本地粗排结果，不调用LLM精排，适合对延迟敏感的调用方
+    return await semantic_manager.query(query, lanlan_name, fast=fast)
+
+@app.get("/search_by_timeframe/{lanlan_name}")
+async def get_memory_by_timeframe(lanlan_name: str, start: datetime, end: datetime):
+    """按时间范围回忆，优先使用月/周/日汇总，条数不随历史长度增长"""
+    if lanlan_name not in time_manager.engine:
+        return f"======{lanlan_name}尝试回忆=====\n{start} ~ {end}\n\n（无记录）"
+    entries = await time_manager.aretrieve_rollup_by_timeframe(lanlan_name, start, end)
+    labels = {'session': '会话', 'day': '日', 'week': '周', 'month': '月'}
+    results_text = "\n".join([
+        f"[{labels[level]} {entry_start:%Y-%m-%d %H:%M}] {summary}"
+        for level, entry_start, _, summary in entries
+    ])
+    return f"======{lanlan_name}尝试回忆=====\n{start} ~ {end}\n\n====={lanlan_name}的相关记忆=====\n{results_text}"
 
 @app.get("/get_settings/{lanlan_name}")
 def get_settings(lanlan_name: str):
@@ -246,6 +347,18 @@ def get_settings(lanlan_name: str):
     result = f"{lanlan_name}记得{json.dumps(settings_manager.get_settings(lanlan_name), ensure_ascii=False)}"
     return result
 
+@app.get("/export/{lanlan_name}")
+async def export_memory(lanlan_name: str):
+    """流式导出角色的全部记忆（gzip压缩的NDJSON归档，末行为校验清单），导入见 python -m memory.archive"""
+    # 先落盘排队中的写入，导出内容包含已收到的全部对话
+    await ingest_queue.flush(lanlan_name)
+    filename = f"{lanlan_name}-memory-{datetime.now():%Y%m%d-%H%M%S}.ndjson.gz"
+    return StreamingResponse(
+        archive.iter_archive_gzip(lanlan_name),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"},
+    )
+
 @app.post("/reload")
 async def reload_config():
     """重新加载记忆服务器配置（用于新角色创建后）"""
@@ -259,22 +372,52 @@ async def reload_config():
         logger.error(f"重新加载配置时出错: {e}", exc_info=True)
         return {"status": "error", "message": str(e)}
 
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+def _render_new_dialog(lanlan_name: str) -> str:
+    master_name, _, _, _, name_mapping, _, _, _, _, _ = _config_manager.get_character_data()
+    name_mapping = {**name_mapping, 'ai': lanlan_name}
+    result = f"\n========{lanlan_name}的内心活动========\n{lanlan_name}的脑海里经常想着自己和{master_name}的事情，她记得{json.dumps(settings_manager.get_settings(lanlan_name), ensure_ascii=False)}\n\n"
+    result += f"开始聊天前，{lanlan_name}又在脑海内整理了近期发生的事情。\n"
+    for i in recent_history_manager.get_recent_history(lanlan_name):
+        if type(i.content) == str:
+            cleaned_content = _BRACKETS_PATTERN.sub('', i.content).strip()
+            result += f"{name_mapping[i.type]} | {cleaned_content}\n"
+        else:
+            texts = [_BRACKETS_PATTERN.sub('', j['text']).strip() for j in i.content if j['type'] == 'text']
+            result += f"{name_mapping[i.type]} | " + "\n".join(texts) + "\n"
+    return result
+
 @app.get("/new_dialog/{lanlan_name}")
-async def new_dialog(lanlan_name: str):
+async def new_dialog(lanlan_name: str, request: Request):
     global correction_tasks, correction_cancel_flags
     
-    # 检查角色是否存在于配置中
-    try:
-        character_data = _config_manager.load_characters()
-        catgirl_names = list(character_data.get('猫娘', {}).keys())
-        if lanlan_name not in catgirl_names:
-            logger.warning(f"角色 '{lanlan_name}' 不在配置中，返回空上下文")
+    characters_stamp = _file_stamp(str(_config_manager.get_config_path('characters.json')))
+    cached = _new_dialog_cache.get(lanlan_name)
+    
+    # 检查角色是否存在于配置中（角色配置文件未变化且已有缓存时，说明角色存在，无需重新读取）
+    if not (cached and cached[0][2] == characters_stamp):
+        try:
+            character_data = _config_manager.load_characters()
+            catgirl_names = list(character_data.get('猫娘', {}).keys())
+            if lanlan_name not in catgirl_names:
+                logger.warning(f"角色 '{lanlan_name}' 不在配置中，返回空上下文")
+                _new_dialog_cache.pop(lanlan_name, None)
+                return ""
+        except Exception as e:
+            logger.error(f"检查角色配置失败: {e}")
             return ""
-    except Exception as e:
-        logger.error(f"检查角色配置失败: {e}")
-        return ""
+    
+    # 先处理排队中的写入：新会话/热切换的上下文必须包含刚结束的一轮对话
+    await ingest_queue.flush(lanlan_name)
     
     # 中断正在进行的correction任务
+    correction_pending.discard(lanlan_name)
     if lanlan_name in correction_tasks and not correction_tasks[lanlan_name].done():
         logger.info(f"🛑 收到new_dialog请求，中断 {lanlan_name} 的correction任务")
         
@@ -291,20 +434,24 @@ async def new_dialog(lanlan_name: str):
         except Exception as e:
             logger.warning(f"⚠️ 中断 {lanlan_name} 的correction任务时出现异常: {e}")
     
-    # 正则表达式：删除所有类型括号及其内容（包括[]、()、{}、<>、【】、（）等）
-    brackets_pattern = re.compile(r'(\[.*?\]|\(.*?\)|（.*?）|【.*?】|\{.*?\}|<.*?>)')
-    master_name, _, _, _, name_mapping, _, _, _, _, _ = _config_manager.get_character_data()
-    name_mapping['ai'] = lanlan_name
-    result = f"\n========{lanlan_name}的内心活动========\n{lanlan_name}的脑海里经常想着自己和{master_name}的事情，她记得{json.dumps(settings_manager.get_settings(lanlan_name), ensure_ascii=False)}\n\n"
-    result += f"开始聊天前，{lanlan_name}又在脑海内整理了近期发生的事情。\n"
-    for i in recent_history_manager.get_recent_history(lanlan_name):
-        if type(i.content) == str:
-            cleaned_content = brackets_pattern.sub('', i.content).strip()
-            result += f"{name_mapping[i.type]} | {cleaned_content}\n"
-        else:
-            texts = [brackets_pattern.sub('', j['text']).strip() for j in i.content if j['type'] == 'text']
-            result += f"{name_mapping[i.type]} | " + "\n".join(texts) + "\n"
-    return result
+    version_key = (
+        recent_history_manager.get_history_version(lanlan_name),
+        settings_manager.get_settings_version(lanlan_name),
+        characters_stamp,
+    )
+    if cached and cached[0] == version_key:
+        _, etag, result = cached
+    else:
+        result = _render_new_dialog(lanlan_name)
+        etag = '"' + hashlib.sha1(result.encode('utf-8')).hexdigest()[:16] + '"'
+        # 渲染过程中可能首次加载了历史记录，以渲染后的版本作为缓存键
+        version_key = (recent_history_manager.get_history_version(lanlan_name),) + version_key[1:]
+        _new_dialog_cache[lanlan_name] = (version_key, etag, result)
+    
+    # 调用方携带相同的ETag时，内容未变化，直接返回304跳过响应体
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(result, headers={"ETag": etag})
 
 if __name__ == "__main__":
     import threading
@@ -315,10 +462,16 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Memory Server')
     parser.add_argument('--enable-shutdown', action='store_true', 
                        help='启用响应退出请求功能（仅在终端用户环境使用）')
+    parser.add_argument('--ingest-debounce', type=float, default=MEMORY_INGEST_DEBOUNCE_SECONDS,
+                       help='记忆写入请求的合并窗口（秒）')
+    parser.add_argument('--ingest-max-delay', type=float, default=MEMORY_INGEST_MAX_DELAY_SECONDS,
+                       help='记忆写入请求的最长等待时间（秒）')
     args = parser.parse_args()
     
     # 设置全局变量
     enable_shutdown = args.enable_shutdown
+    ingest_queue.debounce = args.ingest_debounce
+    ingest_queue.max_delay = args.ingest_max_delay
     
     # 创建一个后台线程来监控关闭信号
     def monitor_shutdown():
@@ -168,6 +168,20 @@ function init_app(){
       );
     }
 
+    // 麦克风音频以二进制帧发送：4字节头 [帧类型=1][协议版本=1][保留2字节] + int16 PCM
+    // 浏览器的Int16Array均为小端序，与服务端约定一致
+    const AUDIO_FRAME_TYPE = 0x01;
+    const AUDIO_FRAME_VERSION = 1;
+    const AUDIO_FRAME_HEADER_SIZE = 4;
+
+    function encodeAudioFrame(pcmData) {
+        const frame = new Uint8Array(AUDIO_FRAME_HEADER_SIZE + pcmData.byteLength);
+        frame[0] = AUDIO_FRAME_TYPE;
+        frame[1] = AUDIO_FRAME_VERSION;
+        frame.set(new Uint8Array(pcmData.buffer, pcmData.byteOffset, pcmData.byteLength), AUDIO_FRAME_HEADER_SIZE);
+        return frame.buffer;
+    }
+
     // 建立WebSocket连接
     function connectWebSocket() {
         const protocol = window.location.protocol === "https:" ? "wss" : "ws";
@@ -1802,11 +1816,7 @@ function init_app(){
                 }
 
                 if (isRecording && socket.readyState === WebSocket.OPEN) {
-                    socket.send(JSON.stringify({
-                        action: 'stream_data',
-                        data: Array.from(audioData),
-                        input_type: 'audio'
-                    }));
+                    socket.send(encodeAudioFrame(audioData));
                 }
             };
 
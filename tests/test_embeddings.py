@@ -0,0 +1,53 @@
+import asyncio
+
+from memory.embeddings import CachedEmbeddings, EmbeddingCache
+
+
+class SlowEmbeddings:
+    model = 'fake'
+
+    def __init__(self):
+        self.requests = []
+        self.release = None
+
+    async def aembed_documents(self, texts):
+        self.requests.append(list(texts))
+        await self.release.wait()
+        return [[float(len(t)), 1.0] for t in texts]
+
+
+def test_text_requested_while_in_flight_shares_the_call(tmp_path):
+    embeddings = SlowEmbeddings()
+    cached = CachedEmbeddings(embeddings, EmbeddingCache(tmp_path / 'cache.db'), batch_window=0.001)
+
+    async def run():
+        embeddings.release = asyncio.Event()
+        first = asyncio.ensure_future(cached.aembed_query('你好'))
+        while not embeddings.requests:
+            await asyncio.sleep(0.001)
+        # 第一批已经发出但尚未返回时，再次请求同一文本
+        second = asyncio.ensure_future(cached.aembed_documents(['你好', '晚安']))
+        await asyncio.sleep(0.02)
+        embeddings.release.set()
+        return await first, await second
+
+    first, second = asyncio.run(run())
+    assert embeddings.requests == [['你好'], ['晚安']]
+    assert first == second[0] == [2.0, 1.0]
+    assert second[1] == [2.0, 1.0]
+    assert cached.api_calls == 2
+    assert cached._inflight == {}
+
+
+def test_cached_text_skips_the_api(tmp_path):
+    embeddings = SlowEmbeddings()
+    cached = CachedEmbeddings(embeddings, EmbeddingCache(tmp_path / 'cache.db'), batch_window=0.001)
+
+    async def run():
+        embeddings.release = asyncio.Event()
+        embeddings.release.set()
+        await cached.aembed_documents(['a', 'bb'])
+        return await cached.aembed_documents(['bb', 'a', 'bb'])
+
+    assert asyncio.run(run()) == [[2.0, 1.0], [1.0, 1.0], [2.0, 1.0]]
+    assert embeddings.requests == [['a', 'bb']]
@@ -0,0 +1,81 @@
+import json
+
+from utils.journal_store import JournalStore
+
+
+def test_append_then_reload_replays_journal(tmp_path):
+    path = tmp_path / 'recent_Neko.json'
+    store = JournalStore(path)
+    store.rewrite([{'n': 0}])
+    store.append([{'n': 1}, {'n': 2}])
+    store.append([{'n': 3}])
+
+    assert store.has_journal()
+    assert JournalStore(path).load() == [{'n': 0}, {'n': 1}, {'n': 2}, {'n': 3}]
+    # 快照本身保持原样，新元素只在日志里
+    assert json.loads(path.read_text(encoding='utf-8')) == [{'n': 0}]
+
+
+def test_journal_without_snapshot(tmp_path):
+    path = tmp_path / 'recent_Neko.json'
+    JournalStore(path).append(['a'])
+    assert not path.exists()
+    assert JournalStore(path).load() == ['a']
+
+
+def test_compact_merges_journal_into_snapshot(tmp_path):
+    path = tmp_path / 'recent_Neko.json'
+    store = JournalStore(path)
+    store.rewrite(['a'])
+    store.append(['b'])
+    store.compact()
+
+    assert not store.has_journal()
+    assert json.loads(path.read_text(encoding='utf-8')) == ['a', 'b']
+    assert store.load() == ['a', 'b']
+
+
+def test_auto_compact_after_compact_every_records(tmp_path):
+    path = tmp_path / 'recent_Neko.json'
+    store = JournalStore(path, compact_every=3)
+    for i in range(3):
+        store.append([i])
+
+    assert not store.has_journal()
+    assert json.loads(path.read_text(encoding='utf-8')) == [0, 1, 2]
+
+    # 合并后继续追加，新日志基于新快照
+    store.append([3])
+    assert store.has_journal()
+    assert JournalStore(path).load() == [0, 1, 2, 3]
+
+
+def test_stale_journal_is_discarded_when_snapshot_replaced(tmp_path):
+    path = tmp_path / 'recent_Neko.json'
+    store = JournalStore(path)
+    store.rewrite(['old'])
+    store.append(['from-journal'])
+
+    # 外部（例如前端编辑保存）整体替换快照
+    path.write_text(json.dumps(['edited', 'by', 'user']), encoding='utf-8')
+    assert JournalStore(path).load() == ['edited', 'by', 'user']
+
+    # 过期日志不会被续写，新追加的元素基于新快照回放
+    store.append(['new'])
+    assert JournalStore(path).load() == ['edited', 'by', 'user', 'new']
+
+
+def test_torn_tail_is_ignored_and_repaired_on_append(tmp_path):
+    path = tmp_path / 'recent_Neko.json'
+    store = JournalStore(path)
+    store.rewrite(['a'])
+    store.append(['b'])
+    # 模拟写到一半崩溃：最后一行没有换行
+    with open(store.journal_path, 'a', encoding='utf-8') as f:
+        f.write('{"items": ["tor')
+
+    assert JournalStore(path).load() == ['a', 'b']
+
+    reopened = JournalStore(path)
+    reopened.append(['c'])
+    assert JournalStore(path).load() == ['a', 'b', 'c']
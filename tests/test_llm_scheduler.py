@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+import httpx
+from openai import RateLimitError
+
+from memory.scheduler import LLMScheduler
+
+
+class _FakeLLM:
+    def __init__(self, endpoint, failures=0, retry_after='0.3'):
+        self.openai_api_base = endpoint
+        self.failures = failures
+        self.retry_after = retry_after
+
+    async def ainvoke(self, prompt):
+        if self.failures:
+            self.failures -= 1
+            request = httpx.Request('POST', self.openai_api_base)
+            response = httpx.Response(429, headers={'retry-after': self.retry_after}, request=request)
+            raise RateLimitError("rate limited", response=response, body=None)
+        return prompt
+
+
+def _timed(scheduler, llm, prompt):
+    async def call():
+        start = time.monotonic()
+        await scheduler.ainvoke(llm, prompt)
+        return time.monotonic() - start
+    return call()
+
+
+def test_bucket_delay_does_not_hold_a_slot():
+    scheduler = LLMScheduler(max_concurrency=1, rate=100, burst=1)
+
+    async def run():
+        scheduler._bucket('http://a').pause(0.5)
+        slow = asyncio.ensure_future(_timed(scheduler, _FakeLLM('http://a'), 'a'))
+        await asyncio.sleep(0)
+        fast = await _timed(scheduler, _FakeLLM('http://b'), 'b')
+        return fast, await slow
+
+    fast, slow = asyncio.run(run())
+    assert fast < 0.2
+    assert slow >= 0.45
+
+
+def test_rate_limit_backoff_releases_the_slot():
+    scheduler = LLMScheduler(max_concurrency=1, rate=100, burst=1)
+
+    async def run():
+        limited = asyncio.ensure_future(_timed(scheduler, _FakeLLM('http://a', failures=1), 'a'))
+        await asyncio.sleep(0.05)
+        fast = await _timed(scheduler, _FakeLLM('http://b'), 'b')
+        return fast, await limited
+
+    fast, limited = asyncio.run(run())
+    assert fast < 0.2
+    assert limited >= 0.25
+    assert scheduler.stats['rate_limited'] == 1 and scheduler._active == 0
+
+
+def test_interactive_call_gets_the_next_token_before_queued_background_calls():
+    scheduler = LLMScheduler(max_concurrency=4, rate=10, burst=1)
+    order = []
+
+    async def call(prompt, priority):
+        await scheduler.ainvoke(_FakeLLM('http://a'), prompt, priority=priority)
+        order.append(prompt)
+
+    async def run():
+        background = [asyncio.ensure_future(call(f'bg{i}', 2)) for i in range(4)]
+        await asyncio.sleep(0.01)
+        interactive = asyncio.ensure_future(call('interactive', 0))
+        await asyncio.gather(interactive, *background)
+
+    asyncio.run(run())
+    # 第一个后台请求用掉了积攒的令牌，下一个令牌给后到的交互请求
+    assert order[:2] == ['bg0', 'interactive']
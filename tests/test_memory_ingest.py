@@ -0,0 +1,21 @@
+import asyncio
+
+from memory.ingest import MemoryIngestQueue
+
+
+def test_batch_keeps_each_payload_and_its_detailed_flag():
+    batches = []
+
+    async def handler(lanlan_name, payloads):
+        batches.append((lanlan_name, payloads))
+
+    async def run():
+        ingest_queue = MemoryIngestQueue(handler, debounce=60, max_delay=60)
+        ingest_queue.enqueue('Neko', ['a1', 'a2'], False)
+        ingest_queue.enqueue('Neko', ['b1'], True)
+        await ingest_queue.flush('Neko')
+        return ingest_queue.status()['Neko']
+
+    status = asyncio.run(run())
+    assert batches == [('Neko', [(['a1', 'a2'], False), (['b1'], True)])]
+    assert status['payloads'] == 2 and status['messages'] == 3 and status['queue_depth'] == 0
@@ -0,0 +1,67 @@
+"""近期记忆在重启后的加载：首次合并之前，新角色只有追加日志、没有快照文件"""
+import os
+
+from langchain_core.messages import AIMessage, HumanMessage, messages_to_dict
+
+import memory.recent as recent
+from utils.journal_store import JournalStore
+
+
+class _FakeConfigManager:
+    def __init__(self, memory_dir, recent_log):
+        self.memory_dir = memory_dir
+        self._recent_log = recent_log
+
+    def get_character_data(self):
+        return None, None, None, None, {}, None, None, None, None, self._recent_log
+
+
+def _restart(monkeypatch, tmp_path, path):
+    monkeypatch.setattr(recent, 'get_config_manager', lambda: _FakeConfigManager(tmp_path, {'Neko': path}))
+    return recent.CompressedRecentHistoryManager()
+
+
+def test_journal_only_history_survives_restart(monkeypatch, tmp_path):
+    path = str(tmp_path / 'recent_Neko.json')
+    messages = [HumanMessage(content="早上好"), AIMessage(content="早上好喵")]
+    JournalStore(path).append(messages_to_dict(messages))
+    assert not os.path.exists(path)
+
+    manager = _restart(monkeypatch, tmp_path, path)
+
+    assert [m.content for m in manager.user_histories['Neko']] == ["早上好", "早上好喵"]
+
+
+def test_snapshot_and_journal_are_merged_on_restart(monkeypatch, tmp_path):
+    path = str(tmp_path / 'recent_Neko.json')
+    store = JournalStore(path)
+    store.rewrite(messages_to_dict([HumanMessage(content="一")]))
+    store.append(messages_to_dict([AIMessage(content="二")]))
+
+    manager = _restart(monkeypatch, tmp_path, path)
+
+    assert [m.content for m in manager.user_histories['Neko']] == ["一", "二"]
+
+
+def test_review_fingerprints_survive_restart(monkeypatch, tmp_path):
+    path = str(tmp_path / 'recent_Neko.json')
+    messages = [HumanMessage(content="一"), AIMessage(content="二")]
+    JournalStore(path).rewrite(messages_to_dict(messages))
+    manager = _restart(monkeypatch, tmp_path, path)
+    fingerprints = [manager._fingerprint(msg) for msg in manager.user_histories['Neko']]
+    manager._set_reviewed('Neko', fingerprints)
+
+    manager = _restart(monkeypatch, tmp_path, path)
+
+    assert manager._get_reviewed('Neko') == fingerprints
+
+
+def test_repeated_content_at_a_new_position_is_not_treated_as_reviewed():
+    prefix = recent.CompressedRecentHistoryManager._reviewed_prefix
+    reviewed = ['a', 'ok', 'b', 'ok']
+    # 新消息与已审阅的消息内容相同（复读）
+    assert prefix(reviewed, ['a', 'ok', 'b', 'ok', 'ok']) == 4
+    # 压缩移除了开头的消息
+    assert prefix(reviewed, ['b', 'ok', 'ok', 'c']) == 2
+    assert prefix(reviewed, ['x', 'ok']) == 0
+    assert prefix([], ['a']) == 0
@@ -0,0 +1,80 @@
+"""审阅结果与压缩并发时，历史记录的改写必须串行，不能互相覆盖"""
+import asyncio
+import json
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, messages_to_dict
+
+import memory.recent as recent
+import utils.config_manager
+from utils.journal_store import JournalStore
+
+
+class _FakeConfigManager:
+    def __init__(self, memory_dir, recent_log):
+        self.memory_dir = memory_dir
+        self._recent_log = recent_log
+
+    def get_character_data(self):
+        name_mapping = {'human': '主人', 'ai': 'Neko', 'system': 'SYSTEM_MESSAGE'}
+        return None, None, None, None, name_mapping, None, None, None, None, self._recent_log
+
+    def get_config_path(self, filename):
+        return self.memory_dir / filename
+
+    def ensure_memory_directory(self):
+        pass
+
+
+class _Response:
+    def __init__(self, content):
+        self.content = content
+
+
+def test_review_does_not_commit_while_compression_is_in_flight(monkeypatch, tmp_path):
+    path = str(tmp_path / 'recent_Neko.json')
+    JournalStore(path).rewrite(messages_to_dict([
+        HumanMessage(content="一"), AIMessage(content="二"), HumanMessage(content="三"),
+    ]))
+    config_manager = _FakeConfigManager(tmp_path, {'Neko': path})
+    monkeypatch.setattr(recent, 'get_config_manager', lambda: config_manager)
+    monkeypatch.setattr(utils.config_manager, 'get_config_manager', lambda: config_manager)
+    manager = recent.CompressedRecentHistoryManager(max_history_length=4)
+    monkeypatch.setattr(manager, '_get_review_llm', lambda: None)
+
+    review_go = asyncio.Event()
+    compress_go = asyncio.Event()
+
+    async def fake_ainvoke(llm, prompt, lanlan_name=None, priority=None):
+        await review_go.wait()
+        return _Response(json.dumps({
+            '修正说明': '合并',
+            '修正后的对话': [{'role': 'user', 'content': '修正后'}],
+        }, ensure_ascii=False))
+
+    async def fake_compress(messages, lanlan_name, detailed=False, priority=None):
+        await compress_go.wait()
+        return SystemMessage(content="先前对话的备忘录: 摘要"), "摘要"
+
+    monkeypatch.setattr(recent.llm_scheduler, 'ainvoke', fake_ainvoke)
+    monkeypatch.setattr(manager, 'compress_history', fake_compress)
+
+    async def run():
+        review = asyncio.ensure_future(manager.review_history('Neko'))
+        await asyncio.sleep(0.01)
+        update = asyncio.ensure_future(manager.update_history(
+            [AIMessage(content="四"), HumanMessage(content="五")], 'Neko'))
+        await asyncio.sleep(0.01)
+        # 压缩等待LLM期间审阅结果返回
+        review_go.set()
+        await asyncio.sleep(0.05)
+        compress_go.set()
+        await update
+        return await review
+
+    reviewed = asyncio.run(run())
+    history = [m.content for m in manager.user_histories['Neko']]
+    if reviewed:
+        assert "修正后" in history
+    else:
+        assert manager._get_reviewed('Neko') == []
+    assert history[0] == "先前对话的备忘录: 摘要"
@@ -0,0 +1,34 @@
+import asyncio
+import threading
+
+import pytest
+
+from memory.timeindex import SQLiteWriter
+
+
+def test_submit_after_close_raises():
+    writer = SQLiteWriter('test')
+    assert asyncio.run(writer.submit(lambda: 1)) == 1
+    writer.close()
+    with pytest.raises(RuntimeError):
+        asyncio.run(writer.submit(lambda: 2))
+
+
+def test_close_timeout_fails_queued_writes():
+    writer = SQLiteWriter('test')
+    release = threading.Event()
+
+    async def run():
+        blocked = asyncio.ensure_future(writer.submit(release.wait))
+        queued = asyncio.ensure_future(writer.submit(lambda: 'never'))
+        await asyncio.sleep(0.05)
+        await asyncio.to_thread(writer.close, 0.1)
+        # 超时后仍在队列中的写入以异常结束，而不是让调用方永久等待
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(queued, timeout=1)
+        release.set()
+        assert await asyncio.wait_for(blocked, timeout=1) is True
+
+    asyncio.run(run())
+    writer._thread.join(1)
+    assert not writer._thread.is_alive()
@@ -0,0 +1,33 @@
+import asyncio
+import json
+import os
+
+from memory.summary_cache import SummaryCache
+
+
+def test_puts_in_event_loop_are_saved_once_off_the_loop(tmp_path):
+    path = tmp_path / 'summary_cache_test.json'
+
+    async def run():
+        cache = SummaryCache(path, save_delay=0.05)
+        for i in range(5):
+            cache.put(f'k{i}', {'memo': str(i), 'summary': str(i)})
+        # 写入只标记为脏，不在事件循环中同步落盘
+        assert not os.path.exists(path)
+        await asyncio.sleep(0.3)
+
+    asyncio.run(run())
+    with open(path, encoding='utf-8') as f:
+        assert [key for key, _ in json.load(f)] == [f'k{i}' for i in range(5)]
+
+
+def test_flush_writes_pending_entries(tmp_path):
+    path = tmp_path / 'summary_cache_test.json'
+
+    async def run():
+        cache = SummaryCache(path, save_delay=60)
+        cache.put('k', {'memo': 'm', 'summary': 's'})
+        cache.flush()
+
+    asyncio.run(run())
+    assert SummaryCache(path).get('k') == {'memo': 'm', 'summary': 's'}
@@ -0,0 +1,37 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+import memory.timeindex as timeindex
+from config import TIME_ORIGINAL_TABLE_NAME, TIME_ROLLUP_TABLE_NAME
+
+
+def _tables(engine):
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type='table'"))}
+
+
+def _user_version(engine):
+    with engine.connect() as conn:
+        return conn.execute(text("PRAGMA user_version")).scalar()
+
+
+def test_migrate_creates_schema_and_is_idempotent(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'time_indexed'}")
+    assert timeindex.migrate(engine) == timeindex.SCHEMA_VERSION
+    assert timeindex.migrate(engine) == timeindex.SCHEMA_VERSION
+    assert {TIME_ORIGINAL_TABLE_NAME, TIME_ROLLUP_TABLE_NAME} <= _tables(engine)
+
+
+def test_failed_migration_rolls_back_every_step(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'time_indexed'}")
+
+    def broken_rollup(conn):
+        timeindex._create_rollup_table(conn)
+        raise RuntimeError("迁移中途失败")
+
+    monkeypatch.setattr(timeindex, 'MIGRATIONS', [timeindex.MIGRATIONS[0], broken_rollup])
+    with pytest.raises(RuntimeError):
+        timeindex.migrate(engine)
+
+    assert _tables(engine) == set()
+    assert _user_version(engine) == 0
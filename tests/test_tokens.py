@@ -0,0 +1,51 @@
+import asyncio
+import threading
+import time
+
+import memory.tokens as tokens
+
+
+def _reset(monkeypatch):
+    monkeypatch.setattr(tokens, '_encoding', None)
+    monkeypatch.setattr(tokens, '_encoding_failed', False)
+    monkeypatch.setattr(tokens, '_load_future', None)
+
+
+def test_no_download_without_local_cache(monkeypatch, tmp_path):
+    _reset(monkeypatch)
+    monkeypatch.setenv('TIKTOKEN_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(tokens, 'TOKEN_ENCODING_ALLOW_DOWNLOAD', False)
+
+    asyncio.run(tokens.ensure_encoding())
+
+    assert tokens._encoding is None
+    assert tokens.count_tokens("你好") == tokens.estimate_tokens("你好")
+
+
+def test_slow_load_does_not_block_the_event_loop(monkeypatch):
+    _reset(monkeypatch)
+    release = threading.Event()
+    monkeypatch.setattr(tokens, '_load_encoding', release.wait)
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.ensure_future(ticker())
+        start = time.monotonic()
+        await tokens.ensure_encoding(timeout=0.2)
+        elapsed = time.monotonic() - start
+        # 之后的调用不再等待
+        await tokens.ensure_encoding(timeout=0.2)
+        task.cancel()
+        release.set()
+        return elapsed, time.monotonic() - start, ticks
+
+    first, total, ticks = asyncio.run(run())
+    assert 0.15 < first < 1 and total - first < 0.05
+    assert ticks >= 10
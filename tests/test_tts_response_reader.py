@@ -0,0 +1,42 @@
+import asyncio
+import time
+from multiprocessing import Queue as MPQueue
+
+from main_helper.tts_helper import TTSResponseReader
+
+
+def test_clear_drops_frames_already_in_the_queue():
+    response_queue = MPQueue()
+
+    async def run():
+        reader = TTSResponseReader(response_queue).start()
+        try:
+            # 等后台线程进入阻塞读取（持有队列读锁）
+            await asyncio.sleep(0.1)
+            response_queue.put(b'old-1')
+            response_queue.put(b'old-2')
+            reader.clear()
+            response_queue.put(b'new')
+            return await asyncio.wait_for(reader.get(), timeout=2)
+        finally:
+            reader.stop()
+
+    assert asyncio.run(run()) == b'new'
+
+
+def test_frames_arrive_without_polling_delay():
+    response_queue = MPQueue()
+
+    async def run():
+        reader = TTSResponseReader(response_queue).start()
+        try:
+            await asyncio.sleep(0.1)
+            start = time.monotonic()
+            response_queue.put(b'frame')
+            data = await asyncio.wait_for(reader.get(), timeout=2)
+            return data, time.monotonic() - start
+        finally:
+            reader.stop()
+
+    data, elapsed = asyncio.run(run())
+    assert data == b'frame' and elapsed < 0.1
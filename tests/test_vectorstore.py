@@ -0,0 +1,109 @@
+"""本地向量库的持久化与崩溃恢复：记录原文是用户记忆，任何恢复路径都不能丢失"""
+import os
+
+import pytest
+
+import memory.vectorstore as vectorstore
+from memory.vectorstore import HashingEmbeddings, LocalVectorStore
+
+
+def _open(tmp_path, dim=16):
+    return LocalVectorStore(tmp_path, 'memory', HashingEmbeddings(dim))
+
+
+def _texts(store):
+    return [r['text'] for r in store._records]
+
+
+def test_rebuild_replaces_matrix_for_a_new_model(tmp_path):
+    _open(tmp_path, 16).add_texts(["早上好", "喜欢草莓"])
+
+    store = _open(tmp_path, 32)
+    assert store.similarity_search("草莓", k=1)[0].page_content == "喜欢草莓"
+
+    reopened = _open(tmp_path, 32)
+    assert _texts(reopened) == ["早上好", "喜欢草莓"]
+    assert reopened._meta == {'dim': 32, 'model': 'local-hashing-32'}
+    assert reopened._matrix_rows() == 2
+
+
+def test_failed_rebuild_keeps_records_and_old_matrix(tmp_path, monkeypatch):
+    _open(tmp_path, 16).add_texts(["早上好", "喜欢草莓"])
+
+    def fail_replace(src, dst):
+        raise OSError("模拟写入中途崩溃")
+
+    monkeypatch.setattr(vectorstore.os, 'replace', fail_replace)
+    with pytest.raises(OSError):
+        _open(tmp_path, 32).similarity_search("草莓")
+    monkeypatch.undo()
+
+    reopened = _open(tmp_path, 16)
+    assert _texts(reopened) == ["早上好", "喜欢草莓"]
+    assert reopened._matrix_rows() == 2
+    assert not reopened._needs_rebuild()
+    assert os.path.exists(reopened._records_path)
+
+
+def test_append_and_reload(tmp_path):
+    store = _open(tmp_path)
+    store.add_texts(["早上好"], metadatas=[{'event_id': 'e1'}])
+    store.add_texts(["喜欢草莓", "晚安"])
+
+    reopened = _open(tmp_path)
+    assert _texts(reopened) == ["早上好", "喜欢草莓", "晚安"]
+    assert reopened._matrix_rows() == 3
+    doc = reopened.similarity_search("草莓", k=1)[0]
+    assert doc.page_content == "喜欢草莓" and doc.metadata['id'] == 'memory-1'
+
+
+def test_missing_meta_keeps_records_and_reembeds(tmp_path):
+    _open(tmp_path).add_texts(["早上好", "喜欢草莓"])
+    os.remove(_open(tmp_path)._meta_path)
+
+    store = _open(tmp_path)
+    assert _texts(store) == ["早上好", "喜欢草莓"]
+    assert store._needs_rebuild()
+    assert store.similarity_search("草莓", k=1)[0].page_content == "喜欢草莓"
+
+    reopened = _open(tmp_path)
+    assert _texts(reopened) == ["早上好", "喜欢草莓"] and not reopened._needs_rebuild()
+
+
+def test_partial_append_drops_only_the_unfinished_record(tmp_path):
+    store = _open(tmp_path)
+    store.add_texts(["早上好", "喜欢草莓"])
+    # 模拟追加时崩溃：向量已写入，记录只写了一半
+    with open(store._matrix_path, 'ab') as f:
+        f.write(b'\0' * 16 * 4)
+    with open(store._records_path, 'a', encoding='utf-8') as f:
+        f.write('{"id": "memory-2", "te')
+
+    reopened = _open(tmp_path)
+    assert _texts(reopened) == ["早上好", "喜欢草莓"]
+    assert reopened._matrix_rows() == 2 and not reopened._needs_rebuild()
+    reopened.add_texts(["晚安"])
+    assert _texts(_open(tmp_path)) == ["早上好", "喜欢草莓", "晚安"]
+
+
+def test_extra_vector_rows_and_half_rows_are_truncated(tmp_path):
+    store = _open(tmp_path)
+    store.add_texts(["早上好"])
+    with open(store._matrix_path, 'ab') as f:
+        f.write(b'\0' * (16 * 4 + 10))
+
+    reopened = _open(tmp_path)
+    assert _texts(reopened) == ["早上好"]
+    assert os.path.getsize(reopened._matrix_path) == 16 * 4
+
+
+def test_fewer_vectors_than_records_reembeds_instead_of_truncating(tmp_path):
+    store = _open(tmp_path)
+    store.add_texts(["早上好", "喜欢草莓"])
+    with open(store._matrix_path, 'r+b') as f:
+        f.truncate(16 * 4)
+
+    reopened = _open(tmp_path)
+    assert _texts(reopened) == ["早上好", "喜欢草莓"] and reopened._needs_rebuild()
+    assert reopened.similarity_search("草莓", k=1)[0].page_content == "喜欢草莓"
+    assert _open(tmp_path)._matrix_rows() == 2
@@ -6,8 +6,146 @@ from openai import OpenAI
 import copy
 # from funasr import AutoModel
 import numpy as np
+import soxr
 #########
 
+
+class StreamingResampler:
+    """
+    TTS / 原生语音输出的流式重采样（默认 24kHz -> 48kHz，int16 单声道）。
+
+    每段语音（speech_id）持有一个有状态的 soxr.ResampleStream，相邻音频块共享滤波器状态，
+    块边界处不会产生咔哒声；int16 直接进出，不经过 float 往返。
+    soxr 会在内部保留少量尾部采样，语音结束时调用 flush() 取出。
+    """
+
+    def __init__(self, in_rate=24000, out_rate=48000, quality='HQ'):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.quality = quality
+        self._stream = None
+        self._stream_key = None
+
+    def resample(self, pcm, speech_id=None, in_rate=None) -> bytes:
+        """重采样一块 int16 PCM；speech_id 或采样率变化时丢弃旧状态，开始新的一段"""
+        return self.resample_samples(np.frombuffer(pcm, dtype=np.int16), speech_id, in_rate).tobytes()
+
+    def resample_samples(self, samples, speech_id=None, in_rate=None):
+        """同 resample，输入输出均为 int16 数组"""
+        in_rate = in_rate or self.in_rate
+        key = (speech_id, in_rate)
+        if self._stream is None or key != self._stream_key:
+            self._stream = soxr.ResampleStream(in_rate, self.out_rate, 1, dtype='int16', quality=self.quality)
+            self._stream_key = key
+        return self._stream.resample_chunk(samples)
+
+    def flush(self) -> bytes:
+        """当前语音结束：取出滤波器中剩余的采样，下一块音频将开始新的一段"""
+        return self.flush_samples().tobytes()
+
+    def flush_samples(self):
+        """同 flush，返回 int16 数组"""
+        if self._stream is None:
+            return np.zeros(0, dtype=np.int16)
+        tail = self._stream.resample_chunk(np.zeros(0, dtype=np.int16), last=True)
+        self.reset()
+        return tail
+
+    def reset(self):
+        """打断：直接丢弃当前语音的重采样状态"""
+        self._stream = None
+        self._stream_key = None
+
+
+class PCMRingBuffer:
+    """
+    int16 采样的环形缓冲区：预分配存储，写满时按倍数扩容。
+    读写只拷贝本次涉及的采样，与缓冲区中已有的数据量无关。
+    """
+
+    def __init__(self, capacity=48000):
+        self._buf = np.zeros(max(1, capacity), dtype=np.int16)
+        self._start = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def capacity(self):
+        return len(self._buf)
+
+    def _grow(self, needed):
+        capacity = len(self._buf)
+        while capacity < needed:
+            capacity *= 2
+        size = self._size
+        buf = np.zeros(capacity, dtype=np.int16)
+        self._read_into(buf[:size])
+        self._buf, self._start, self._size = buf, 0, size
+
+    def _read_into(self, out):
+        """把最早的 len(out) 个采样拷贝到 out 并移出缓冲区"""
+        n = len(out)
+        first = min(n, len(self._buf) - self._start)
+        out[:first] = self._buf[self._start:self._start + first]
+        out[first:] = self._buf[:n - first]
+        self._start = (self._start + n) % len(self._buf)
+        self._size -= n
+
+    def write(self, samples):
+        n = len(samples)
+        if not n:
+            return
+        if self._size + n > len(self._buf):
+            self._grow(self._size + n)
+        end = (self._start + self._size) % len(self._buf)
+        first = min(n, len(self._buf) - end)
+        self._buf[end:end + first] = samples[:first]
+        self._buf[:n - first] = samples[first:]
+        self._size += n
+
+    def read(self, n):
+        """取出最早的至多 n 个采样（新数组）"""
+        out = np.empty(min(n, self._size), dtype=np.int16)
+        self._read_into(out)
+        return out
+
+    def clear(self):
+        self._start = 0
+        self._size = 0
+
+
+class FramedResampler:
+    """
+    流式重采样后按固定帧长输出：每写入一个音频包，立即返回其中已凑满的 frame_samples 帧（bytes）。
+    语音结束时 finish() 取出重采样尾部与不足一帧的剩余数据。
+    """
+
+    def __init__(self, frame_samples, in_rate=24000, out_rate=48000, quality='HQ'):
+        self.frame_samples = frame_samples
+        self.resampler = StreamingResampler(in_rate, out_rate, quality)
+        self._ring = PCMRingBuffer(frame_samples * 2)
+
+    def feed(self, pcm, speech_id=None):
+        self._ring.write(self.resampler.resample_samples(np.frombuffer(pcm, dtype=np.int16), speech_id))
+        frames = []
+        while len(self._ring) >= self.frame_samples:
+            frames.append(self._ring.read(self.frame_samples).tobytes())
+        return frames
+
+    def finish(self):
+        self._ring.write(self.resampler.flush_samples())
+        frames = []
+        while len(self._ring):
+            frames.append(self._ring.read(self.frame_samples).tobytes())
+        return frames
+
+    def reset(self):
+        self.resampler.reset()
+        self._ring.clear()
+
+
 def make_wav_header(data_length, sample_rate, num_channels, sample_width):
     buffer = io.BytesIO()
     with wave.open(buffer, 'wb') as wf:
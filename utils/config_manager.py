@@ -8,6 +8,7 @@ import os
 import json
 import shutil
 import logging
+import threading
 from copy import deepcopy
 from pathlib import Path
 
@@ -30,6 +31,51 @@ from utils.api_config_loader import (
 logger = logging.getLogger(__name__)
 
 
+def _readonly(self, *args, **kwargs):
+    raise TypeError(f"{type(self).__name__} 是共享的只读配置快照，请先复制（dict()/list()/copy.deepcopy()）再修改")
+
+
+class FrozenDict(dict):
+    """只读dict：可直接序列化为JSON；copy()/deepcopy() 得到可修改的普通dict"""
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return {k: deepcopy(v, memo) for k, v in self.items()}
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+class FrozenList(list):
+    """只读list：可直接序列化为JSON；copy()/deepcopy() 得到可修改的普通list"""
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = pop = remove = clear = sort = reverse = _readonly
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return [deepcopy(v, memo) for v in self]
+
+    def __reduce__(self):
+        return FrozenList, (list(self),)
+
+
+def freeze(value):
+    """递归地把 dict/list 转为只读视图"""
+    if isinstance(value, dict):
+        return FrozenDict({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return FrozenList(freeze(v) for v in value)
+    if isinstance(value, tuple):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
 class ConfigManager:
     """配置文件管理器"""
     
@@ -50,6 +96,10 @@ class ConfigManager:
 
         self.project_config_dir = self._get_project_config_directory()
         self.project_memory_dir = self._get_project_memory_directory()
+
+        # 解析后的配置快照 {文件名: (文件戳, 快照)}，文件的路径/size/mtime变化或显式保存后才重新解析
+        self._snapshots = {}
+        self._snapshot_lock = threading.Lock()
     
     def _get_documents_directory(self):
         """获取用户文档目录（使用系统API）"""
@@ -324,6 +374,35 @@ class ConfigManager:
         # 都不存在，返回我的文档路径（用于创建新文件）
         return docs_config_path
     
+    def _config_file_stamp(self, filename):
+        path = str(self.get_config_path(filename))
+        try:
+            st = os.stat(path)
+        except OSError:
+            return path, None
+        return path, st.st_size, st.st_mtime_ns
+
+    def _cached_snapshot(self, filename, build):
+        """返回 build() 结果的只读快照，filename 对应的配置文件未变化时直接复用"""
+        # 先取文件戳再解析：解析期间文件被改写时，下次调用会因文件戳不同而重新解析
+        stamp = self._config_file_stamp(filename)
+        with self._snapshot_lock:
+            cached = self._snapshots.get(filename)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+        snapshot = freeze(build())
+        with self._snapshot_lock:
+            self._snapshots[filename] = (stamp, snapshot)
+        return snapshot
+
+    def invalidate_config_cache(self, filename=None):
+        """丢弃配置快照（filename为None时丢弃全部），下次读取时重新解析"""
+        with self._snapshot_lock:
+            if filename is None:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(filename, None)
+
     def migrate_config_files(self):
         """
         迁移配置文件到我的文档
@@ -435,6 +514,7 @@ class ConfigManager:
 
         with open(character_json_path, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
+        self.invalidate_config_cache('characters.json')
 
     # --- Voice storage helpers ---
 
@@ -552,7 +632,15 @@ class ConfigManager:
     # --- Character metadata helpers ---
 
     def get_character_data(self):
-        """获取角色基础数据及相关路径"""
+        """
+        获取角色基础数据及相关路径
+
+        返回进程内共享的只读快照，characters.json 未变化时不会重新读取；
+        需要修改时先复制，例如 dict(name_mapping)。
+        """
+        return self._cached_snapshot('characters.json', self._build_character_data)
+
+    def _build_character_data(self):
         character_data = self.load_characters()
         defaults = self.get_default_characters()
 
@@ -607,7 +695,14 @@ class ConfigManager:
     # --- Core config helpers ---
 
     def get_core_config(self):
-        """动态读取核心配置"""
+        """
+        动态读取核心配置
+
+        返回进程内共享的只读快照，core_config.json 未变化时不会重新解析。
+        """
+        return self._cached_snapshot('core_config.json', self._build_core_config)
+
+    def _build_core_config(self):
         # 从 config 模块导入所有默认配置值
         from config import (
             DEFAULT_CORE_API_KEY,
@@ -839,6 +934,8 @@ class ConfigManager:
         except Exception as e:
             print(f"Error saving {filename}: {e}", file=sys.stderr)
             raise
+        finally:
+            self.invalidate_config_cache(filename)
     
     def get_memory_path(self, filename):
         """
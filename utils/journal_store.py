@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+追加写日志(journal)存储引擎
+
+用于 recent_*.json 这类"整体是一个JSON列表、每轮只追加少量元素"的文件：
+- 快照文件（原 JSON 文件，格式不变）保存压缩后的完整列表
+- 旁路日志文件（<快照>.journal，NDJSON）只追加新元素，每轮写入量与新消息数成正比
+- 日志达到阈值后原子地合并回快照（临时文件 + os.replace），崩溃不会截断快照
+
+日志第一行记录它所基于的快照的 (size, mtime_ns)。若快照被外部整体替换
+（例如前端编辑保存），旧日志会因基准不匹配而被丢弃，不会重复回放。
+旧版本只有快照文件的数据无需任何迁移即可直接读取。
+"""
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_SUFFIX = '.journal'
+
+
+class JournalStore:
+    """JSON列表快照 + 追加写日志"""
+
+    def __init__(self, path, compact_every=64, compact_bytes=1024 * 1024):
+        """
+        Args:
+            path: 快照文件路径（即原 JSON 文件路径）
+            compact_every: 日志累计多少条追加记录后自动合并
+            compact_bytes: 日志超过多少字节后自动合并
+        """
+        self.path = str(path)
+        self.journal_path = self.path + JOURNAL_SUFFIX
+        self.compact_every = compact_every
+        self.compact_bytes = compact_bytes
+        self._journal_records = None  # 未知时为None，首次追加前统计
+
+    # --- 内部工具 ---
+
+    def _snapshot_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return [st.st_size, st.st_mtime_ns]
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        if not content.strip():
+            return []
+        data = json.loads(content)
+        return data if isinstance(data, list) else []
+
+    def _read_journal(self):
+        """回放日志，返回 (追加的元素列表, 有效记录数)。基准不匹配或文件不存在时返回空。"""
+        if not os.path.exists(self.journal_path):
+            return [], 0
+        items = []
+        records = 0
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            header_line = f.readline()
+            try:
+                header = json.loads(header_line)
+            except json.JSONDecodeError:
+                logger.warning(f"日志头损坏，忽略日志: {self.journal_path}")
+                return [], 0
+            if header.get('base') != self._snapshot_stamp():
+                logger.info(f"快照已被替换，丢弃过期日志: {self.journal_path}")
+                return [], 0
+            for line in f:
+                if not line.endswith('\n'):
+                    # 崩溃时写了一半的尾部记录，忽略
+                    logger.warning(f"日志尾部记录不完整，已忽略: {self.journal_path}")
+                    break
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"日志记录损坏，停止回放: {self.journal_path}")
+                    break
+                items.extend(record.get('items', []))
+                records += 1
+        return items, records
+
+    def _read_journal_header_base(self):
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                return json.loads(f.readline()).get('base')
+        except (OSError, json.JSONDecodeError, AttributeError):
+            return False
+
+    def _repair_tail(self):
+        """截掉崩溃遗留的不完整尾部，保证新记录从新行开始"""
+        size = os.path.getsize(self.journal_path)
+        if size == 0:
+            return
+        with open(self.journal_path, 'rb+') as f:
+            f.seek(size - 1)
+            if f.read(1) == b'\n':
+                return
+            f.seek(0)
+            data = f.read()
+            f.truncate(data.rfind(b'\n') + 1)
+
+    def _remove_journal(self):
+        try:
+            os.remove(self.journal_path)
+        except FileNotFoundError:
+            pass
+        self._journal_records = 0
+
+    # --- 公共接口 ---
+
+    def stamp(self):
+        """快照与日志的 (size, mtime_ns)，任一变化都意味着磁盘内容已改变"""
+        try:
+            st = os.stat(self.journal_path)
+            journal_stamp = [st.st_size, st.st_mtime_ns]
+        except FileNotFoundError:
+            journal_stamp = None
+        return self._snapshot_stamp(), journal_stamp
+
+    def has_journal(self):
+        """是否存在尚未合并进快照的日志"""
+        return os.path.exists(self.journal_path)
+
+    def load(self):
+        """读取完整列表（快照 + 日志回放）"""
+        items = self._read_snapshot()
+        journal_items, records = self._read_journal()
+        self._journal_records = records
+        items.extend(journal_items)
+        return items
+
+    def append(self, items):
+        """把新元素追加到日志，写入量只与新元素数量有关"""
+        if not items:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        if os.path.exists(self.journal_path):
+            if self._read_journal_header_base() != self._snapshot_stamp():
+                # 过期日志不可再追加，否则新记录也会被一并丢弃
+                self._remove_journal()
+            else:
+                self._repair_tail()
+        if not os.path.exists(self.journal_path):
+            with open(self.journal_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'base': self._snapshot_stamp()}) + '\n')
+            self._journal_records = 0
+        elif self._journal_records is None:
+            self._journal_records = self._read_journal()[1]
+
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'items': list(items)}, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_records += 1
+
+        if self._journal_records >= self.compact_every or os.path.getsize(self.journal_path) >= self.compact_bytes:
+            self.compact()
+
+    def rewrite(self, items):
+        """原子地整体替换快照，并清空日志"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(list(items), f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        # 若在此处崩溃，遗留日志的基准与新快照不匹配，下次读取时自动丢弃
+        self._remove_journal()
+
+    def compact(self):
+        """把日志合并回快照"""
+        if not os.path.exists(self.journal_path):
+            return
+        items = self.load()
+        self.rewrite(items)
+        logger.info(f"日志已合并到快照: {self.path}（共 {len(items)} 条）")
@@ -176,6 +176,7 @@ from multiprocessing import Process, Queue as MPQueue
 from uuid import uuid4
 import numpy as np
 import httpx 
+from utils.audio import StreamingResampler
 import websockets
 import time
 from enum import Enum
@@ -190,12 +191,12 @@ class SessionMode(Enum):
 
 async def tts_audio_worker(in_queue: MPQueue, out_queue: MPQueue):
     """
-    异步音频处理协程：从 in_queue 读取 24kHz PCM（int16 LE），重复采样为 48kHz 后写入 out_queue。
-    收到 None 作为哨兵值时退出。为兼容 multiprocessing，进程入口见 _tts_audio_worker_entry。
+    异步音频处理协程：从 in_queue 读取 24kHz PCM（int16 LE），流式重采样为 48kHz 后写入 out_queue。
+    收到 None 作为哨兵值时输出重采样尾部并退出。为兼容 multiprocessing，进程入口见 _tts_audio_worker_entry。
     """
-    import numpy as _np
     import asyncio as _asyncio
     loop = _asyncio.get_running_loop()
+    resampler = StreamingResampler()
     
     # 使用批量处理减少进程间通信开销
     batch_size = 4  # 批量处理的音频块数量
@@ -209,7 +210,10 @@ async def tts_audio_worker(in_queue: MPQueue, out_queue: MPQueue):
             if audio_bytes is None:
                 # 处理剩余的批
                 if audio_batch:
-                    await _process_audio_batch(audio_batch, out_queue, loop)
+                    await _process_audio_batch(audio_batch, out_queue, loop, resampler)
+                tail = resampler.flush()
+                if tail:
+                    await loop.run_in_executor(None, out_queue.put, tail)
                 # 透传一个 None 给发送协程（_start_audio_sender），帮助其尽快结束
                 await loop.run_in_executor(None, out_queue.put, None)
                 break
@@ -219,7 +223,7 @@ async def tts_audio_worker(in_queue: MPQueue, out_queue: MPQueue):
             
             # 当收集到足够的音频块或队列为空时处理批次
             if len(audio_batch) >= batch_size or in_queue.empty():
-                await _process_audio_batch(audio_batch, out_queue, loop)
+                await _process_audio_batch(audio_batch, out_queue, loop, resampler)
                 audio_batch = []
         except Exception as e:
             # 处理异常，确保工作进程不会崩溃
@@ -233,21 +237,17 @@ async def tts_audio_worker(in_queue: MPQueue, out_queue: MPQueue):
                     pass
                 audio_batch = []
 
-async def _process_audio_batch(audio_batch, out_queue, loop):
+async def _process_audio_batch(audio_batch, out_queue, loop, resampler):
     """批量处理音频数据"""
     try:
-        import numpy as _np
-        
         # 将多个音频块合并为一个批次处理
         all_bytes = b''.join(audio_batch)
-        audio_array = _np.frombuffer(all_bytes, dtype=_np.int16)
         
-        # 使用更高效的重采样方法（线性插值）
-        # 24kHz -> 48kHz，采样率翻倍
-        # 注意：这里使用简单重复作为基础，后续可以优化为更复杂的插值方法
-        resampled = _np.repeat(audio_array, 2)
+        # 24kHz -> 48kHz，流式重采样，批次之间共享滤波器状态
+        resampled = resampler.resample(all_bytes)
         
-        await loop.run_in_executor(None, out_queue.put, resampled.tobytes())
+        if resampled:
+            await loop.run_in_executor(None, out_queue.put, resampled)
     except Exception:
         # 处理失败则分别退回原始数据，避免中断播放链路
         for audio_bytes in audio_batch:
@@ -621,6 +621,7 @@ class LLMSessionManager:
         self.tts_handler_task = None  # TTS消息处理任务
         self.lock = asyncio.Lock()  # 使用异步锁替代同步锁
         self.current_speech_id = None
+        self.audio_resampler = StreamingResampler()  # 原生语音输出的流式重采样（不使用TTS时）
         self.emoji_pattern = re.compile(r'[^\w\u4e00-\u9fff\s>][^\w\u4e00-\u9fff\s]{2,}[^\w\u4e00-\u9fff\s<]', flags=re.UNICODE)
         self.emoji_pattern2 = re.compile("["
         u"\U0001F600-\U0001F64F"  # emoticons
@@ -791,12 +792,10 @@ class LLMSessionManager:
         """Qwen音频回调：推送音频到WebSocket前端"""
         if not self.use_tts:
             if self.websocket and hasattr(self.websocket, 'client_state') and self.websocket.client_state == self.websocket.client_state.CONNECTED:
-                # 这里假设audio_data为PCM16字节流，直接推送
-                audio = np.frombuffer(audio_data, dtype=np.int16)
-                # 使用简单的重复采样，将 24kHz 转为 48kHz
-                audio = np.repeat(audio, 2)
-
-                await self.send_speech(audio.tobytes())
+                # 这里假设audio_data为PCM16字节流，流式重采样 24kHz -> 48kHz 后推送
+                audio = self.audio_resampler.resample(audio_data, self.current_speech_id)
+                if audio:
+                    await self.send_speech(audio)
                 # 你可以根据需要加上格式、isNewMessage等标记
                 # await self.websocket.send_json({"type": "cozy_audio", "format": "blob", "isNewMessage": True})
             else:
@@ -1231,7 +1230,11 @@ class LLMSessionManager:
         try:
             if input_type == 'audio':
                 try:
-                    if isinstance(data, list):
+                    if isinstance(data, (bytes, bytearray, memoryview)):
+                        # 二进制帧：已是小端int16 PCM，直接转发
+                        await self.session.stream_audio(data)
+                    elif isinstance(data, list):
+                        # 兼容旧的JSON整数数组格式
                         audio_bytes = struct.pack(f'<{len(data)}h', *data)
                         await self.session.stream_audio(audio_bytes)
                     else: